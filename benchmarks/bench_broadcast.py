@@ -0,0 +1,186 @@
+"""Benchmark of broadcasts to all players.
+
+Fills the fake database with synthetic players, some of whom blocked
+the bot in the fake Bot API, and reports:
+
+    `recipients` - seconds and peak traced memory to read all recipients:
+        `naive` loads every player with `AsyncPlayerDao`-like `Player`
+        objects, `stream` is `Broadcaster.iter_recipients` fetching ids;
+    `send` - messages per second to the fake Bot API answering every call
+        after `--latency` seconds: `naive` awaits every send in a loop over
+        the first `--naive-sends` players, `pool` is `Broadcaster` with
+        `--workers` workers and no rate limit;
+    `resume` - the broadcast is stopped half way and resumed by another
+        broadcaster: players sent to twice and never, blocked players
+        recorded and recipients of the next broadcast.
+
+Usage:
+
+    python benchmarks/bench_broadcast.py [--players 1000000] [--workers 64]
+
+"""
+import argparse
+import asyncio
+import random
+import time
+import tracemalloc
+from typing import Tuple
+
+from fakes import FakeBotApi, FakeDatabase, configure_environment
+
+configure_environment()
+
+from aiogram import Bot  # noqa: E402
+from aiogram.client.session.aiohttp import AiohttpSession  # noqa: E402
+from aiogram.client.telegram import TelegramAPIServer  # noqa: E402
+
+from broadcast import Broadcaster  # noqa: E402
+from config import BOT_TOKEN  # noqa: E402
+from dao import (  # noqa: E402
+    AsyncBlockedPlayerDao,
+    AsyncBroadcastDao,
+    AsyncPlayerDao,
+    document_to_player,
+)
+from models import Broadcast  # noqa: E402
+
+TEXT = "Новые события в игре! /play"
+
+
+def fill_players(database: FakeDatabase, players: int, seed: int):
+    """Adds players with a few guessed events bypassing the fake's copies."""
+    rng = random.Random(seed)
+    documents = database[AsyncPlayerDao.collection_name].documents
+    for player_id in range(1, players + 1):
+        documents[player_id] = {
+            "_id": player_id,
+            "current_event": None,
+            "guessed_events": rng.sample(range(10000), 20),
+            "attempts": 0,
+            "score": rng.randrange(1000),
+        }
+
+
+async def read_naive(database: FakeDatabase) -> int:
+    collection = database[AsyncPlayerDao.collection_name]
+    players = [
+        document_to_player(document) async for document in collection.find()
+    ]
+    return len(players)
+
+
+async def read_stream(broadcaster: Broadcaster) -> int:
+    count = 0
+    async for _ in broadcaster.iter_recipients(Broadcast(None, TEXT)):
+        count += 1
+    return count
+
+
+async def measure(read) -> Tuple[float, float, int]:
+    """Returns seconds, peak memory in MB and the result of the read."""
+    tracemalloc.start()
+    start = time.perf_counter()
+    count = await read
+    elapsed = time.perf_counter() - start
+    peak = tracemalloc.get_traced_memory()[1] / 2**20
+    tracemalloc.stop()
+    return elapsed, peak, count
+
+
+def make_broadcaster(bot: Bot, database: FakeDatabase, workers: int):
+    return Broadcaster(
+        bot,
+        AsyncBroadcastDao(database),
+        AsyncPlayerDao(database),
+        AsyncBlockedPlayerDao(database),
+        rate=0,
+        workers=workers,
+        checkpoint_interval=1,
+        lease=1,
+    )
+
+
+async def bench(args):
+    api = FakeBotApi(latency=args.latency)
+    rng = random.Random(args.seed)
+    api.blocked = {
+        player_id
+        for player_id in range(1, args.players + 1)
+        if rng.random() < args.blocked
+    }
+    base_url = await api.start()
+    session = AiohttpSession(api=TelegramAPIServer.from_base(base_url))
+    bot = Bot(BOT_TOKEN, session=session)
+    database = FakeDatabase()
+    fill_players(database, args.players, args.seed)
+
+    print(f"{'recipients':<10} {'reader':>7} {'seconds':>8} {'peak MB':>8}")
+    naive = await measure(read_naive(database))
+    broadcaster = make_broadcaster(bot, database, args.workers)
+    stream = await measure(read_stream(broadcaster))
+    for name, (elapsed, peak, _) in (("naive", naive), ("stream", stream)):
+        print(f"{args.players:<10} {name:>7} {elapsed:>8.2f} {peak:>8.1f}")
+
+    print(f"\n{'send':<10} {'sender':>7} {'messages':>9} {'msg/s':>8}")
+    start = time.perf_counter()
+    for player_id in range(1, args.naive_sends + 1):
+        try:
+            await bot.send_message(player_id, TEXT)
+        except Exception:
+            pass
+    naive_rate = args.naive_sends / (time.perf_counter() - start)
+    print(f"{'':<10} {'naive':>7} {args.naive_sends:>9} {naive_rate:>8.0f}")
+    api.sent.clear()
+
+    # Stop the broadcast half way and resume it with another broadcaster
+    finished = asyncio.Event()
+
+    async def on_finish(broadcast: Broadcast):
+        finished.set()
+
+    start = time.perf_counter()
+    broadcast = await broadcaster.broadcast(TEXT)
+    while len(api.sent) < args.players // 2:
+        await asyncio.sleep(0.1)
+    await broadcaster.stop()
+    stopped_after = broadcast.last_id
+    resumed = make_broadcaster(bot, database, args.workers)
+    resumed.owner += ":resumed"
+    resumed.start(on_finish)
+    await finished.wait()
+    elapsed = time.perf_counter() - start
+    await resumed.stop()
+    messages = sum(len(texts) for texts in api.sent.values())
+    print(f"{'':<10} {'pool':>7} {messages:>9} {messages / elapsed:>8.0f}")
+
+    twice = sum(1 for texts in api.sent.values() if len(texts) > 1)
+    never = args.players - len(api.blocked) - len(api.sent)
+    recorded = len(database[AsyncBlockedPlayerDao.collection_name].documents)
+    next_recipients = await read_stream(resumed)
+    print(
+        f"\nresume after player {stopped_after}: sent twice {twice}, "
+        f"never {never}; blocked {len(api.blocked)}, recorded {recorded}; "
+        f"next broadcast recipients {next_recipients}"
+    )
+    await session.close()
+    await api.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--players", type=int, default=1000000)
+    parser.add_argument(
+        "--blocked", type=float, default=0.05, help="share of blocked chats"
+    )
+    parser.add_argument("--workers", type=int, default=64)
+    parser.add_argument(
+        "--latency", type=float, default=0.05, help="seconds per API call"
+    )
+    parser.add_argument("--naive-sends", type=int, default=200)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    asyncio.run(bench(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,120 @@
+"""Simulation of duel matchmaking with tens of thousands of players.
+
+Players with random scores join the queue over simulated time, some of
+them leave it with `/cancel` and the rest wait until they are paired or
+their wait times out. Compares `Matchmaker` with a naive queue which scans
+all waiting players for the closest score on every join.
+
+Usage:
+
+    python benchmarks/bench_duel.py [--players 10000 50000]
+
+"""
+import argparse
+import random
+import time
+from typing import Dict, Optional
+
+from fakes import configure_environment
+
+configure_environment()
+
+from duel import Matchmaker  # noqa: E402
+
+
+class NaiveMatchmaker:
+    """The straightforward queue: a dictionary scanned on every join."""
+
+    def __init__(self, max_gap: int, timeout: float):
+        self.max_gap = max_gap
+        self.timeout = timeout
+        self.waiting: Dict[int, tuple] = {}
+
+    def add(self, player_id: int, score: int, now: float) -> Optional[int]:
+        best = None
+        for other_id, (other_score, _) in self.waiting.items():
+            gap = abs(other_score - score)
+            if gap <= self.max_gap and (best is None or gap < best[0]):
+                best = (gap, other_id)
+        if best is not None:
+            del self.waiting[best[1]]
+            return best[1]
+        self.waiting[player_id] = (score, now)
+        return None
+
+    def remove(self, player_id: int) -> bool:
+        return self.waiting.pop(player_id, None) is not None
+
+    def expire(self, now: float):
+        expired = [
+            player_id
+            for player_id, (_, joined_at) in self.waiting.items()
+            if now - joined_at >= self.timeout
+        ]
+        for player_id in expired:
+            del self.waiting[player_id]
+        return expired
+
+
+def simulate(matchmaker, players: int, seed: int) -> dict:
+    """Runs the simulation of joins spread over 60 seconds."""
+    rng = random.Random(seed)
+    joins = sorted(rng.uniform(0, 60) for _ in range(players))
+    matches = cancels = expired = peak = 0
+    start = time.perf_counter()
+    next_expire = 0.0
+    for player_id, now in enumerate(joins):
+        if now >= next_expire:
+            expired += len(matchmaker.expire(now))
+            next_expire = now + 1
+        score = int(rng.gauss(1000, 800))
+        if matchmaker.add(player_id, score, now) is not None:
+            matches += 1
+        elif rng.random() < 0.1:
+            cancels += matchmaker.remove(player_id)
+        peak = max(peak, len(matchmaker.waiting))
+    elapsed = time.perf_counter() - start
+    return {
+        "us_per_join": elapsed / players * 1e6,
+        "matches": matches,
+        "cancels": cancels,
+        "expired": expired,
+        "peak_waiting": peak,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        "--players", type=int, nargs="+", default=[1000, 10000, 50000]
+    )
+    parser.add_argument("--max-gap", type=int, default=2)
+    parser.add_argument("--timeout", type=float, default=30)
+    parser.add_argument(
+        "--naive-limit",
+        type=int,
+        default=10000,
+        help="skip the naive queue for more players (it is quadratic)",
+    )
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    print(
+        f"{'players':>8} {'queue':>8} {'us/join':>9} {'matches':>8} "
+        f"{'cancels':>8} {'expired':>8} {'peak waiting':>13}"
+    )
+    for players in args.players:
+        queues = {"sorted": Matchmaker(args.max_gap, args.timeout)}
+        if players <= args.naive_limit:
+            queues["naive"] = NaiveMatchmaker(args.max_gap, args.timeout)
+        for name, matchmaker in queues.items():
+            result = simulate(matchmaker, players, args.seed)
+            print(
+                f"{players:>8} {name:>8} {result['us_per_join']:>9.2f} "
+                f"{result['matches']:>8} {result['cancels']:>8} "
+                f"{result['expired']:>8} {result['peak_waiting']:>13}"
+            )
+
+
+if __name__ == "__main__":
+    main()
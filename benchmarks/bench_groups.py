@@ -0,0 +1,133 @@
+"""Benchmark of group chat rounds against independent private rounds.
+
+`--members` players guess `--guesses` years per round, `--rounds` times, at
+`--rate` guesses per second, and the last guess of a round is right. Every
+guess goes through the real `Dispatcher` from `bot.py`:
+
+    `private` - the messages are sent to private chats, so every member
+        plays its own round of `/play` and gets an answer to every guess,
+        which is what a group chat got before group rounds;
+    `group` - the messages are sent to one group chat playing one round,
+        wrong guesses are summarized once per `--hint-interval` seconds.
+
+Reports the Bot API calls and the database operations per guess.
+
+Usage:
+
+    python benchmarks/bench_groups.py [--members 50] [--guesses 200]
+
+"""
+import argparse
+import asyncio
+import itertools
+import os
+import random
+import time
+
+from fakes import (
+    FakeBotApi,
+    FakeDatabase,
+    configure_environment,
+    make_message_update,
+)
+
+configure_environment()
+
+GROUP_CHAT_ID = -1001
+
+
+async def play(args, mode: str) -> dict:
+    from aiogram import Bot
+    from aiogram.client.session.aiohttp import AiohttpSession
+    from aiogram.client.telegram import TelegramAPIServer
+
+    import bot as bot_module
+    from config import BOT_TOKEN
+
+    api = FakeBotApi()
+    base_url = await api.start()
+    session = AiohttpSession(api=TelegramAPIServer.from_base(base_url))
+    bot = bot_module.bot = Bot(BOT_TOKEN, session=session)
+    database = FakeDatabase()
+    rng = random.Random(args.seed)
+    update_ids = itertools.count(1)
+    chat_id = GROUP_CHAT_ID if mode == "group" else None
+    members = range(1, args.members + 1)
+
+    async def send(player_id: int, text: str):
+        update = make_message_update(
+            next(update_ids), player_id, text, chat_id
+        )
+        await bot_module.dp.feed_raw_update(bot, update)
+
+    async with bot_module.setup_game(database, warm_up_images=False) as game:
+        await game.wait_for_events()
+        await game.wait_for_leaderboard()
+        api.calls.clear()
+        database.ops.clear()
+        start = time.perf_counter()
+        for _ in range(args.rounds):
+            if mode == "group":
+                await send(members[0], "/play")
+            else:
+                for player_id in members:
+                    await send(player_id, "/play")
+            for guess in range(args.guesses):
+                player_id = rng.choice(members)
+                if mode == "group":
+                    event_id = game.groups.get(GROUP_CHAT_ID).event_id
+                else:
+                    event_id = game.players.peek(player_id).current_event
+                date = game.events[event_id].date
+                if guess < args.guesses - 1:
+                    date += rng.choice((-1, 1)) * rng.randint(1, 100)
+                    date = date if 0 <= date <= 2023 else 2023 - date % 2
+                await send(player_id, str(date))
+                await asyncio.sleep(1 / args.rate)
+        elapsed = time.perf_counter() - start
+    await session.close()
+    await api.stop()
+    guesses = args.rounds * args.guesses
+    return {
+        "seconds": elapsed,
+        "api_calls": sum(api.calls.values()) / guesses,
+        "db_ops": sum(database.ops.values()) / guesses,
+        "db_writes": sum(
+            count
+            for name, count in database.ops.items()
+            if "write" in name or "update" in name or "insert" in name
+        )
+        / guesses,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--members", type=int, default=50)
+    parser.add_argument("--guesses", type=int, default=200)
+    parser.add_argument("--rounds", type=int, default=3)
+    parser.add_argument(
+        "--rate", type=float, default=200, help="guesses per second"
+    )
+    parser.add_argument("--hint-interval", type=float, default=0.5)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    os.environ["GROUP_HINT_INTERVAL"] = str(args.hint_interval)
+    # Measure the calls, not the flood limits
+    os.environ["SEND_GLOBAL_RATE"] = "0"
+
+    print(
+        f"{'mode':<8} {'seconds':>8} {'API calls/guess':>16} "
+        f"{'DB ops/guess':>13} {'DB writes/guess':>16}"
+    )
+    for mode in ("private", "group"):
+        result = asyncio.run(play(args, mode))
+        print(
+            f"{mode:<8} {result['seconds']:>8.2f} "
+            f"{result['api_calls']:>16.3f} {result['db_ops']:>13.3f} "
+            f"{result['db_writes']:>16.3f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,112 @@
+"""Benchmark of the event images optimization.
+
+Copies `res/images/` `--copies` times into a temporary directory (every
+copy gets distinct content) and runs `image_pipeline.optimize_images` into
+a temporary cache:
+
+    `cold` - nothing is cached, with one process and with all CPUs;
+    `warm` - no image changed;
+    `touched` - one image got a new modification time but the same content;
+    `changed` - one image changed.
+
+Then uploads the original and the optimized images to the fake Bot API and
+reports the uploaded bytes and the seconds to upload them at `--uplink`
+megabits per second.
+
+Usage:
+
+    python benchmarks/bench_images.py [--copies 10] [--uplink 20]
+
+"""
+import argparse
+import asyncio
+import os
+import tempfile
+import time
+
+from fakes import FakeBotApi, configure_environment
+
+configure_environment()
+
+from aiogram import Bot  # noqa: E402
+from aiogram.client.session.aiohttp import AiohttpSession  # noqa: E402
+from aiogram.client.telegram import TelegramAPIServer  # noqa: E402
+from aiogram.types import FSInputFile  # noqa: E402
+
+from config import BASE_PATH, BOT_TOKEN, RESOURCES_PATH  # noqa: E402
+from image_pipeline import find_images, optimize_images  # noqa: E402
+
+
+def copy_images(directory: str, copies: int):
+    source = os.path.join(RESOURCES_PATH, "images")
+    for copy in range(copies):
+        for name in os.listdir(source):
+            with open(os.path.join(source, name), "rb") as file:
+                data = file.read()
+            # Bytes after the end of a JPEG are ignored by decoders
+            target = os.path.join(directory, f"{copy}-{name}")
+            with open(target, "wb") as file:
+                file.write(data + copy.to_bytes(4, "big"))
+
+
+def run(name: str, paths, cache_path: str, jobs: int = None):
+    start = time.perf_counter()
+    images = optimize_images(paths, cache_path, jobs=jobs)
+    elapsed = time.perf_counter() - start
+    processed = sum(image.status == "optimized" for image in images)
+    jobs = jobs or os.cpu_count()
+    print(f"{name:<8} {jobs:>4} {elapsed:>8.2f} {processed:>9}")
+    return images
+
+
+async def upload(paths, uplink: float):
+    api = FakeBotApi()
+    base_url = await api.start()
+    session = AiohttpSession(api=TelegramAPIServer.from_base(base_url))
+    bot = Bot(BOT_TOKEN, session=session)
+    for path in paths:
+        await bot.send_photo(1, FSInputFile(path))
+    await session.close()
+    await api.stop()
+    return api.uploaded_bytes, api.uploaded_bytes * 8 / (uplink * 10**6)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--copies", type=int, default=10)
+    parser.add_argument(
+        "--uplink", type=float, default=20, help="upload megabits per second"
+    )
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        sources = os.path.join(directory, "images")
+        os.makedirs(sources)
+        copy_images(sources, args.copies)
+        paths = find_images(sources)
+        print(f"{len(paths)} images\n")
+        print(f"{'run':<8} {'jobs':>4} {'seconds':>8} {'processed':>9}")
+        for jobs in (1, None):
+            cache_path = os.path.join(directory, f"cache-{jobs}")
+            images = run("cold", paths, cache_path, jobs)
+        run("warm", paths, cache_path)
+        os.utime(os.path.join(BASE_PATH, paths[0]))
+        run("touched", paths, cache_path)
+        with open(os.path.join(BASE_PATH, paths[1]), "ab") as file:
+            file.write(b"changed")
+        images = run("changed", paths, cache_path)
+
+        print(f"\n{'upload':<10} {'bytes':>10} {'seconds':>8}")
+        for name, files in (
+            ("original", [os.path.join(BASE_PATH, path) for path in paths]),
+            (
+                "optimized",
+                [os.path.join(cache_path, image.file) for image in images],
+            ),
+        ):
+            size, seconds = asyncio.run(upload(files, args.uplink))
+            print(f"{name:<10} {size:>10} {seconds:>8.2f}")
+
+
+if __name__ == "__main__":
+    main()
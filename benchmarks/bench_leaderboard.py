@@ -0,0 +1,93 @@
+"""Benchmark of the leaderboard with up to a million players.
+
+Compares `Leaderboard` with the ad hoc way of ranking: sorting all scores
+for every query (as a scan of the `Players` collection would do). Reports
+microseconds per score update, rank query and top page.
+
+Usage:
+
+    python benchmarks/bench_leaderboard.py [--sizes 1000 100000 1000000]
+
+"""
+import argparse
+import random
+import time
+
+from fakes import configure_environment
+
+configure_environment()
+
+from leaderboard import Leaderboard  # noqa: E402
+
+
+def per_call(function, calls: int) -> float:
+    """Returns microseconds per call of the function."""
+    start = time.perf_counter()
+    for _ in range(calls):
+        function()
+    return (time.perf_counter() - start) / calls * 1e6
+
+
+def bench(size: int, calls: int, scan_limit: int):
+    rng = random.Random(size)
+    scores = {i: rng.randint(-500, 5000) for i in range(size)}
+    start = time.perf_counter()
+    leaderboard = Leaderboard(scores.items())
+    build = time.perf_counter() - start
+
+    def update():
+        player_id = rng.randrange(size)
+        score = leaderboard.scores[player_id] + rng.choice((10, -1, -10))
+        leaderboard.update(player_id, score)
+
+    def rank():
+        leaderboard.rank(rng.randrange(size))
+
+    def top():
+        leaderboard.top(rng.randrange(size), 10)
+
+    def scan_rank():
+        score = scores[rng.randrange(size)]
+        sum(1 for other in scores.values() if other > score)
+
+    scan = per_call(scan_rank, 3) if size <= scan_limit else None
+    return (
+        build,
+        per_call(update, calls),
+        per_call(rank, calls),
+        per_call(top, calls),
+        scan,
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        "--sizes", type=int, nargs="+", default=[1000, 100000, 1000000]
+    )
+    parser.add_argument("--calls", type=int, default=100000)
+    parser.add_argument(
+        "--scan-limit",
+        type=int,
+        default=1000000,
+        help="skip the scan for bigger numbers of players",
+    )
+    args = parser.parse_args()
+
+    print(
+        f"{'players':>8} {'build, s':>9} {'update, us':>11} "
+        f"{'rank, us':>9} {'top 10, us':>11} {'scan rank, us':>14}"
+    )
+    for size in args.sizes:
+        build, update, rank, top, scan = bench(
+            size, args.calls, args.scan_limit
+        )
+        scan = f"{scan:>14.1f}" if scan is not None else f"{'-':>14}"
+        print(
+            f"{size:>8} {build:>9.2f} {update:>11.2f} "
+            f"{rank:>9.2f} {top:>11.2f} {scan}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,124 @@
+"""Benchmark of loading the events catalog at startup.
+
+Generates catalogs with long descriptions and loads every catalog in a
+fresh process with:
+
+    `json` - the previous loader: `json.load` of the whole file and
+        a `HistoricalEvent` for every record;
+    `stream` - `HistoricalEventDao.all`, the streaming loader;
+    `lazy` - the streaming loader leaving descriptions in the file.
+
+Reports the load time and the peak RSS growth of the process.
+
+Usage:
+
+    python benchmarks/bench_loader.py [--sizes 1000 10000 100000]
+
+"""
+import argparse
+import json
+import os
+import random
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+from fakes import FakeDatabase, configure_environment
+
+
+MODES = ("json", "stream", "lazy")
+
+
+def write_catalog(path: str, size: int, description_size: int):
+    """Writes a catalog of `size` events in the JSON array format."""
+    rng = random.Random(size)
+    words = ["событие", "князь", "война", "город", "реформа", "договор"]
+    with open(path, "w", encoding="utf-8") as file:
+        file.write("[\n")
+        for event_id in range(size):
+            description = []
+            length = 0
+            while length < description_size:
+                description.append(rng.choice(words))
+                length += len(description[-1]) + 1
+            event = {
+                "_id": event_id,
+                "_type": "date",
+                "event": f"Событие номер {event_id}",
+                "date": rng.randint(0, 2023),
+                "description": " ".join(description),
+                "image_path": None,
+            }
+            separator = ",\n" if event_id < size - 1 else "\n"
+            file.write(json.dumps(event, ensure_ascii=False) + separator)
+        file.write("]\n")
+
+
+def max_rss_kb() -> int:
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def load(mode: str, path: str) -> dict:
+    """Loads the catalog in the current process."""
+    configure_environment()
+    from dao import HistoricalEventDao
+    from models import HistoricalEvent
+
+    before = max_rss_kb()
+    start = time.perf_counter()
+    if mode == "json":
+        with open(path, "r") as json_file:
+            events = [HistoricalEvent(**e) for e in json.load(json_file)]
+    else:
+        events = HistoricalEventDao(FakeDatabase()).all(path, mode == "lazy")
+    events = {event._id: event for event in events}
+    elapsed = time.perf_counter() - start
+    return {"seconds": elapsed, "rss_mb": (max_rss_kb() - before) / 1024}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        "--sizes", type=int, nargs="+", default=[1000, 10000, 100000]
+    )
+    parser.add_argument(
+        "--description-size",
+        type=int,
+        default=1000,
+        help="characters in every description",
+    )
+    parser.add_argument("--child", nargs=2, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        print(json.dumps(load(*args.child)))
+        return
+
+    print(
+        f"{'events':>8} {'file, MB':>9} "
+        + " ".join(f"{m + ', s':>10} {m + ', MB':>10}" for m in MODES)
+    )
+    with tempfile.TemporaryDirectory() as directory:
+        for size in args.sizes:
+            path = os.path.join(directory, f"events-{size}.json")
+            write_catalog(path, size, args.description_size)
+            columns = []
+            for mode in MODES:
+                output = subprocess.run(
+                    [sys.executable, __file__, "--child", mode, path],
+                    capture_output=True,
+                    text=True,
+                    check=True,
+                ).stdout
+                result = json.loads(output)
+                columns.append(
+                    f"{result['seconds']:>10.2f} {result['rss_mb']:>10.1f}"
+                )
+            file_size = os.path.getsize(path) / 1024**2
+            print(f"{size:>8} {file_size:>9.1f} " + " ".join(columns))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,276 @@
+"""Benchmark of the `Players` migration, export and import commands.
+
+Fills the collection with `--players` documents of schema version 0 and
+reports documents per second and peak traced memory of:
+
+    `migrate` - `naive` loads all documents, migrates them and replaces them
+        with one ordered bulk write, `stream` is
+        `player_migrations.migrate_players` with one and `--workers` bulk
+        writes at the same time;
+    `export` and `import` - a gzip JSON Lines backup of all players and its
+        import into an empty collection.
+
+Then every command is interrupted half way and resumed, and the result is
+checked: all players migrated, exported once and imported as exported.
+
+The in-memory stand-in of MongoDB is used by default, then the peak memory
+includes the documents written to it. Pass `--mongo-uri` to measure a local
+mongod (the `date_duel_migrations_bench` database is dropped).
+
+Usage:
+
+    python benchmarks/bench_migrations.py [--players 200000] [--workers 8]
+
+"""
+import argparse
+import asyncio
+import gzip
+import os
+import random
+import tempfile
+import time
+import tracemalloc
+from typing import Awaitable, Callable, Tuple
+
+from fakes import FakeDatabase, configure_environment
+
+configure_environment()
+
+from pymongo import ReplaceOne  # noqa: E402
+
+from dao import AsyncPlayerDao  # noqa: E402
+from models import PLAYER_SCHEMA_VERSION  # noqa: E402
+from player_migrations import (  # noqa: E402
+    export_players,
+    import_players,
+    migrate_document,
+    migrate_players,
+)
+
+DATABASE_NAME = "date_duel_migrations_bench"
+
+
+class Databases:
+    """Creates empty databases, in memory or in a local mongod."""
+
+    def __init__(self, mongo_uri: str = None):
+        self.client = None
+        if mongo_uri:
+            from motor.motor_asyncio import AsyncIOMotorClient
+
+            self.client = AsyncIOMotorClient(mongo_uri)
+
+    async def create(self):
+        if self.client is None:
+            return FakeDatabase()
+        await self.client.drop_database(DATABASE_NAME)
+        return self.client[DATABASE_NAME]
+
+
+async def fill(database, players: int, seed: int):
+    """Adds players of schema version 0, some without `attempts`."""
+    rng = random.Random(seed)
+    collection = database[AsyncPlayerDao.collection_name]
+    batch = []
+    for player_id in range(1, players + 1):
+        document = {
+            "_id": player_id,
+            "current_event": None,
+            "guessed_events": rng.sample(range(1000), 20),
+            "score": rng.randrange(1000),
+        }
+        if rng.random() < 0.5:
+            document["attempts"] = rng.randrange(100)
+        batch.append(document)
+        if len(batch) == 10000:
+            await collection.insert_many(batch)
+            batch = []
+    if batch:
+        await collection.insert_many(batch)
+
+
+async def migrate_naive(database, batch_size: int, workers: int) -> dict:
+    collection = database[AsyncPlayerDao.collection_name]
+    documents = [document async for document in collection.find()]
+    requests = [
+        ReplaceOne({"_id": document["_id"]}, document)
+        for document in documents
+        if migrate_document(document)
+    ]
+    await collection.bulk_write(requests)
+    return {"read": len(documents), "migrated": len(requests)}
+
+
+async def measure(run: Awaitable) -> Tuple[float, float, dict]:
+    """Returns seconds, peak memory in MB and the result of the run."""
+    tracemalloc.start()
+    start = time.perf_counter()
+    result = await run
+    elapsed = time.perf_counter() - start
+    peak = tracemalloc.get_traced_memory()[1] / 2**20
+    tracemalloc.stop()
+    return elapsed, peak, result
+
+
+async def interrupt(run: Awaitable, done: Callable[[], bool]):
+    """Cancels the run when `done` returns true."""
+    task = asyncio.ensure_future(run)
+    while not task.done() and not done():
+        await asyncio.sleep(0.01)
+    task.cancel()
+    try:
+        await task
+    except asyncio.CancelledError:
+        pass
+
+
+def normalize(document: dict) -> dict:
+    """Returns the document as it's read from mongod, which returns binary
+    data of the default subtype as `bytes`."""
+    return {
+        name: bytes(value) if isinstance(value, bytes) else value
+        for name, value in document.items()
+    }
+
+
+async def count_migrated(database) -> int:
+    collection = database[AsyncPlayerDao.collection_name]
+    return await collection.count_documents(
+        {"schema_version": PLAYER_SCHEMA_VERSION}
+    )
+
+
+async def bench(args):
+    databases = Databases(args.mongo_uri)
+    directory = tempfile.mkdtemp()
+    state_path = os.path.join(directory, "state")
+    backup_path = os.path.join(directory, "players.jsonl.gz")
+
+    print(
+        f"{'command':<8} {'runner':>10} {'seconds':>8} {'docs/s':>9} "
+        f"{'peak MB':>8}"
+    )
+
+    def report(command: str, runner: str, elapsed: float, peak: float):
+        rate = args.players / elapsed
+        print(
+            f"{command:<8} {runner:>10} {elapsed:>8.2f} {rate:>9.0f} "
+            f"{peak:>8.1f}"
+        )
+
+    runners = {
+        "naive": migrate_naive,
+        "stream-1": lambda database, batch_size, workers: migrate_players(
+            database, state_path, batch_size=batch_size, workers=1
+        ),
+        f"stream-{args.workers}": lambda database, batch_size, workers: (
+            migrate_players(
+                database, state_path, batch_size=batch_size, workers=workers
+            )
+        ),
+    }
+    for name, runner in runners.items():
+        database = await databases.create()
+        await fill(database, args.players, args.seed)
+        elapsed, peak, _ = await measure(
+            runner(database, args.batch_size, args.workers)
+        )
+        report("migrate", name, elapsed, peak)
+
+    elapsed, peak, _ = await measure(
+        export_players(database, backup_path, state_path, batch_size=1000)
+    )
+    report("export", "stream", elapsed, peak)
+    size = os.path.getsize(backup_path) / 2**20
+    imported = await databases.create()
+    elapsed, peak, _ = await measure(
+        import_players(
+            imported,
+            backup_path,
+            state_path,
+            batch_size=args.batch_size,
+            workers=args.workers,
+        )
+    )
+    report("import", "stream", elapsed, peak)
+
+    # Interrupt every command half way and resume it
+    database = await databases.create()
+    await fill(database, args.players, args.seed)
+    migrated = [0]
+
+    async def poll_migrated():
+        while True:
+            migrated[0] = await count_migrated(database)
+            await asyncio.sleep(0.05)
+
+    poller = asyncio.create_task(poll_migrated())
+    await interrupt(
+        migrate_players(
+            database, state_path, batch_size=args.batch_size, workers=4
+        ),
+        lambda: migrated[0] >= args.players // 2,
+    )
+    poller.cancel()
+    stats = await migrate_players(
+        database, state_path, resume=True, batch_size=args.batch_size
+    )
+    print(
+        f"\nmigrate resumed: read {stats['read']} of {args.players}, "
+        f"migrated {await count_migrated(database)}"
+    )
+
+    await interrupt(
+        export_players(database, backup_path, state_path, batch_size=1000),
+        lambda: os.path.getsize(backup_path) > size * 2**20 / 2,
+    )
+    await export_players(database, backup_path, state_path, resume=True)
+    with gzip.open(backup_path, "rt") as file:
+        lines = sum(1 for _ in file)
+    print(f"export resumed: {lines} lines of {args.players} players")
+
+    imported = await databases.create()
+    collection = imported[AsyncPlayerDao.collection_name]
+    await interrupt(
+        import_players(
+            imported, backup_path, state_path, batch_size=args.batch_size
+        ),
+        lambda: os.path.exists(state_path),
+    )
+    before = await collection.count_documents({})
+    stats = await import_players(
+        imported,
+        backup_path,
+        state_path,
+        resume=True,
+        batch_size=args.batch_size,
+    )
+    source = database[AsyncPlayerDao.collection_name]
+    different = 0
+    async for document in source.find():
+        copy = await collection.find_one({"_id": document["_id"]})
+        if normalize(copy) != normalize(document):
+            different += 1
+    print(
+        f"import resumed after {before} players: imported {stats['imported']}"
+        f", total {await collection.count_documents({})}, "
+        f"different from the source {different}"
+    )
+    print(f"\nbackup {size:.1f} MB")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--players", type=int, default=200000)
+    parser.add_argument("--batch-size", type=int, default=1000)
+    parser.add_argument("--workers", type=int, default=8)
+    parser.add_argument(
+        "--mongo-uri", help="use a local mongod instead of the in-memory one"
+    )
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    asyncio.run(bench(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,98 @@
+"""Microbenchmark of picking the next event for a player.
+
+Compares the old linear scan over all events with `EventSelector` for
+catalogs from 30 to 100k events. Every run simulates a player who guesses
+the whole catalog, one event per `/play`.
+
+Usage:
+
+    python benchmarks/bench_selection.py [--sizes 30 1000 10000 100000]
+
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+
+from selection import ORDERS, EventSelector  # noqa: E402
+
+
+class BenchPlayer:
+    """Player stand-in with the interface used by `EventSelector`."""
+
+    def __init__(self, player_id: int):
+        self._id = player_id
+        self.event_cursor = None
+        self.guessed_events = []
+        self._guessed_set = set()
+
+    def has_guessed(self, event_id: int) -> bool:
+        return event_id in self._guessed_set
+
+    def add_guessed_event(self, event_id: int):
+        self._guessed_set.add(event_id)
+        self.guessed_events.append(event_id)
+
+    def reset_guessed_events(self):
+        self._guessed_set = set()
+        self.guessed_events = []
+
+
+def linear_scan(event_ids, player: BenchPlayer) -> int:
+    """The previous implementation with the list membership test."""
+    for event_id in event_ids:
+        if event_id not in player.guessed_events:
+            return event_id
+
+
+def bench_linear(size: int, picks: int) -> float:
+    event_ids = list(range(size))
+    player = BenchPlayer(1)
+    start = time.perf_counter()
+    for _ in range(picks):
+        player.add_guessed_event(linear_scan(event_ids, player))
+    return (time.perf_counter() - start) / picks
+
+
+def bench_selector(size: int, picks: int, order: str) -> float:
+    selector = EventSelector({i: str(i % 3) for i in range(size)}, order)
+    player = BenchPlayer(1)
+    start = time.perf_counter()
+    for _ in range(picks):
+        player.add_guessed_event(selector.next_event_id(player))
+    return (time.perf_counter() - start) / picks
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        "--sizes", type=int, nargs="+", default=[30, 1000, 10000, 100000]
+    )
+    parser.add_argument(
+        "--linear-limit",
+        type=int,
+        default=1000,
+        help="skip the linear scan for bigger catalogs (it is cubic)",
+    )
+    args = parser.parse_args()
+
+    columns = ["linear"] + list(ORDERS)
+    print(f"{'events':>8} " + " ".join(f"{c + ', us':>14}" for c in columns))
+    for size in args.sizes:
+        timings = [
+            bench_linear(size, size) if size <= args.linear_limit else None
+        ]
+        timings += [bench_selector(size, size, order) for order in ORDERS]
+        print(
+            f"{size:>8} "
+            + " ".join(
+                f"{'-':>14}" if t is None else f"{t * 1e6:>14.2f}"
+                for t in timings
+            )
+        )
+
+
+if __name__ == "__main__":
+    main()
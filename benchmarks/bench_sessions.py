@@ -0,0 +1,103 @@
+"""Benchmark of the expiry of idle rounds with millions of pending rounds.
+
+Schedules deadlines of `n` rounds spread over the TTL, then simulates one
+TTL of ticks in which active players move their deadlines, and reports
+microseconds per schedule, milliseconds per tick (average and maximum) and
+the number of expired rounds for:
+
+    `wheel` - `sessions.TimerWheel`;
+    `heap` - a binary heap of deadlines with lazy deletion of moved ones.
+
+Usage:
+
+    python benchmarks/bench_sessions.py [--sizes 100000 1000000 2000000]
+
+"""
+import argparse
+import heapq
+import random
+import time
+from typing import Dict, Hashable, List
+
+from fakes import configure_environment
+
+configure_environment()
+
+from sessions import TimerWheel  # noqa: E402
+
+
+class HeapTimers:
+    """Deadlines in a heap, the usual alternative to a timing wheel."""
+
+    def __init__(self):
+        self.heap: List[tuple] = []
+        self.deadlines: Dict[Hashable, float] = {}
+
+    def schedule(self, key: Hashable, deadline: float):
+        self.deadlines[key] = deadline
+        heapq.heappush(self.heap, (deadline, key))
+
+    def advance(self, now: float) -> List[Hashable]:
+        expired = []
+        while self.heap and self.heap[0][0] <= now:
+            deadline, key = heapq.heappop(self.heap)
+            if self.deadlines.get(key) == deadline:
+                del self.deadlines[key]
+                expired.append(key)
+        return expired
+
+
+def simulate(timers, size: int, ttl: float, touches: int, seed: int) -> dict:
+    rng = random.Random(seed)
+    start = time.perf_counter()
+    for key in range(size):
+        timers.schedule(key, rng.uniform(0, ttl))
+    schedule_us = (time.perf_counter() - start) / size * 1e6
+
+    tick_times = []
+    expired = 0
+    for now in range(1, int(ttl) + 1):
+        for _ in range(touches):
+            timers.schedule(rng.randrange(size), now + ttl)
+        start = time.perf_counter()
+        expired += len(timers.advance(now))
+        tick_times.append(time.perf_counter() - start)
+    return {
+        "schedule_us": schedule_us,
+        "tick_ms": sum(tick_times) / len(tick_times) * 1e3,
+        "max_tick_ms": max(tick_times) * 1e3,
+        "expired": expired,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        "--sizes", type=int, nargs="+", default=[100000, 1000000, 2000000]
+    )
+    parser.add_argument("--ttl", type=float, default=1800)
+    parser.add_argument(
+        "--touches", type=int, default=1000, help="moved deadlines per tick"
+    )
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    print(
+        f"{'rounds':>8} {'timers':>6} {'us/schedule':>12} {'ms/tick':>8} "
+        f"{'max ms/tick':>12} {'expired':>8}"
+    )
+    for size in args.sizes:
+        for name, timers in (
+            ("wheel", TimerWheel(1, args.ttl, now=0)),
+            ("heap", HeapTimers()),
+        ):
+            result = simulate(timers, size, args.ttl, args.touches, args.seed)
+            print(
+                f"{size:>8} {name:>6} {result['schedule_us']:>12.2f} "
+                f"{result['tick_ms']:>8.3f} {result['max_tick_ms']:>12.3f} "
+                f"{result['expired']:>8}"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,180 @@
+"""Benchmark of the bot cold start.
+
+Breaks down the import time of an entry point module per bot module and
+per the heaviest packages with `python -X importtime`, then starts the game
+in fresh processes with a generated events catalog and players in a fake
+database and reports:
+
+    `import` - seconds to import the `bot` module;
+    `accepting` - seconds from entering `setup_game` until the bot can
+        receive updates;
+    `events`, `leaderboard` - seconds until events and the leaderboard are
+        loaded;
+    `max stall` - the longest time the event loop was blocked meanwhile.
+
+The game is started with the loading awaited before receiving updates
+(`blocking`) and with the loading in background (`background`), see
+`BACKGROUND_LOADING`.
+
+Usage:
+
+    python benchmarks/bench_startup.py [--events 100000] [--players 100000]
+
+"""
+import argparse
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Dict, List, Tuple
+
+from bench_loader import write_catalog
+from fakes import SRC_PATH, FakeDatabase, configure_environment
+
+
+MODES = ("blocking", "background")
+
+
+def import_times(module: str) -> List[Tuple[str, int, float, float]]:
+    """Imports the module in a fresh process with `-X importtime`.
+
+    Returns:
+        Tuples of the imported module name, its nesting level and its self
+        and cumulative import time in seconds in the order of imports.
+    """
+    configure_environment()
+    output = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=SRC_PATH,
+        env=os.environ,
+        capture_output=True,
+        text=True,
+        check=True,
+    ).stderr
+    times = []
+    for line in output.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:") :].split("|")
+        level = (len(name) - len(name.lstrip()) - 1) // 2
+        times.append(
+            (name.strip(), level, int(self_us) / 1e6, int(cumulative_us) / 1e6)
+        )
+    return times
+
+
+def print_import_times(module: str, top: int):
+    times = import_times(module)
+    local = {
+        name[:-3] for name in os.listdir(SRC_PATH) if name.endswith(".py")
+    }
+    print(f"import {module}: {times[-1][3]:.3f}s")
+    print(f"  {'bot module':<24} {'self, s':>8} {'total, s':>9}")
+    for name, _, self_time, cumulative in times:
+        if name in local:
+            print(f"  {name:<24} {self_time:>8.3f} {cumulative:>9.3f}")
+    packages = sorted(
+        (
+            (cumulative, name)
+            for name, _, _, cumulative in times
+            if "." not in name and name not in local
+        ),
+        reverse=True,
+    )
+    print(f"  {'heaviest packages':<24} {'':>8} {'total, s':>9}")
+    for cumulative, name in packages[:top]:
+        print(f"  {name:<24} {'':>8} {cumulative:>9.3f}")
+
+
+async def start_game(players: int) -> Dict[str, float]:
+    """Starts the game and waits until everything is loaded."""
+    start = time.perf_counter()
+    import bot as bot_module
+
+    result = {"import": time.perf_counter() - start}
+    database = FakeDatabase()
+    await database["Players"].insert_many(
+        {"_id": player_id, "score": player_id % 1000}
+        for player_id in range(players)
+    )
+    stalls = []
+
+    async def watch_loop():
+        while True:
+            before = time.perf_counter()
+            await asyncio.sleep(0.001)
+            stalls.append(time.perf_counter() - before - 0.001)
+
+    watcher = asyncio.create_task(watch_loop())
+    start = time.perf_counter()
+    async with bot_module.setup_game(database, warm_up_images=False) as game:
+        result["accepting"] = time.perf_counter() - start
+        await game.wait_for_events()
+        result["events"] = time.perf_counter() - start
+        await game.wait_for_leaderboard()
+        result["leaderboard"] = time.perf_counter() - start
+    watcher.cancel()
+    result["max_stall"] = max(stalls, default=0)
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--events", type=int, default=100000)
+    parser.add_argument("--players", type=int, default=100000)
+    parser.add_argument(
+        "--modules",
+        nargs="+",
+        default=["bot", "import_events"],
+        help="entry points to break down the import time of",
+    )
+    parser.add_argument("--top", type=int, default=8)
+    parser.add_argument("--child", nargs=2, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        mode, catalog = args.child
+        os.environ["EVENTS_FILE_PATH"] = catalog
+        os.environ["BACKGROUND_LOADING"] = str(int(mode == "background"))
+        os.environ["JOURNAL_ENABLED"] = "0"
+        configure_environment()
+        print(json.dumps(asyncio.run(start_game(args.players))))
+        return
+
+    for module in args.modules:
+        print_import_times(module, args.top)
+        print()
+
+    columns = ("import", "accepting", "events", "leaderboard", "max_stall")
+    print(f"{args.events} events, {args.players} players")
+    print(f"{'mode':>10} " + " ".join(f"{c + ', s':>14}" for c in columns))
+    with tempfile.TemporaryDirectory() as directory:
+        catalog = os.path.join(directory, "events.json")
+        write_catalog(catalog, args.events, 200)
+        for mode in MODES:
+            output = subprocess.run(
+                [
+                    sys.executable,
+                    __file__,
+                    "--players",
+                    str(args.players),
+                    "--child",
+                    mode,
+                    catalog,
+                ],
+                capture_output=True,
+                text=True,
+                check=True,
+            ).stdout
+            result = json.loads(output.splitlines()[-1])
+            print(
+                f"{mode:>10} "
+                + " ".join(f"{result[c]:>14.3f}" for c in columns)
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,89 @@
+"""Benchmark of the guess telemetry.
+
+Records guesses of players in many events and reports:
+
+    `us/record` - microseconds the handler spends to record a guess;
+    `db ops`, `unbatched` - write operations to save all guesses with
+        `Telemetry` and with an insert per guess, as logging every guess
+        synchronously would do;
+    `ms/reorder` - milliseconds to rebuild the `difficulty` order of
+        events, which is done in background and not on the hot path.
+
+Usage:
+
+    python benchmarks/bench_telemetry.py [--guesses 100000] [--events 10000]
+
+"""
+import argparse
+import asyncio
+import random
+import time
+
+from fakes import FakeDatabase, configure_environment
+
+configure_environment()
+
+from dao import AsyncEventStatsDao, AsyncGuessDao  # noqa: E402
+from selection import EventSelector  # noqa: E402
+from telemetry import Telemetry  # noqa: E402
+
+
+async def bench(guesses: int, events: int, batch_size: int, seed: int):
+    rng = random.Random(seed)
+    dates = {event_id: rng.randint(0, 2023) for event_id in range(events)}
+    database = FakeDatabase()
+    telemetry = Telemetry(
+        AsyncGuessDao(database),
+        AsyncEventStatsDao(database),
+        buffer_size=guesses,
+        batch_size=batch_size,
+    )
+    actions = [
+        (rng.randrange(100000), rng.randrange(events), rng.random())
+        for _ in range(guesses)
+    ]
+    start = time.perf_counter()
+    for player_id, event_id, chance in actions:
+        date = dates[event_id]
+        if chance < 0.1:
+            telemetry.record(player_id, event_id, "surrender")
+        else:
+            guess = date if chance < 0.4 else date + rng.randint(-50, 50)
+            telemetry.record(player_id, event_id, "guess", guess, date)
+    record_us = (time.perf_counter() - start) / guesses * 1e6
+    await telemetry.flush()
+
+    selector = EventSelector(
+        {event_id: "date" for event_id in range(events)}, "difficulty"
+    )
+    start = time.perf_counter()
+    selector.reorder(telemetry.difficulty())
+    reorder_ms = (time.perf_counter() - start) * 1e3
+
+    hardest = max(telemetry.events.values(), key=lambda s: s.difficulty)
+    print(
+        f"{guesses:>8} {events:>7} {record_us:>10.2f} "
+        f"{database.total_ops:>7} {guesses:>11} {reorder_ms:>11.2f}   "
+        f"solve rate {hardest.solve_rate:.2f}, "
+        f"mean error {hardest.mean_error or 0:.1f}"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--guesses", type=int, default=100000)
+    parser.add_argument("--events", type=int, nargs="+", default=[100, 10000])
+    parser.add_argument("--batch-size", type=int, default=1000)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    print(
+        f"{'guesses':>8} {'events':>7} {'us/record':>10} {'db ops':>7} "
+        f"{'unbatched':>11} {'ms/reorder':>11}   hardest event"
+    )
+    for events in args.events:
+        asyncio.run(bench(args.guesses, events, args.batch_size, args.seed))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,454 @@
+"""Test doubles shared by the benchmarks.
+
+`FakeDatabase` is an in-memory stand-in for the `motor` database with the
+subset of the collection API used by the bot, it counts the operations made
+against every collection.
+
+`FakeBotApi` is a local HTTP server answering Bot API methods like
+Telegram does and recording sent messages per chat. Chats can block the bot
+and every call can take a simulated network round trip.
+
+"""
+import asyncio
+import copy
+import itertools
+import json
+import operator
+import os
+import sys
+import tempfile
+import time
+from collections import Counter, defaultdict, deque
+from typing import Any, Deque, Dict, Iterable, List, Optional, Set
+
+SRC_PATH = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), os.pardir, "src"
+)
+
+
+def configure_environment():
+    """Adds the sources to `sys.path` and sets required settings.
+
+    Must be called before the bot modules are imported.
+    """
+    if SRC_PATH not in sys.path:
+        sys.path.insert(0, SRC_PATH)
+    for name, value in {
+        "BOT_TOKEN": "42:BENCHMARK",
+        "MONGO_HOST": "localhost",
+        "MONGO_PORT": "27017",
+        "MONGO_INITDB_ROOT_USERNAME": "benchmark",
+        "MONGO_INITDB_ROOT_PASSWORD": "benchmark",
+        "MONGO_INITDB_DATABASE": "benchmark",
+        "EVENTS_FILE_PATH": "events.json",
+        "JOURNAL_PATH": os.path.join(
+            tempfile.gettempdir(), f"dateduel-journal-{os.getpid()}"
+        ),
+    }.items():
+        os.environ.setdefault(name, value)
+
+
+def _get_field(document: dict, name: str) -> Any:
+    for part in name.split("."):
+        if not isinstance(document, dict):
+            return None
+        document = document.get(part)
+    return document
+
+
+_COMPARISONS = {
+    "$gt": operator.gt,
+    "$gte": operator.ge,
+    "$lt": operator.lt,
+    "$lte": operator.le,
+}
+
+
+def _matches(document: dict, query: Optional[dict]) -> bool:
+    """Checks the document against a query with basic operators."""
+    for name, condition in (query or {}).items():
+        value = _get_field(document, name)
+        if not isinstance(condition, dict) or not all(
+            key.startswith("$") for key in condition
+        ):
+            if value != condition:
+                return False
+            continue
+        for op, operand in condition.items():
+            if op in _COMPARISONS:
+                if value is None or not _COMPARISONS[op](value, operand):
+                    return False
+            elif op == "$in" and value not in operand:
+                return False
+            elif op == "$nin" and value in operand:
+                return False
+            elif op == "$ne" and value == operand:
+                return False
+            elif op == "$exists" and (value is not None) != operand:
+                return False
+            elif op == "$type" and operand == "string":
+                if not isinstance(value, str):
+                    return False
+    return True
+
+
+def _apply_update(document: dict, update: dict, inserted: bool):
+    """Applies update operators to the document in place."""
+    if not any(key.startswith("$") for key in update):
+        _id = document.get("_id")
+        document.clear()
+        document.update(update, _id=_id)
+        return
+    for op, fields in update.items():
+        for name, value in fields.items():
+            items = value["$each"] if isinstance(value, dict) else [value]
+            if op == "$set" or (op == "$setOnInsert" and inserted):
+                document[name] = value
+            elif op == "$inc":
+                document[name] = document.get(name, 0) + value
+            elif op == "$push":
+                document.setdefault(name, []).extend(items)
+            elif op == "$addToSet":
+                target = document.setdefault(name, [])
+                target.extend(item for item in items if item not in target)
+            elif op == "$unset":
+                document.pop(name, None)
+
+
+class FakeCursor:
+    """Async cursor over a snapshot of matched documents."""
+
+    def __init__(self, documents: List[dict], projection: Optional[dict]):
+        self._documents = documents
+        self._projection = projection
+
+    def sort(self, key, direction: int = 1) -> "FakeCursor":
+        keys = key if isinstance(key, list) else [(key, direction)]
+        for name, order in reversed(keys):
+            self._documents.sort(
+                key=lambda d: _get_field(d, name), reverse=order < 0
+            )
+        return self
+
+    def limit(self, count: int) -> "FakeCursor":
+        if count:
+            self._documents = self._documents[:count]
+        return self
+
+    def skip(self, count: int) -> "FakeCursor":
+        self._documents = self._documents[count:]
+        return self
+
+    def batch_size(self, size: int) -> "FakeCursor":
+        return self
+
+    def _project(self, document: dict) -> dict:
+        if not self._projection:
+            return copy.deepcopy(document)
+        fields = {k for k, v in self._projection.items() if v}
+        return {
+            k: copy.deepcopy(v)
+            for k, v in document.items()
+            if k in fields or k == "_id"
+        }
+
+    def __aiter__(self):
+        return self._iterate()
+
+    async def _iterate(self):
+        for document in self._documents:
+            yield self._project(document)
+
+    async def to_list(self, length: Optional[int] = None) -> List[dict]:
+        documents = self._documents[:length] if length else self._documents
+        return [self._project(document) for document in documents]
+
+
+class FakeCollection:
+    """In-memory collection with the `motor` API used by the bot."""
+
+    def __init__(self, name: str, ops: Counter):
+        self.name = name
+        self.documents: Dict[Any, dict] = {}
+        self.ops = ops
+        self.indexes: List[Any] = []
+
+    def _count(self, operation: str):
+        self.ops[operation] += 1
+
+    def _find(self, query: Optional[dict]) -> List[dict]:
+        _id = (query or {}).get("_id")
+        if _id is not None and not isinstance(_id, dict):
+            document = self.documents.get(_id)
+            if document and _matches(document, query):
+                return [document]
+            return []
+        return [d for d in self.documents.values() if _matches(d, query)]
+
+    async def find_one(
+        self, query: Optional[dict] = None, projection: Optional[dict] = None
+    ) -> Optional[dict]:
+        self._count("find_one")
+        found = self._find(query)
+        if not found:
+            return None
+        return FakeCursor(found, projection)._project(found[0])
+
+    def find(
+        self, query: Optional[dict] = None, projection: Optional[dict] = None
+    ) -> FakeCursor:
+        self._count("find")
+        return FakeCursor(self._find(query), projection)
+
+    async def count_documents(self, query: dict) -> int:
+        self._count("count_documents")
+        return len(self._find(query))
+
+    async def insert_one(self, document: dict):
+        self._count("insert_one")
+        self.documents[document["_id"]] = copy.deepcopy(document)
+
+    async def insert_many(self, documents: Iterable[dict], ordered=True):
+        self._count("insert_many")
+        for document in documents:
+            document = copy.deepcopy(document)
+            document.setdefault("_id", len(self.documents))
+            self.documents[document["_id"]] = document
+
+    def _upsert(
+        self, query: dict, update: dict, upsert: bool
+    ) -> Optional[dict]:
+        found = self._find(query)
+        if found:
+            _apply_update(found[0], copy.deepcopy(update), inserted=False)
+            return found[0]
+        if not upsert:
+            return None
+        document = {k: v for k, v in query.items() if not isinstance(v, dict)}
+        _apply_update(document, copy.deepcopy(update), inserted=True)
+        document.setdefault("_id", query.get("_id"))
+        self.documents[document["_id"]] = document
+        return document
+
+    async def replace_one(self, query: dict, document: dict, upsert=False):
+        self._count("replace_one")
+        self._upsert(query, document, upsert)
+
+    async def update_one(self, query: dict, update: dict, upsert=False):
+        self._count("update_one")
+        self._upsert(query, update, upsert)
+
+    async def update_many(self, query: dict, update: dict):
+        self._count("update_many")
+        for document in self._find(query):
+            _apply_update(document, copy.deepcopy(update), inserted=False)
+
+    async def find_one_and_update(
+        self,
+        query: dict,
+        update: dict,
+        projection=None,
+        upsert=False,
+        return_document=False,
+    ) -> Optional[dict]:
+        self._count("find_one_and_update")
+        before = self._find(query)
+        before = copy.deepcopy(before[0]) if before else None
+        after = self._upsert(query, update, upsert)
+        document = after if return_document else before
+        return copy.deepcopy(document) if document else None
+
+    async def delete_one(self, query: dict):
+        self._count("delete_one")
+        for document in self._find(query)[:1]:
+            del self.documents[document["_id"]]
+
+    async def delete_many(self, query: dict):
+        self._count("delete_many")
+        for document in self._find(query):
+            del self.documents[document["_id"]]
+
+    async def bulk_write(self, requests: Iterable[Any], ordered=True):
+        """Applies `ReplaceOne`, `UpdateOne` and `InsertOne` requests.
+
+        Every matched document is counted as modified.
+        """
+        from pymongo.results import BulkWriteResult
+
+        self._count("bulk_write")
+        result = {
+            "nInserted": 0,
+            "nMatched": 0,
+            "nModified": 0,
+            "nUpserted": 0,
+            "upserted": [],
+        }
+        for index, request in enumerate(requests):
+            name = type(request).__name__
+            if name == "InsertOne":
+                await self.insert_many([request._doc])
+                result["nInserted"] += 1
+            elif self._find(request._filter):
+                self._upsert(request._filter, request._doc, False)
+                result["nMatched"] += 1
+                result["nModified"] += 1
+            elif request._upsert:
+                document = self._upsert(request._filter, request._doc, True)
+                result["nUpserted"] += 1
+                result["upserted"].append(
+                    {"index": index, "_id": document["_id"]}
+                )
+        return BulkWriteResult(result, True)
+
+    async def create_index(self, keys, **kwargs):
+        self._count("create_index")
+        self.indexes.append(keys)
+
+
+class FakeDatabase:
+    """In-memory stand-in for `motor.motor_asyncio.AsyncIOMotorDatabase`."""
+
+    def __init__(self):
+        self.ops: Counter = Counter()
+        self.collections: Dict[str, FakeCollection] = {}
+
+    def __getitem__(self, name: str) -> FakeCollection:
+        if name not in self.collections:
+            self.collections[name] = FakeCollection(name, self.ops)
+        return self.collections[name]
+
+    @property
+    def total_ops(self) -> int:
+        return sum(self.ops.values())
+
+
+class FakeBotApi:
+    """Local Bot API server for `aiogram.client.telegram.TelegramAPIServer`.
+
+    Properties:
+        calls: A number of calls of every method.
+        uploaded_bytes: A number of bytes of uploaded files.
+        sent: A dictionary mapping from chat id to texts and captions sent
+              to the chat and not read with `pop_sent` yet.
+        blocked: Ids of chats which blocked the bot, sending to them fails
+                 with `403 Forbidden`.
+        latency: Seconds every call takes.
+
+    """
+
+    def __init__(self, latency: float = 0):
+        from aiohttp import web
+
+        self.blocked: Set[int] = set()
+        self.latency = latency
+        self.calls: Counter = Counter()
+        self.uploaded_bytes = 0
+        self.sent: Dict[int, Deque[str]] = defaultdict(deque)
+        self._message_ids = itertools.count(1)
+        self._file_ids = itertools.count(1)
+        self._runner = None
+        self.app = web.Application(client_max_size=50 * 1024**2)
+        self.app.router.add_post("/bot{token}/{method}", self._handle)
+
+    def pop_sent(self, chat_id: int) -> List[str]:
+        """Returns and forgets messages sent to the chat."""
+        return list(self.sent.pop(chat_id, ()))
+
+    def _message(self, chat_id: int, **fields) -> dict:
+        return {
+            "message_id": next(self._message_ids),
+            "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "private"},
+            **fields,
+        }
+
+    async def _handle(self, request):
+        from aiohttp import web
+
+        method = request.match_info["method"]
+        self.calls[method] += 1
+        data = await request.post()
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        params = {}
+        for name, value in data.items():
+            if hasattr(value, "file"):
+                self.uploaded_bytes += len(value.file.read())
+                params[name] = None
+            else:
+                params[name] = value
+        if method == "getMe":
+            result = {
+                "id": 42,
+                "is_bot": True,
+                "first_name": "Benchmark",
+                "username": "benchmark_bot",
+            }
+        elif method in ("sendMessage", "sendPhoto"):
+            chat_id = int(params["chat_id"])
+            if chat_id in self.blocked:
+                return web.json_response(
+                    {
+                        "ok": False,
+                        "error_code": 403,
+                        "description": (
+                            "Forbidden: bot was blocked by the user"
+                        ),
+                    },
+                    status=403,
+                )
+            text = params.get("text") or params.get("caption") or ""
+            self.sent[chat_id].append(text)
+            if method == "sendMessage":
+                result = self._message(chat_id, text=text)
+            else:
+                photo = {
+                    "file_id": f"photo-{next(self._file_ids)}",
+                    "file_unique_id": "unique",
+                    "width": 800,
+                    "height": 600,
+                }
+                result = self._message(chat_id, photo=[photo], caption=text)
+        else:
+            result = True
+        return web.json_response({"ok": True, "result": result})
+
+    async def start(self, host: str = "127.0.0.1", port: int = 0) -> str:
+        """Starts the server and returns its base URL."""
+        from aiohttp import web
+
+        self._runner = web.AppRunner(self.app)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, host, port)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+        return f"http://{host}:{port}"
+
+    async def stop(self):
+        if self._runner is not None:
+            await self._runner.cleanup()
+
+
+def make_message_update(
+    update_id: int, user_id: int, text: str, chat_id: Optional[int] = None
+) -> dict:
+    """Returns a raw update with a text message from the user."""
+    message = {
+        "message_id": update_id,
+        "date": int(time.time()),
+        "chat": {"id": user_id if chat_id is None else chat_id},
+        "from": {"id": user_id, "is_bot": False, "first_name": "Player"},
+        "text": text,
+    }
+    message["chat"]["type"] = "private" if chat_id is None else "group"
+    if text.startswith("/"):
+        command = text.split()[0]
+        message["entities"] = [
+            {"type": "bot_command", "offset": 0, "length": len(command)}
+        ]
+    return {"update_id": update_id, "message": message}
+
+
+def dumps(value: Any) -> str:
+    """Serializes benchmark results to a stable one-line JSON."""
+    return json.dumps(value, sort_keys=True, ensure_ascii=False)
@@ -0,0 +1,222 @@
+"""Load test of the bot with many concurrent players.
+
+Drives the real `Dispatcher` from `bot.py` with synthetic message updates.
+The bot talks to a local fake Bot API server and stores players in an
+in-memory stand-in of MongoDB (or in a local mongod with `--mongo-uri`).
+Every virtual player sends `/start`, then plays rounds: `/play`, guesses
+the year with a binary search over the bot's hints and sometimes sends
+`/sur` and `/stat`.
+
+The report is one JSON line with the commit, the parameters and metrics:
+throughput, p50/p95/p99 update latency, database operations per update,
+Bot API calls per update and memory per cached player. Append it to a
+file with `--output` to compare runs across commits.
+
+Usage:
+
+    python benchmarks/load.py [--players 1000] [--rounds 3]
+
+"""
+import argparse
+import asyncio
+import gc
+import itertools
+import random
+import statistics
+import subprocess
+import time
+import tracemalloc
+from collections import Counter
+from typing import Dict, List
+
+from fakes import (
+    FakeBotApi,
+    FakeDatabase,
+    configure_environment,
+    dumps,
+    make_message_update,
+)
+
+configure_environment()
+
+from aiogram import Bot  # noqa: E402
+from aiogram.client.session.aiohttp import AiohttpSession  # noqa: E402
+from aiogram.client.telegram import TelegramAPIServer  # noqa: E402
+
+import bot as bot_module  # noqa: E402
+from config import BOT_TOKEN  # noqa: E402
+
+
+HINTS = {"Это произошло раньше.": -1, "Это произошло позже.": 1}
+
+
+class CommandCounter:
+    """Counts commands sent to a real mongod, see `pymongo.monitoring`."""
+
+    def __init__(self):
+        self.ops: Counter = Counter()
+
+    def started(self, event):
+        self.ops[event.command_name] += 1
+
+    def succeeded(self, event):
+        pass
+
+    def failed(self, event):
+        pass
+
+
+class LoadTest:
+    """Virtual players sending updates to the dispatcher."""
+
+    def __init__(self, api: FakeBotApi, bot: Bot, rng: random.Random):
+        self.api = api
+        self.bot = bot
+        self.rng = rng
+        self.latencies: List[float] = []
+        self.errors: Counter = Counter()
+        self._update_ids = itertools.count(1)
+
+    async def send(self, user_id: int, text: str) -> List[str]:
+        """Feeds the update and returns messages the bot answered with."""
+        update = make_message_update(next(self._update_ids), user_id, text)
+        start = time.perf_counter()
+        try:
+            await bot_module.dp.feed_raw_update(self.bot, update)
+        except Exception as error:
+            self.errors[type(error).__name__] += 1
+        self.latencies.append(time.perf_counter() - start)
+        return self.api.pop_sent(user_id)
+
+    async def play_round(self, user_id: int):
+        await self.send(user_id, "/play")
+        if self.rng.random() < 0.1:
+            await self.send(user_id, "/sur")
+            return
+        low, high = 0, 2023
+        while low <= high:
+            year = (low + high) // 2
+            replies = await self.send(user_id, str(year))
+            direction = next((HINTS[r] for r in replies if r in HINTS), 0)
+            if direction < 0:
+                high = year - 1
+            elif direction > 0:
+                low = year + 1
+            else:
+                return
+
+    async def play(self, user_id: int, rounds: int):
+        await self.send(user_id, "/start")
+        for _ in range(rounds):
+            await self.play_round(user_id)
+            if self.rng.random() < 0.2:
+                await self.send(user_id, "/stat")
+
+
+def percentile(values: List[float], percent: float) -> float:
+    return statistics.quantiles(values, n=100)[percent - 1] if values else 0
+
+
+def get_commit() -> str:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True,
+            text=True,
+        ).stdout.strip()
+    except OSError:
+        return ""
+
+
+async def run(args) -> Dict:
+    api = FakeBotApi()
+    base_url = await api.start()
+    session = AiohttpSession(api=TelegramAPIServer.from_base(base_url))
+    if bot_module.outbound is not None:
+        # Pace the calls as the module bot does
+        session.middleware(bot_module.outbound)
+    bot = Bot(BOT_TOKEN, session=session)
+    # Handlers send photos with the module bot
+    bot_module.bot = bot
+
+    if args.mongo_uri:
+        from motor.motor_asyncio import AsyncIOMotorClient
+
+        counter = CommandCounter()
+        client = AsyncIOMotorClient(args.mongo_uri, event_listeners=[counter])
+        await client.drop_database("date_duel_load_test")
+        database, ops = client["date_duel_load_test"], counter.ops
+    else:
+        database = FakeDatabase()
+        ops = database.ops
+
+    tracemalloc.start()
+    test = LoadTest(api, bot, random.Random(args.seed))
+    semaphore = asyncio.Semaphore(args.concurrency)
+
+    async def player(user_id: int):
+        async with semaphore:
+            await test.play(user_id, args.rounds)
+
+    async with bot_module.setup_game(database, warm_up_images=False) as game:
+        start = time.perf_counter()
+        await asyncio.gather(*(player(i) for i in range(1, args.players + 1)))
+        elapsed = time.perf_counter() - start
+
+        cached = len(game.players)
+        await game.players.flush()
+        gc.collect()
+        before = tracemalloc.get_traced_memory()[0]
+        game.players.max_size = 0
+        game.players.evict()
+        gc.collect()
+        freed = before - tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+
+    await session.close()
+    await api.stop()
+    updates = len(test.latencies)
+    return {
+        "commit": get_commit(),
+        "params": vars(args),
+        "updates": updates,
+        "errors": dict(test.errors),
+        "throughput_ups": round(updates / elapsed, 1),
+        "latency_ms": {
+            f"p{p}": round(percentile(test.latencies, p) * 1000, 3)
+            for p in (50, 95, 99)
+        },
+        "db_ops_per_update": round(sum(ops.values()) / updates, 3),
+        "db_ops": dict(ops),
+        "api_calls_per_update": round(sum(api.calls.values()) / updates, 3),
+        "uploaded_kb": api.uploaded_bytes // 1024,
+        "bytes_per_cached_player": round(freed / cached) if cached else 0,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--players", type=int, default=1000)
+    parser.add_argument("--rounds", type=int, default=3)
+    parser.add_argument(
+        "--concurrency",
+        type=int,
+        default=1000,
+        help="number of players sending updates at the same time",
+    )
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument(
+        "--mongo-uri", help="use a local mongod instead of the in-memory one"
+    )
+    parser.add_argument("--output", help="append the report to the file")
+    args = parser.parse_args()
+
+    report = dumps(asyncio.run(run(args)))
+    print(report)
+    if args.output:
+        with open(args.output, "a") as output:
+            output.write(report + "\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,112 @@
+"""Stress test of per-player serialized execution.
+
+Fires thousands of concurrent updates (`/play`, guesses, `/sur`, `/cancel`)
+per player at `GuessGame` through handlers which mirror the ones in
+`bot.py` and checks that the score of every player matches the results
+of the handled updates. With `--no-locks` the same run shows the races.
+
+Usage:
+
+    python benchmarks/stress_player_locks.py [--players 20] [--updates 2000]
+
+"""
+import argparse
+import asyncio
+import random
+import sys
+import time
+from collections import Counter
+from contextlib import asynccontextmanager
+
+from fakes import FakeDatabase, configure_environment
+
+configure_environment()
+
+from game import GuessGame  # noqa: E402
+from locks import PlayerLocks  # noqa: E402
+
+
+async def handle(game: GuessGame, player_id: int, action: str, results):
+    """Mirrors the bot handlers with an `await` where a handler sends
+    a message, so concurrent updates can interleave there."""
+    player = await game.get_player(player_id)
+    await asyncio.sleep(0)
+    if action == "play":
+        await game.play(player_id)
+    elif not player.in_game:
+        pass
+    elif action == "sur":
+        game.surrender(player)
+        results["sur"] += 1
+    elif action == "cancel":
+        game.cancel(player)
+    else:
+        event = game.events[player.current_event]
+        date = event.date if action == "right" else event.date + 1
+        await asyncio.sleep(0)
+        _, guessed = game.guess(player, date)
+        results["right" if guessed else "wrong"] += 1
+    await asyncio.sleep(0)
+
+
+@asynccontextmanager
+async def no_lock(player_id):
+    yield
+
+
+async def run(players: int, updates: int, use_locks: bool) -> int:
+    game = GuessGame(FakeDatabase())
+    await game.load_events()
+    locks = PlayerLocks()
+    hold = locks.hold if use_locks else no_lock
+    results = {player_id: Counter() for player_id in range(players)}
+    errors = Counter()
+    actions = ["play", "right", "wrong", "wrong", "sur", "cancel"]
+
+    async def update(player_id: int, action: str):
+        try:
+            async with hold(player_id):
+                await handle(game, player_id, action, results[player_id])
+        except Exception as error:
+            errors[type(error).__name__] += 1
+
+    start = time.perf_counter()
+    await asyncio.gather(
+        *(
+            update(player_id, random.choice(actions))
+            for _ in range(updates)
+            for player_id in range(players)
+        )
+    )
+    elapsed = time.perf_counter() - start
+
+    violations = 0
+    for player_id, counts in results.items():
+        player = await game.get_player(player_id)
+        expected_score = 10 * counts["right"] - counts["wrong"]
+        expected_score -= 10 * counts["sur"]
+        if (
+            player.score != expected_score
+            or player.attempts != counts["right"] + counts["wrong"]
+        ):
+            violations += 1
+    print(
+        f"{players * updates} updates in {elapsed:.2f}s, "
+        f"score violations: {violations}/{players}, "
+        f"errors: {dict(errors)}, locks left: {len(locks)}"
+    )
+    return violations + sum(errors.values())
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--players", type=int, default=20)
+    parser.add_argument("--updates", type=int, default=2000)
+    parser.add_argument("--no-locks", action="store_true")
+    args = parser.parse_args()
+    failures = asyncio.run(run(args.players, args.updates, not args.no_locks))
+    sys.exit(1 if failures and not args.no_locks else 0)
+
+
+if __name__ == "__main__":
+    main()
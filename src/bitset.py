@@ -0,0 +1,88 @@
+"""Compact set of event ids.
+
+A player's guessed events are stored as a bitmap where the bit number N
+is set if the event with id N is guessed. For a catalog of 100k events it
+takes 12.5 KB at most, while a list of ints takes about 36 bytes per id.
+
+"""
+from typing import Iterable, Iterator, Union
+
+
+class EventBitset:
+    """A mutable set of non-negative integer ids backed by a `bytearray`.
+
+    Bits are stored in little-endian order: the id N is the bit `N % 8` of
+    the byte `N // 8`. The number of ids is counted once on creation with
+    a popcount and then kept up to date on changes.
+
+    """
+
+    __slots__ = ("_bits", "_count")
+
+    def __init__(self, data: bytes = b""):
+        """Creates a bitset from its bytes representation.
+
+        Args:
+            data: Bytes returned by `to_bytes`.
+        """
+        self._bits = bytearray(data)
+        self._count = int.from_bytes(self._bits, "little").bit_count()
+
+    @classmethod
+    def from_iterable(cls, ids: Iterable[int]) -> "EventBitset":
+        """Creates a bitset from ids, e.g. from the legacy list format."""
+        bitset = cls()
+        for event_id in ids:
+            bitset.add(event_id)
+        return bitset
+
+    @classmethod
+    def coerce(
+        cls, value: Union["EventBitset", bytes, Iterable[int]]
+    ) -> "EventBitset":
+        """Converts a bitset, its bytes or an iterable of ids to a bitset."""
+        if isinstance(value, cls):
+            return value
+        if isinstance(value, (bytes, bytearray)):
+            return cls(value)
+        return cls.from_iterable(value)
+
+    def to_bytes(self) -> bytes:
+        """Returns the bytes representation without trailing zero bytes."""
+        return bytes(self._bits).rstrip(b"\x00")
+
+    def add(self, event_id: int):
+        """Adds the id to the set."""
+        if event_id < 0:
+            raise ValueError(f"Id must be non-negative, got {event_id}.")
+        index, mask = event_id >> 3, 1 << (event_id & 7)
+        if index >= len(self._bits):
+            self._bits.extend(bytes(index - len(self._bits) + 1))
+        if not self._bits[index] & mask:
+            self._bits[index] |= mask
+            self._count += 1
+
+    def __contains__(self, event_id: int) -> bool:
+        index = event_id >> 3
+        return (
+            0 <= index < len(self._bits)
+            and self._bits[index] & (1 << (event_id & 7)) != 0
+        )
+
+    def __len__(self) -> int:
+        return self._count
+
+    def __iter__(self) -> Iterator[int]:
+        for index, byte in enumerate(self._bits):
+            while byte:
+                low_bit = byte & -byte
+                yield (index << 3) + low_bit.bit_length() - 1
+                byte ^= low_bit
+
+    def __eq__(self, other) -> bool:
+        if not isinstance(other, EventBitset):
+            return NotImplemented
+        return self.to_bytes() == other.to_bytes()
+
+    def __repr__(self) -> str:
+        return f"EventBitset({list(self)})"
@@ -15,29 +15,181 @@ The module contains functions to process the following commands:
     `/sur` - surrender and receive information about the historical event.
     `/cancel` - exit the game mode.
     `/stat` - view game statistics.
+    `/top` - view the leaderboard.
+    `/duel` - find an opponent and guess the same event faster.
+
+The admin chat can also send the following commands:
+
+    `/broadcast` - send a message to all players or view the running
+                   broadcast.
+    `/broadcast_stop` - stop the running broadcast.
 
 It also contains functions to process date answers and other text answers
 received from the player during the game.
 
+In group chats `/play` starts one round for the whole chat, every member can
+guess and wrong guesses are summarized once in `GROUP_HINT_INTERVAL`
+seconds, see `groups.GroupRounds`. `/sur` ends the round of the chat.
+`/start`, `/cancel`, `/stat` and `/duel` work only in the private chat.
+
 """
-from aiogram import Bot, Dispatcher
-from aiogram.types import Message
-from aiogram.filters import Command
-from pymongo.database import Database
+import asyncio
+import functools
+import logging
+import os
+import signal
+from contextlib import asynccontextmanager
+from multiprocessing import Queue
+from typing import Dict, List, Optional, Tuple
 
-from config import BOT_TOKEN
-from dao import PlayerDao
-from database import get_database
+from aiogram import Bot, Dispatcher
+from aiogram.types import ChatMemberUpdated, Message
+from aiogram.filters import KICKED, MEMBER, ChatMemberUpdatedFilter, Command
+
+from broadcast import Broadcaster
+from config import (
+    ADMIN_CHAT_ID,
+    BOT_MODE,
+    BOT_TOKEN,
+    BROADCAST_CHECKPOINT_INTERVAL,
+    BROADCAST_LEASE,
+    BROADCAST_RATE,
+    BROADCAST_WORKERS,
+    IMAGES_WARM_UP,
+    JOURNAL_ENABLED,
+    JOURNAL_PATH,
+    JOURNAL_SYNC_INTERVAL,
+    METRICS_HOST,
+    METRICS_PORT,
+    SEND_CHAT_BURST,
+    SEND_CHAT_RATE,
+    SEND_GLOBAL_RATE,
+    SEND_MAX_RETRIES,
+    WEBHOOK_HOST,
+    WEBHOOK_PATH,
+    WEBHOOK_PORT,
+    WEBHOOK_QUEUE_SIZE,
+    WEBHOOK_SECRET,
+    WEBHOOK_URL,
+    WEBHOOK_WORKERS,
+    WORKERS,
+)
+from dao import (
+    AsyncBlockedPlayerDao,
+    AsyncBroadcastDao,
+    AsyncEventImageDao,
+    AsyncPlayerDao,
+)
+from database import get_async_database
+from duel import Match
 from game import GuessGame
-from models import Player
-
+from groups import GroupRound
+from images import ImageCache
+from journal import PlayerJournal, recover_journals
+from locks import PlayerLockMiddleware, PlayerLocks
+from metrics import REGISTRY, StatsCollector, serve_metrics
+from models import Broadcast, HistoricalEvent
+from outbound import OutboundLimiter
+from sharding import (
+    SCORE_CHANGES,
+    ShardQueues,
+    ShardRouter,
+    consume,
+    poll_updates,
+)
+from timing import ApiTimingMiddleware, HandlerTimingMiddleware
+from webhook import WebhookServer
+
+
+logger = logging.getLogger(__name__)
+
+# Telegram limits of a photo caption and a message in UTF-16 code units
+CAPTION_LIMIT = 1024
+MESSAGE_LIMIT = 4096
+TOP_PAGE_SIZE = 10
 
 bot: Bot = Bot(BOT_TOKEN)
 dp: Dispatcher = Dispatcher()
+dp.message.outer_middleware(PlayerLockMiddleware(PlayerLocks()))
+dp.message.middleware(HandlerTimingMiddleware())
+outbound: Optional[OutboundLimiter] = None
+if SEND_GLOBAL_RATE and SEND_CHAT_RATE:
+    outbound = OutboundLimiter(
+        global_rate=SEND_GLOBAL_RATE / WORKERS,
+        chat_rate=SEND_CHAT_RATE,
+        chat_burst=SEND_CHAT_BURST,
+        max_retries=SEND_MAX_RETRIES,
+    )
+    bot.session.middleware(outbound)
+bot.session.middleware(ApiTimingMiddleware())
+
+
+def text_length(text: str) -> int:
+    """Returns the length of the text as Telegram counts it."""
+    return len(text.encode("utf-16-le")) // 2
+
+
+async def reveal_event(
+    message: Message, event: HistoricalEvent, images: ImageCache
+):
+    """Sends the answer with the event image and description.
+
+    The explanation and the description are sent as the image caption if
+    they fit the caption limit, so the reveal takes one Bot API call.
+    """
+    texts = [event.explain()]
+    description = event.get_description()
+    if description:
+        texts.append(description)
+    text = "\n\n".join(texts)
+    if images.get_photo(event) is not None:
+        caption = None
+        if text_length(text) <= CAPTION_LIMIT:
+            caption, texts = text, []
+        elif text_length(texts[0]) <= CAPTION_LIMIT:
+            caption, texts = texts[0], texts[1:]
+        await images.send_photo(bot, message.chat.id, event, caption=caption)
+    elif text_length(text) <= MESSAGE_LIMIT:
+        texts = [text]
+    for text in texts:
+        await message.answer(text)
+
+
+def is_admin_chat(message: Message) -> bool:
+    """Checks whether the message was sent to the admin chat."""
+    return ADMIN_CHAT_ID is not None and message.chat.id == ADMIN_CHAT_ID
+
+
+def is_group_chat(message: Message) -> bool:
+    """Checks whether the message was sent to a group chat."""
+    return message.chat.type in ("group", "supergroup")
+
+
+def describe_broadcast(broadcast: Broadcast) -> str:
+    """Returns the progress of the broadcast for the admin."""
+    return (
+        f"Отправлено: {broadcast.sent}\n"
+        f"Заблокировали бота: {broadcast.blocked}\n"
+        f"Пропущено заблокировавших ранее: {broadcast.skipped}\n"
+        f"Ошибок: {broadcast.failed}"
+    )
+
+
+@dp.message(
+    Command(commands=["start", "cancel", "stat", "duel"]), is_group_chat
+)
+async def process_group_player_commands(message: Message):
+    """Answers commands of the player's own game in a group chat.
+
+    Messages of a group chat are processed by the worker of the chat, which
+    must not load players of other workers, and numbers sent to the chat
+    are guesses of its round, so these commands work in the private chat.
+    """
+    await message.answer("Эта команда работает в личном чате с ботом.")
 
 
 @dp.message(Command(commands=["start"]))
-async def process_start_command(message: Message):
+async def process_start_command(message: Message, game: GuessGame):
     """Process the start command for the historical date guessing game.
 
     This function processes the start command from the user, sends a welcome
@@ -49,9 +201,20 @@ async def process_start_command(message: Message):
         "Чтобы получить правила игры и список доступных "
         "команд - отправьте команду /help"
     )
-    # Create new player
-    player = Player(_id=message.from_user.id)
-    player = players.create(player)
+    # Create new player with one round trip and cache it for the game
+    await game.get_player(message.from_user.id)
+
+
+@dp.my_chat_member(
+    ChatMemberUpdatedFilter(member_status_changed=KICKED >> MEMBER),
+    lambda event: event.chat.type == "private",
+)
+async def process_bot_unblocked(
+    event: ChatMemberUpdated, broadcaster: Broadcaster
+):
+    """Makes broadcasts reach the player again after they unblocked
+    the bot, Telegram sends the update only then."""
+    await broadcaster.blocked_dao.remove(event.from_user.id)
 
 
 @dp.message(Command(commands=["help"]))
@@ -66,23 +229,57 @@ async def process_help_command(message: Message):
         "/sur - сдаться\n"
         "/cancel - отменить игру\n"
         "/stat - посмотреть статистику\n"
+        "/top - таблица лидеров\n"
+        "/duel - дуэль: кто быстрее угадает дату\n"
         "/help - правила игры и список команд\n\nДавай сыграем?"
     )
 
 
+@dp.message(Command(commands=["play"]), is_group_chat)
+async def process_group_play_command(message: Message, game: GuessGame):
+    """Starts a shared round of the group chat or repeats the event of
+    the running one."""
+    group_round, started = await game.play_group(message.chat.id)
+    event = game.events[group_round.event_id]
+    if started:
+        await message.answer(
+            f"Угадайте всем чатом год события:\n\n{event.event}\n\n"
+            "Присылайте даты в виде 1998, сдаться: /sur"
+        )
+    else:
+        await message.answer(f"Мы уже играем:\n\n{event.event}")
+
+
+@dp.message(Command(commands=["sur"]), is_group_chat)
+async def process_group_surrender_command(
+    message: Message, game: GuessGame, images: ImageCache
+):
+    """Ends the round of the group chat and reveals the event."""
+    await game.wait_for_events()
+    group_round = game.groups.get(message.chat.id)
+    if group_round is None:
+        await message.answer("Мы еще не играем. Хотите сыграть? /play")
+        return
+    event = game.surrender_group(group_round)
+    await reveal_event(message, event, images)
+    await game.save_group_scores()
+
+
 @dp.message(Command(commands=["play"]))
-async def process_play_command(message: Message):
+async def process_play_command(message: Message, game: GuessGame):
     """Process the play command for the historical date guessing game.
 
     This function starts a new round of the game. The function retrieves
     the next event from the game memory and sends it to the user for guessing.
     """
-    event = game.play(message.from_user.id)
+    event = await game.play(message.from_user.id)
     await message.answer(event.event)
 
 
 @dp.message(Command(commands=["sur"]))
-async def process_surrender_command(message: Message):
+async def process_surrender_command(
+    message: Message, game: GuessGame, images: ImageCache
+):
     """Process the surrender command for the historical date guessing game.
 
     This function processes the surrender command from the user during a round
@@ -90,20 +287,25 @@ async def process_surrender_command(message: Message):
     the correct event from the game memory, sends it to the user,
     and updates the user's statistics in the database.
     """
-    player = game.get_player(message.from_user.id)
-    if not player.in_game:
+    player = await game.get_player(message.from_user.id)
+    await game.wait_for_events()
+    match = game.duels.get(player._id)
+    if match:
+        event = game.leave_duel(player, match)
+        await reveal_event(message, event, images)
+        await bot.send_message(
+            match.opponent(player._id),
+            f"Соперник сдался, дуэль окончена.\n{event.explain()}",
+        )
+    elif not player.in_game:
         await message.answer("Мы еще не играем. Хотите сыграть? /play")
     else:
         event = game.surrender(player)
-        await message.answer(event.explain())
-        if image := event.get_image_file():
-            await bot.send_photo(message.chat.id, image)
-        if event.description:
-            await message.answer(event.description)
+        await reveal_event(message, event, images)
 
 
 @dp.message(Command(commands=["cancel"]))
-async def process_cancel_command(message: Message):
+async def process_cancel_command(message: Message, game: GuessGame):
     """Process the cancel command for the historical date guessing game.
 
     This function processes the cancel command from the user during a round of
@@ -111,8 +313,10 @@ async def process_cancel_command(message: Message):
     current game and sends a message to the user indicating that the user
     have left the game.
     """
-    player = game.get_player(message.from_user.id)
-    if not player.in_game:
+    player = await game.get_player(message.from_user.id)
+    if game.duels.matchmaker.remove(player._id):
+        await message.answer("Вы вышли из очереди на дуэль.")
+    elif not player.in_game:
         await message.answer("Мы еще не играем. Хотите сыграть? /play")
     else:
         game.cancel(player)
@@ -123,7 +327,7 @@ async def process_cancel_command(message: Message):
 
 
 @dp.message(Command(commands=["stat"]))
-async def process_stat_command(message: Message):
+async def process_stat_command(message: Message, game: GuessGame):
     """Handles the stat command, which retrieves the statistics of the player.
 
     The statistics include:
@@ -135,8 +339,10 @@ async def process_stat_command(message: Message):
                                   successfully guessed.
         Average number of attempts per answer: the average number of attempts
                                 the player takes to guess the date of an event.
+        Rank: the place of the player on the leaderboard.
     """
-    player = game.get_player(message.from_user.id)
+    player = await game.get_player(message.from_user.id)
+    await game.wait_for_leaderboard()
     gussed_events_num = len(player.guessed_events)
     try:
         attempts_average = round(player.attempts / gussed_events_num)
@@ -146,12 +352,143 @@ async def process_stat_command(message: Message):
         f"Очки: {player.score}\n"
         f"Общее число попыток: {player.attempts}\n"
         f"Угаданных дат: {gussed_events_num}\n"
-        f"Среднее кол-во попыток на ответ: {attempts_average}"
+        f"Среднее кол-во попыток на ответ: {attempts_average}\n"
+        f"Место в рейтинге: {game.leaderboard.rank(player._id)} "
+        f"из {len(game.leaderboard)}"
     )
 
 
+@dp.message(Command(commands=["top"]))
+async def process_top_command(message: Message, game: GuessGame):
+    """Sends a page of the leaderboard, e.g. `/top 2` for the second page.
+
+    The leaderboard is kept in memory, so the command doesn't query
+    the database.
+    """
+    args = message.text.split()[1:]
+    page = int(args[0]) if args and args[0].isdigit() else 1
+    page = max(page, 1)
+    offset = (page - 1) * TOP_PAGE_SIZE
+    await game.wait_for_leaderboard()
+    players = game.leaderboard.top(offset, TOP_PAGE_SIZE)
+    if not players:
+        await message.answer("На этой странице никого нет. /top")
+        return
+    lines = [f"Таблица лидеров, страница {page}:"]
+    for player_id, score in players:
+        place = game.leaderboard.rank(player_id)
+        you = " (вы)" if player_id == message.from_user.id else ""
+        lines.append(f"{place}. Игрок {player_id}{you} - {score}")
+    if offset + TOP_PAGE_SIZE < len(game.leaderboard):
+        lines.append(f"\nДальше: /top {page + 1}")
+    await message.answer("\n".join(lines))
+
+
+@dp.message(Command(commands=["duel"]))
+async def process_duel_command(message: Message, game: GuessGame):
+    """Puts the player into the duel queue or starts a duel.
+
+    Players are paired by score. Both players get the same event and
+    the first one to guess its date wins.
+    """
+    player = await game.get_player(message.from_user.id)
+    if game.duels.get(player._id):
+        await message.answer("Вы уже в дуэли. Присылайте дату или /sur.")
+        return
+    if player._id in game.duels.matchmaker:
+        await message.answer("Ищем соперника... Выйти из очереди: /cancel")
+        return
+    await game.wait_for_events()
+    match, event = game.duel(player)
+    if match is None:
+        await message.answer(
+            "Ищем соперника с близким числом очков. "
+            "Выйти из очереди: /cancel"
+        )
+        return
+    text = f"Дуэль! Кто первым угадает год события:\n\n{event.event}"
+    await message.answer(text)
+    await bot.send_message(match.opponent(player._id), text)
+
+
+@dp.message(Command(commands=["broadcast"]), is_admin_chat)
+async def process_broadcast_command(
+    message: Message, broadcaster: Broadcaster
+):
+    """Sends the text after the command to all players, e.g.
+    `/broadcast Новые события!`, or shows the progress of the running
+    broadcast if there is no text.
+
+    Players are sent to in the background, the admin chat is notified
+    when the broadcast is finished.
+    """
+    args = message.text.split(maxsplit=1)[1:]
+    if not args:
+        broadcast = await broadcaster.broadcasts_dao.get_running()
+        if broadcast is None:
+            await message.answer(
+                "Рассылок нет. Начать рассылку: /broadcast текст"
+            )
+        else:
+            await message.answer(
+                f"Идет рассылка:\n{describe_broadcast(broadcast)}\n\n"
+                "Остановить: /broadcast_stop"
+            )
+        return
+    if await broadcaster.broadcast(args[0]) is None:
+        await message.answer(
+            "Уже идет другая рассылка. Остановить: /broadcast_stop"
+        )
+    else:
+        await message.answer("Рассылка началась. Прогресс: /broadcast")
+
+
+@dp.message(Command(commands=["broadcast_stop"]), is_admin_chat)
+async def process_broadcast_stop_command(
+    message: Message, broadcaster: Broadcaster
+):
+    """Stops the running broadcast."""
+    if await broadcaster.stop_broadcast() is None:
+        await message.answer("Рассылок нет.")
+    else:
+        await message.answer("Рассылка остановлена.")
+
+
+@dp.message(lambda x: x.text and x.text.isdigit(), is_group_chat)
+async def process_group_date_answer(
+    message: Message, game: GuessGame, images: ImageCache
+):
+    """Records a guess of a member of the group chat.
+
+    Only the right guess is answered, wrong ones are summarized by
+    `notify_group_rounds`. Numbers sent when the chat doesn't play are
+    ignored.
+    """
+    group_round = game.groups.get(message.chat.id)
+    date = int(message.text)
+    if group_round is None or not 0 <= date <= 2023:
+        return
+    event = game.group_guess(group_round, message.from_user.id, date)
+    if event is None:
+        return
+    await message.reply(
+        f"{message.from_user.full_name} угадал(а)! +10 очков.\n"
+        f"Попыток: {group_round.attempts}, "
+        f"участников: {len(group_round.participants)}."
+    )
+    await reveal_event(message, event, images)
+    await game.save_group_scores()
+
+
+@dp.message(is_group_chat)
+async def process_group_other_messages(message: Message):
+    """Ignores other messages of group chats, members talk to each other."""
+
+
 @dp.message(lambda x: x.text and x.text.isdigit())
-async def process_date_answer(message: Message):
+async def process_date_answer(
+    message: Message, game: GuessGame, images: ImageCache
+):
     """Process a user's answer to a date in the current game.
 
     Validates an answer. Gets a result from the game and sends a result message
@@ -159,28 +496,38 @@ async def process_date_answer(message: Message):
     hints for guessing.
     """
     date = int(message.text)
-    player = game.get_player(message.from_user.id)
+    player = await game.get_player(message.from_user.id)
+    await game.wait_for_events()
+    match = game.duels.get(player._id)
 
-    if not player.in_game:
+    if not player.in_game and not match:
         await message.answer("Мы еще не играем. Хотите сыграть? /play")
 
     elif not 0 <= date <= 2023:
         await message.answer("Присылайте даты от 0 до 2023 года.")
 
+    elif match:
+        msg, event = game.duel_guess(player, match, date)
+        if event:
+            await message.answer(msg)
+            await reveal_event(message, event, images)
+            await bot.send_message(
+                match.opponent(player._id),
+                f"Соперник угадал первым.\n{event.explain()}",
+            )
+        else:
+            await message.answer(msg)
+
     else:
         msg, event = game.guess(player, date)
         if event:
-            await message.answer(event.explain())
-            if image := event.get_image_file():
-                await bot.send_photo(message.chat.id, image)
-            if event.description:
-                await message.answer(event.description)
+            await reveal_event(message, event, images)
         else:
             await message.answer(msg)
 
 
 @dp.message()
-async def process_other_text_answers(message: Message):
+async def process_other_text_answers(message: Message, game: GuessGame):
     """Processes the text messages that are not associated with any command.
 
     If the player is in a game, they will receive a message asking them
@@ -188,8 +535,8 @@ async def process_other_text_answers(message: Message):
     If the player is not in a game, they will receive a message asking them
     to start a game by using the "/play" command.
     """
-    player = game.get_player(message.from_user.id)
-    if player.in_game:
+    player = await game.get_player(message.from_user.id)
+    if player.in_game or game.duels.get(player._id):
         await message.answer(
             "Мы же сейчас с вами играем. "
             "Присылайте, пожалуйста, даты в виде 1998."
@@ -200,8 +547,343 @@ async def process_other_text_answers(message: Message):
         )
 
 
+async def notify_duels_expired(
+    game: GuessGame, player_ids: List[int], matches: List[Match]
+):
+    """Notifies players whose duel wait or duel timed out."""
+    messages = [
+        (player_id, "Соперник не нашелся, попробуйте позже. /duel")
+        for player_id in player_ids
+    ]
+    for match in matches:
+        event = game.events[match.event_id]
+        messages.extend(
+            (player_id, f"Время дуэли вышло.\n{event.explain()}")
+            for player_id in match.players
+        )
+    for chat_id, text in messages:
+        try:
+            await bot.send_message(chat_id, text)
+        except Exception:
+            logger.exception("Failed to notify %d about the duel.", chat_id)
+
+
+async def notify_group_rounds(
+    game: GuessGame,
+    hints: List[Tuple[GroupRound, str]],
+    expired: List[GroupRound],
+):
+    """Saves scores of ended group rounds and sends summaries of wrong
+    guesses and the events of expired rounds to group chats."""
+    await game.save_group_scores()
+    messages = [(group_round.chat_id, text) for group_round, text in hints]
+    messages.extend(
+        (
+            group_round.chat_id,
+            "Время раунда вышло.\n"
+            f"{game.events[group_round.event_id].explain()}\n"
+            "Сыграть еще: /play",
+        )
+        for group_round in expired
+    )
+    for chat_id, text in messages:
+        try:
+            await bot.send_message(chat_id, text)
+        except Exception:
+            logger.exception("Failed to notify group chat %d.", chat_id)
+
+
+async def notify_broadcast_finished(broadcast: Broadcast):
+    """Sends the result of the broadcast to the admin chat."""
+    if ADMIN_CHAT_ID is None:
+        return
+    title = (
+        "Рассылка завершена"
+        if broadcast.status == "finished"
+        else "Рассылка остановлена"
+    )
+    await bot.send_message(
+        ADMIN_CHAT_ID, f"{title}.\n{describe_broadcast(broadcast)}"
+    )
+
+
+async def load_images(game: GuessGame, images: ImageCache, warm_up: bool):
+    """Loads stored `file_id`s of event images and uploads the others to
+    the admin chat if `warm_up` is set."""
+    await images.load()
+    if warm_up:
+        await game.wait_for_events()
+        # Reloads of events change the dictionary while images are uploaded
+        await images.warm_up(bot, ADMIN_CHAT_ID, list(game.events.values()))
+
+
+def _log_background_error(task: asyncio.Task):
+    if not task.cancelled() and task.exception() is not None:
+        logger.error(
+            "Background task %s failed.",
+            task.get_coro().__name__,
+            exc_info=task.exception(),
+        )
+
+
+def create_webhook_server(handle_update) -> WebhookServer:
+    """Returns the webhook server passing raw updates to the handler."""
+    return WebhookServer(
+        handle_update,
+        path=WEBHOOK_PATH,
+        secret=WEBHOOK_SECRET,
+        workers=WEBHOOK_WORKERS,
+        queue_size=WEBHOOK_QUEUE_SIZE,
+    )
+
+
+async def set_webhook():
+    """Registers the webhook in Telegram if its public URL is configured."""
+    if WEBHOOK_URL:
+        await bot.set_webhook(
+            WEBHOOK_URL.rstrip("/") + WEBHOOK_PATH, secret_token=WEBHOOK_SECRET
+        )
+
+
+@asynccontextmanager
+async def setup_game(
+    database=None,
+    warm_up_images: bool = True,
+    metrics_port: int = None,
+    journal_name: str = "players",
+    shards: Optional[ShardQueues] = None,
+):
+    """Creates the game and injects it with the players DAO and the images
+    cache into the handlers.
+
+    Args:
+        database: A database to use instead of the configured one.
+        warm_up_images: Whether to upload event images in the background if
+                        `IMAGES_WARM_UP` is enabled.
+        metrics_port: A port to serve metrics on, if not set metrics are
+                      collected but not served.
+        journal_name: A name of the players journal in `JOURNAL_PATH`, every
+                      process must have its own journal.
+        shards: Queues of the worker processes if the game runs in one of
+                them.
+    """
+    database = get_async_database() if database is None else database
+    players = AsyncPlayerDao(database)
+    images = ImageCache(AsyncEventImageDao(database))
+    broadcaster = Broadcaster(
+        bot,
+        AsyncBroadcastDao(database),
+        players,
+        AsyncBlockedPlayerDao(database),
+        rate=BROADCAST_RATE,
+        workers=BROADCAST_WORKERS,
+        checkpoint_interval=BROADCAST_CHECKPOINT_INTERVAL,
+        lease=BROADCAST_LEASE,
+    )
+    journal = None
+    if JOURNAL_ENABLED:
+        journal = PlayerJournal(
+            os.path.join(JOURNAL_PATH, journal_name), JOURNAL_SYNC_INTERVAL
+        )
+    async with GuessGame(database, journal, shards) as game:
+        warm_up = bool(warm_up_images and IMAGES_WARM_UP and ADMIN_CHAT_ID)
+        tasks = [asyncio.create_task(load_images(game, images, warm_up))]
+        if metrics_port:
+            tasks.append(
+                asyncio.create_task(serve_metrics(METRICS_HOST, metrics_port))
+            )
+        for task in tasks:
+            task.add_done_callback(_log_background_error)
+        cache_collector = StatsCollector(
+            "dateduel_players_cache",
+            game.players.stats,
+            {
+                "size": lambda: len(game.players),
+                "dirty": lambda: len(game.players.dirty),
+            },
+        )
+        REGISTRY.register(cache_collector)
+        if outbound is not None:
+            outbound_collector = StatsCollector(
+                "dateduel_outbound",
+                outbound.stats,
+                {"chats": lambda: len(outbound.chats)},
+            )
+            REGISTRY.register(outbound_collector)
+        if journal is not None:
+            journal_collector = StatsCollector(
+                "dateduel_journal", journal.stats
+            )
+            REGISTRY.register(journal_collector)
+        duels_collector = StatsCollector(
+            "dateduel_duels",
+            game.duels.stats,
+            {
+                "waiting": lambda: len(game.duels.matchmaker),
+                "playing": lambda: len(game.duels.matches),
+            },
+        )
+        REGISTRY.register(duels_collector)
+        groups_collector = StatsCollector(
+            "dateduel_groups",
+            game.groups.stats,
+            {
+                "playing": lambda: len(game.groups),
+                "unsaved": lambda: len(game.groups.unsaved),
+            },
+        )
+        REGISTRY.register(groups_collector)
+        rounds_collector = StatsCollector(
+            "dateduel_rounds",
+            game.rounds.stats,
+            {"pending": lambda: len(game.rounds)},
+        )
+        REGISTRY.register(rounds_collector)
+        telemetry_collector = StatsCollector(
+            "dateduel_telemetry",
+            game.telemetry.stats,
+            {"buffered": lambda: len(game.telemetry.buffer)},
+        )
+        REGISTRY.register(telemetry_collector)
+        broadcast_collector = StatsCollector(
+            "dateduel_broadcast",
+            broadcaster.stats,
+            {"running": lambda: int(broadcaster.current is not None)},
+        )
+        REGISTRY.register(broadcast_collector)
+        game.duels.start_expiring(
+            functools.partial(notify_duels_expired, game)
+        )
+        game.groups.start_hinting(functools.partial(notify_group_rounds, game))
+        broadcaster.start(notify_broadcast_finished)
+        dp.workflow_data.update(
+            game=game, players=players, images=images, broadcaster=broadcaster
+        )
+        try:
+            yield game
+        finally:
+            await broadcaster.stop()
+            REGISTRY.unregister(broadcast_collector)
+            REGISTRY.unregister(cache_collector)
+            REGISTRY.unregister(duels_collector)
+            REGISTRY.unregister(groups_collector)
+            REGISTRY.unregister(rounds_collector)
+            REGISTRY.unregister(telemetry_collector)
+            if outbound is not None:
+                REGISTRY.unregister(outbound_collector)
+            if journal is not None:
+                REGISTRY.unregister(journal_collector)
+            for task in tasks:
+                task.cancel()
+
+
+async def recover_other_journals(journal_names: List[str]):
+    """Replays journals other than the ones of the processes about to
+    start, e.g. after `WORKERS` was changed."""
+    if JOURNAL_ENABLED and os.path.isdir(JOURNAL_PATH):
+        players = AsyncPlayerDao(get_async_database())
+        await recover_journals(JOURNAL_PATH, players, keep=journal_names)
+
+
+async def save_left_scores(items: List[dict]):
+    """Adds score changes left in the queues of stopped workers to
+    the players in the database."""
+    scores: Dict[int, List[int]] = {}
+    updates = 0
+    for item in items:
+        if SCORE_CHANGES not in item:
+            updates += 1
+            continue
+        for player_id, (score, attempts) in item[SCORE_CHANGES].items():
+            entry = scores.setdefault(player_id, [0, 0])
+            entry[0] += score
+            entry[1] += attempts
+    if updates:
+        logger.warning("Dropped %d updates left in the queues.", updates)
+    if scores:
+        players = AsyncPlayerDao(get_async_database())
+        await players.add_scores(scores)
+
+
+async def run_shard(index: int, queues: List[Queue]):
+    """Processes updates routed to the worker process and score changes of
+    its players from group rounds of other workers."""
+    shards = ShardQueues(index, queues)
+    # Every worker serves its own metrics on the next port
+    metrics_port = METRICS_PORT + index if METRICS_PORT else None
+    async with setup_game(
+        warm_up_images=index == 0,
+        metrics_port=metrics_port,
+        journal_name=f"players-{index}",
+        shards=shards,
+    ) as game:
+
+        async def handle_update(update: dict):
+            scores = update.get(SCORE_CHANGES)
+            if scores is None:
+                await dp.feed_raw_update(bot, update)
+                return
+            game.groups.add_unsaved(scores)
+            await game.save_group_scores()
+
+        await consume(
+            shards.updates, handle_update, concurrency=WEBHOOK_WORKERS
+        )
+
+
+def run_worker(index: int, queues: List[Queue]):
+    """Entry point of a worker process, see `sharding.ShardRouter`."""
+    logging.basicConfig(level=logging.INFO)
+    asyncio.run(run_shard(index, queues))
+
+
+async def run_front():
+    """Receives updates and routes them to the worker processes."""
+    # Import the worker entry point from the `bot` module, so spawned
+    # processes can find it when this module runs as `__main__`
+    from bot import run_worker
+
+    await recover_other_journals([f"players-{i}" for i in range(WORKERS)])
+    router = ShardRouter(WORKERS, run_worker)
+    router.start()
+    supervisor = asyncio.create_task(router.supervise())
+    try:
+        if BOT_MODE == "webhook":
+            await set_webhook()
+            server = create_webhook_server(router.route_async)
+            await server.serve(WEBHOOK_HOST, WEBHOOK_PORT)
+        else:
+            await poll_updates(router.route_async, BOT_TOKEN)
+    finally:
+        supervisor.cancel()
+        await save_left_scores(await router.stop())
+
+
+async def main():
+    """Starts receiving updates with the game and the players DAO injected
+    into the handlers."""
+    logging.basicConfig(level=logging.INFO)
+    loop = asyncio.get_running_loop()
+    # Stop gracefully on `docker stop` to save the cached players
+    loop.add_signal_handler(signal.SIGTERM, asyncio.current_task().cancel)
+    if WORKERS > 1:
+        await run_front()
+        return
+
+    await recover_other_journals(["players"])
+    async with setup_game(metrics_port=METRICS_PORT):
+        if BOT_MODE == "webhook":
+            await set_webhook()
+            server = create_webhook_server(
+                lambda update: dp.feed_raw_update(bot, update)
+            )
+            await server.serve(WEBHOOK_HOST, WEBHOOK_PORT)
+        else:
+            await dp.start_polling(bot)
+
+
 if __name__ == "__main__":
-    database: Database = get_database()
-    players: PlayerDao = PlayerDao(database)
-    with GuessGame(database) as game:
-        dp.run_polling(bot)
+    try:
+        asyncio.run(main())
+    except asyncio.CancelledError:
+        pass
@@ -0,0 +1,341 @@
+"""Announcements sent by the admin to all players.
+
+`Broadcaster` streams player ids from the `Players` collection in ascending
+order with a cursor fetching only ids, so the players are never loaded
+into memory. A pool of workers sends the message at most at the broadcast
+rate, on top of the flood limits of `outbound.OutboundLimiter`, so game
+replies still get through during a broadcast.
+
+Progress is checkpointed to the `Broadcasts` collection: `last_id` is
+the id up to which every player was handled, and it only moves over ids
+whose sends completed. A broadcast of a crashed process is resumed by
+another one after the id (see `dao.AsyncBroadcastDao`), so players sent to
+by the workers after the last checkpoint may get the message twice.
+
+Players who blocked the bot are recorded in the `BlockedPlayers` collection
+and skipped by later broadcasts. Both collections are read in id order, so
+the skipping is a merge of two cursors.
+
+"""
+import asyncio
+import logging
+import os
+import socket
+import time
+from collections import deque
+from typing import (
+    AsyncIterator,
+    Awaitable,
+    Callable,
+    Deque,
+    Dict,
+    List,
+    Optional,
+)
+
+from aiogram import Bot
+from aiogram.exceptions import TelegramForbiddenError, TelegramRetryAfter
+
+from dao import AsyncBlockedPlayerDao, AsyncBroadcastDao, AsyncPlayerDao
+from models import Broadcast
+from outbound import TokenBucket
+
+
+logger = logging.getLogger(__name__)
+
+FinishCallback = Callable[[Broadcast], Awaitable]
+
+
+class Broadcaster:
+    """Sends broadcasts with a pool of workers and resumes crashed ones.
+
+    Properties:
+        bot: The bot to send messages with.
+        broadcasts_dao: An instance of `AsyncBroadcastDao`.
+        players_dao: An instance of `AsyncPlayerDao` to stream players ids.
+        blocked_dao: An instance of `AsyncBlockedPlayerDao`.
+        bucket: A bucket of sent messages, None if the rate is not limited.
+        workers: A number of messages sent at the same time.
+        checkpoint_interval: Seconds between checkpoints.
+        lease: Seconds without checkpoints after which a broadcast is
+               considered crashed and resumed.
+        max_retries: How many times a message is retried after flood errors.
+        owner: The name of the process in the `Broadcasts` collection.
+        current: The broadcast being sent by the process.
+        stats: Counters of sent messages, blocked, skipped and failed
+               players and resumed broadcasts.
+
+    """
+
+    bot: Bot
+    broadcasts_dao: AsyncBroadcastDao
+    players_dao: AsyncPlayerDao
+    blocked_dao: AsyncBlockedPlayerDao
+    bucket: Optional[TokenBucket]
+    workers: int
+    checkpoint_interval: float
+    lease: float
+    max_retries: int
+    owner: str
+    current: Optional[Broadcast]
+    stats: Dict[str, int]
+
+    def __init__(
+        self,
+        bot: Bot,
+        broadcasts_dao: AsyncBroadcastDao,
+        players_dao: AsyncPlayerDao,
+        blocked_dao: AsyncBlockedPlayerDao,
+        rate: float = 20,
+        workers: int = 8,
+        checkpoint_interval: float = 5,
+        lease: float = 60,
+        max_retries: int = 3,
+    ):
+        self.bot = bot
+        self.broadcasts_dao = broadcasts_dao
+        self.players_dao = players_dao
+        self.blocked_dao = blocked_dao
+        self.bucket = TokenBucket(rate, 1) if rate else None
+        self.workers = workers
+        self.checkpoint_interval = checkpoint_interval
+        self.lease = lease
+        self.max_retries = max_retries
+        self.owner = f"{socket.gethostname()}:{os.getpid()}"
+        self.current = None
+        self.stats = dict.fromkeys(
+            ("sent", "blocked", "skipped", "failed", "resumed"), 0
+        )
+        # Sends in the order of ids as `[player_id, done]`, the done ones
+        # at the front move `last_id` of the current broadcast
+        self._pending: Deque[list] = deque()
+        # Players who blocked the bot, not recorded in the database yet
+        self._blocked: List[int] = []
+        self._task: Optional[asyncio.Task] = None
+        self._sending: Optional[asyncio.Task] = None
+        self._on_finish: Optional[FinishCallback] = None
+        # Set on shutdown to stop taking new recipients
+        self._closing = False
+
+    async def broadcast(self, text: str) -> Optional[Broadcast]:
+        """Starts sending the text to all players in the background.
+
+        Returns:
+            The started broadcast or None if another one is running.
+        """
+        if self.current is not None:
+            return None
+        if await self.broadcasts_dao.get_running() is not None:
+            return None
+        broadcast = await self.broadcasts_dao.create(text, self.owner)
+        self._send_in_background(broadcast)
+        return broadcast
+
+    async def stop_broadcast(self) -> Optional[Broadcast]:
+        """Stops the running broadcast, whichever process sends it.
+
+        Returns:
+            The stopped broadcast or None if there was no running one.
+        """
+        return await self.broadcasts_dao.stop()
+
+    async def iter_recipients(
+        self, broadcast: Broadcast
+    ) -> AsyncIterator[int]:
+        """Yields ids of players to send the broadcast to after its
+        `last_id` skipping the blocked players."""
+        blocked = aiter(self.blocked_dao.iter_ids(broadcast.last_id))
+        next_blocked = await anext(blocked, None)
+        async for player_id in self.players_dao.iter_ids(broadcast.last_id):
+            while next_blocked is not None and next_blocked < player_id:
+                next_blocked = await anext(blocked, None)
+            if player_id == next_blocked:
+                broadcast.skipped += 1
+                self.stats["skipped"] += 1
+                continue
+            yield player_id
+
+    async def _send(self, broadcast: Broadcast, player_id: int):
+        for attempt in range(self.max_retries + 1):
+            if self.bucket is not None:
+                delay = self.bucket.reserve()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+            try:
+                await self.bot.send_message(player_id, broadcast.text)
+            except TelegramRetryAfter as error:
+                if attempt == self.max_retries:
+                    break
+                if self.bucket is not None:
+                    self.bucket.pause(error.retry_after)
+                else:
+                    await asyncio.sleep(error.retry_after)
+                continue
+            except TelegramForbiddenError:
+                broadcast.blocked += 1
+                self.stats["blocked"] += 1
+                self._blocked.append(player_id)
+                return
+            except Exception as error:
+                logger.warning(
+                    "Failed to send the broadcast to %d: %s", player_id, error
+                )
+                break
+            else:
+                broadcast.sent += 1
+                self.stats["sent"] += 1
+                return
+        broadcast.failed += 1
+        self.stats["failed"] += 1
+
+    async def _work(self, broadcast: Broadcast, queue: asyncio.Queue):
+        while True:
+            sending = await queue.get()
+            try:
+                await self._send(broadcast, sending[0])
+            finally:
+                sending[1] = True
+                while self._pending and self._pending[0][1]:
+                    broadcast.last_id = self._pending.popleft()[0]
+                queue.task_done()
+
+    async def _save(self, broadcast: Broadcast, release: bool = False) -> bool:
+        """Saves the checkpoint and the blocked players.
+
+        Returns:
+            Whether the process still owns the broadcast.
+        """
+        blocked, self._blocked = self._blocked, []
+        try:
+            await self.blocked_dao.add_many(blocked)
+        except Exception:
+            self._blocked.extend(blocked)
+            logger.exception(
+                "Failed to save %d blocked players.", len(blocked)
+            )
+        return await self.broadcasts_dao.save(broadcast, self.owner, release)
+
+    async def send(self, broadcast: Broadcast):
+        """Sends the broadcast to the players after its `last_id` and marks
+        it finished, or stopped if it was stopped meanwhile.
+
+        If the process is closing, the queued messages are sent and
+        the broadcast is released for another process to resume.
+        """
+        queue = asyncio.Queue(self.workers * 2)
+        workers = [
+            asyncio.create_task(self._work(broadcast, queue))
+            for _ in range(self.workers)
+        ]
+        self._pending.clear()
+        checkpoint_at = time.monotonic() + self.checkpoint_interval
+        try:
+            async for player_id in self.iter_recipients(broadcast):
+                sending = [player_id, False]
+                self._pending.append(sending)
+                await queue.put(sending)
+                if self._closing:
+                    break
+                if time.monotonic() >= checkpoint_at:
+                    checkpoint_at = time.monotonic() + self.checkpoint_interval
+                    if not await self._save(broadcast):
+                        broadcast.status = "stopped"
+                        return
+            await queue.join()
+        finally:
+            for worker in workers:
+                worker.cancel()
+        if self._closing:
+            await self._save(broadcast, release=True)
+            return
+        broadcast.status = "finished"
+        if not await self._save(broadcast):
+            broadcast.status = "stopped"
+
+    async def _send_current(self):
+        broadcast = self.current
+        try:
+            await self.send(broadcast)
+        except asyncio.CancelledError:
+            # Let another process resume it without waiting for the lease
+            await self._save(broadcast, release=True)
+            raise
+        except Exception:
+            logger.exception("Broadcast %s failed.", broadcast._id)
+            return
+        finally:
+            self.current = None
+        if broadcast.status == "running":
+            return
+        logger.info(
+            "Broadcast %s %s: %d sent, %d blocked, %d skipped, %d failed.",
+            broadcast._id,
+            broadcast.status,
+            broadcast.sent,
+            broadcast.blocked,
+            broadcast.skipped,
+            broadcast.failed,
+        )
+        if self._on_finish is not None:
+            try:
+                await self._on_finish(broadcast)
+            except Exception:
+                logger.exception("Failed to notify about the broadcast.")
+
+    def _send_in_background(self, broadcast: Broadcast):
+        self.current = broadcast
+        self._sending = asyncio.create_task(self._send_current())
+
+    async def run(self):
+        """Resumes broadcasts whose lease expired in a loop."""
+        while True:
+            if self.current is None:
+                try:
+                    broadcast = await self.broadcasts_dao.claim(
+                        self.owner, self.lease
+                    )
+                except Exception:
+                    logger.exception("Failed to claim a broadcast.")
+                else:
+                    if broadcast is not None:
+                        logger.info(
+                            "Resuming broadcast %s after player %s.",
+                            broadcast._id,
+                            broadcast.last_id,
+                        )
+                        self.stats["resumed"] += 1
+                        self._send_in_background(broadcast)
+            await asyncio.sleep(self.lease / 2)
+
+    def start(self, on_finish: Optional[FinishCallback] = None):
+        """Starts resuming crashed broadcasts in the background.
+
+        Args:
+            on_finish: A coroutine function called with every broadcast
+                       finished or stopped in the process.
+        """
+        self._on_finish = on_finish
+        if self._task is None:
+            self._task = asyncio.create_task(self.run())
+
+    async def stop(self):
+        """Stops the background tasks and releases the current broadcast,
+        so another process resumes it.
+
+        Messages already queued are sent within `checkpoint_interval`,
+        the ones left are cancelled and may be sent again on resume.
+        """
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        if self._sending is not None:
+            self._closing = True
+            try:
+                await asyncio.wait_for(self._sending, self.checkpoint_interval)
+            except (asyncio.CancelledError, asyncio.TimeoutError):
+                pass
+            self._sending = None
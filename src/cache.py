@@ -0,0 +1,235 @@
+"""Write-behind cache of players for the date guessing game.
+
+The cache keeps recently used players in memory, tracks which of them were
+changed since the last save and periodically writes only the changed
+players to the database with one bulk write. Clean players are evicted when
+they are idle for too long or when the cache exceeds its size limit.
+Changes made between flushes are kept in the optional write-ahead journal.
+
+"""
+import asyncio
+import logging
+import time
+from collections import OrderedDict
+from typing import Dict, Iterator, Optional, Set
+
+from dao import AsyncPlayerDao
+from journal import PlayerJournal
+from models import Player
+
+
+logger = logging.getLogger(__name__)
+
+
+class PlayerCache:
+    """LRU cache of players with dirty tracking and a background flush.
+
+    Properties:
+        players_dao: An instance of `AsyncPlayerDao` to save players with.
+        max_size: Max number of cached players. Dirty players are never
+                  evicted, so the limit can be exceeded until the next flush.
+        ttl: Seconds after the last access when a clean player is evicted.
+        flush_interval: Seconds between periodic flushes of dirty players.
+        flush_changes: Number of changes after which a flush is started
+                       before the interval expires.
+        journal: A `PlayerJournal` to write every change to or `None`.
+        players: An ordered dictionary mapping from player id to `Player`
+                 instance; the least recently used players go first.
+        dirty: Ids of players changed since the last flush.
+        stats: Cache counters - hits, misses, evictions, flushes, flushed
+               players and failed flushes.
+
+    """
+
+    players_dao: AsyncPlayerDao
+    max_size: int
+    ttl: float
+    flush_interval: float
+    flush_changes: int
+    journal: Optional[PlayerJournal]
+    players: "OrderedDict[int, Player]"
+    dirty: Set[int]
+    stats: Dict[str, int]
+
+    def __init__(
+        self,
+        players_dao: AsyncPlayerDao,
+        max_size: int,
+        ttl: float,
+        flush_interval: float,
+        flush_changes: int,
+        journal: Optional[PlayerJournal] = None,
+    ):
+        self.players_dao = players_dao
+        self.max_size = max_size
+        self.ttl = ttl
+        self.flush_interval = flush_interval
+        self.flush_changes = flush_changes
+        self.journal = journal
+        self.players = OrderedDict()
+        self.dirty = set()
+        self.stats = dict.fromkeys(
+            ("hits", "misses", "evictions", "flushes", "flushed", "errors"), 0
+        )
+        self._accessed_at: Dict[int, float] = {}
+        self._flushing: Set[int] = set()
+        self._changes = 0
+        self._flush_requested = asyncio.Event()
+        self._flush_lock = asyncio.Lock()
+        self._task: Optional[asyncio.Task] = None
+
+    def __len__(self) -> int:
+        return len(self.players)
+
+    def __contains__(self, player_id: int) -> bool:
+        return player_id in self.players
+
+    def values(self) -> Iterator[Player]:
+        return iter(self.players.values())
+
+    def get(self, player_id: int) -> Optional[Player]:
+        """Returns a cached player and marks it as recently used.
+
+        Args:
+            player_id: Player's unique identifier.
+
+        Returns:
+            The cached player or `None` if the player is not cached.
+        """
+        player = self.players.get(player_id)
+        if player is None:
+            self.stats["misses"] += 1
+            return None
+        self.stats["hits"] += 1
+        self.players.move_to_end(player_id)
+        self._accessed_at[player_id] = time.monotonic()
+        return player
+
+    def peek(self, player_id: int) -> Optional[Player]:
+        """Returns a cached player without marking it as recently used."""
+        return self.players.get(player_id)
+
+    def expire(self, player_id: int):
+        """Makes the player the first to evict, it's evicted with the next
+        `evict` after its changes are saved."""
+        if player_id in self.players:
+            self.players.move_to_end(player_id, last=False)
+            self._accessed_at[player_id] = float("-inf")
+
+    def add(self, player: Player) -> Player:
+        """Adds a clean player to the cache.
+
+        If the player is already cached the cached instance is kept.
+
+        Returns:
+            The cached player instance.
+        """
+        player = self.players.setdefault(player._id, player)
+        self.players.move_to_end(player._id)
+        self._accessed_at[player._id] = time.monotonic()
+        if len(self.players) > self.max_size:
+            self.evict()
+        return player
+
+    def mark_dirty(self, player: Player):
+        """Marks the player as changed, so it is saved on the next flush."""
+        if player._id not in self.players:
+            self.add(player)
+        if self.journal is not None:
+            self.journal.append(player)
+        self.dirty.add(player._id)
+        self._changes += 1
+        if self._changes >= self.flush_changes:
+            self._flush_requested.set()
+
+    def evict(self, now: Optional[float] = None) -> int:
+        """Evicts least recently used clean players.
+
+        A player is evicted if the cache is over the size limit or the player
+        has been idle for longer than `ttl`.
+
+        Returns:
+            A number of evicted players.
+        """
+        now = time.monotonic() if now is None else now
+        size = len(self.players)
+        evicted = []
+        for player_id in self.players:
+            idle = now - self._accessed_at[player_id] >= self.ttl
+            if size <= self.max_size and not idle:
+                break
+            if player_id not in self.dirty and player_id not in self._flushing:
+                evicted.append(player_id)
+                size -= 1
+        for player_id in evicted:
+            del self.players[player_id]
+            del self._accessed_at[player_id]
+
+        if len(self.players) > self.max_size:
+            # Only dirty players are left above the limit
+            self._flush_requested.set()
+        self.stats["evictions"] += len(evicted)
+        return len(evicted)
+
+    async def flush(self):
+        """Saves dirty players to the database with one bulk write.
+
+        If the write fails the players stay dirty and are saved on the next
+        flush.
+        """
+        async with self._flush_lock:
+            if not self.dirty:
+                return
+            # Players changed while the write is in progress become dirty
+            # again, the ones being written must not be evicted until then
+            dirty = self._flushing = self.dirty
+            self.dirty = set()
+            self._changes = 0
+            self._flush_requested.clear()
+            if self.journal is not None:
+                # Changes from now on go to a new journal segment
+                segment = self.journal.rotate()
+            try:
+                await self.players_dao.save_many(
+                    self.players[player_id] for player_id in dirty
+                )
+            except Exception:
+                self.dirty |= dirty
+                self.stats["errors"] += 1
+                logger.exception("Failed to flush %d players.", len(dirty))
+                return
+            finally:
+                self._flushing = set()
+            if self.journal is not None:
+                self.journal.compact(segment)
+            self.stats["flushes"] += 1
+            self.stats["flushed"] += len(dirty)
+            logger.debug("Flushed %d players: %s.", len(dirty), self.stats)
+
+    async def run(self):
+        """Flushes dirty players and evicts idle ones in a loop."""
+        while True:
+            try:
+                await asyncio.wait_for(
+                    self._flush_requested.wait(), self.flush_interval
+                )
+            except asyncio.TimeoutError:
+                pass
+            await self.flush()
+            self.evict()
+
+    def start(self):
+        """Starts the background flush task."""
+        if self._task is None:
+            self._task = asyncio.create_task(self.run())
+
+    async def stop(self):
+        """Stops the background flush task and saves all dirty players."""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.flush()
@@ -1,57 +1,275 @@
-"""Module to manage the project configuration settings."""
-import os
-from pathlib import Path
+"""Module to manage the project configuration settings.
 
-from dotenv import load_dotenv
+Settings are resolved lazily: a setting is read from the environment on
+first access (`from config import BOT_TOKEN` or `config.BOT_TOKEN`) and
+then kept in the module, so a process doesn't parse or require variables it
+never uses. The `.env` file is loaded before the first variable is read.
 
-
-# Parse a `.env` file and load the variables inside into environment variables
-load_dotenv()
+"""
+import os
+from pathlib import Path
+from typing import Any, Callable, Dict
 
 
 class ImproperlyConfigured(Exception):
-    """Raises when a environment variable is missing."""
+    """Raises when a environment variable is missing or has a wrong
+    value."""
 
-    def __init__(self, variable_name, *args, **kwargs):
+    def __init__(self, variable_name, message=None, *args, **kwargs):
         self.variable_name = variable_name
-        self.message = f"Set the {variable_name} environment variable."
+        self.message = (
+            message or f"Set the {variable_name} environment variable."
+        )
         super().__init__(self.message, *args, **kwargs)
 
 
-def get_env_variable(var_name: str, cast=str) -> str:
+_NOT_SET = object()
+
+_dotenv_loaded = False
+
+
+def load_dotenv():
+    """Parses a `.env` file and loads the variables inside into environment
+    variables, only once."""
+    global _dotenv_loaded
+    if not _dotenv_loaded:
+        import dotenv
+
+        dotenv.load_dotenv()
+        _dotenv_loaded = True
+
+
+def to_bool(value: str) -> bool:
+    """Casts an environment variable value like `1`, `true`, `yes` to bool."""
+    return value.strip().lower() in ("1", "true", "yes", "on")
+
+
+def one_of(*choices: str) -> Callable[[str], str]:
+    """Returns a cast of an environment variable value which must be one
+    of the choices."""
+
+    def cast(value: str) -> str:
+        if value not in choices:
+            raise ValueError(f"use one of {', '.join(choices)}")
+        return value
+
+    return cast
+
+
+def get_env_variable(var_name: str, cast=str, default=_NOT_SET) -> str:
     """Get an environment variable or raise an exception.
 
     Args:
         var_name: a name of a environment variable.
+        cast: a callable to convert the raw string value.
+        default: a value to return if the variable is not set. If omitted
+                 the variable is required.
 
     Returns:
         A value of the environment variable.
 
     Raises:
-        ImproperlyConfigured: if the environment variable is not set.
+        ImproperlyConfigured: if the environment variable is not set and
+                              there is no default, or the cast rejects
+                              its value.
     """
+    load_dotenv()
+    # An empty optional variable (e.g. `ADMIN_CHAT_ID=`) falls back to default
+    if default is not _NOT_SET and not os.environ.get(var_name):
+        return default
     try:
         return cast(os.environ[var_name])
     except KeyError:
         raise ImproperlyConfigured(var_name)
+    except ValueError as error:
+        raise ImproperlyConfigured(
+            var_name,
+            f"The {var_name} environment variable has a wrong value "
+            f"{os.environ[var_name]!r}: {error}.",
+        )
     except TypeError:
         raise TypeError(f"Variable {var_name} must be type {cast}.")
 
 
+# Functions resolving the lazy settings by name, see `__getattr__`
+_SETTINGS: Dict[str, Callable[[], Any]] = {}
+
+
+def _env(name: str, cast=str, default=_NOT_SET, var_name: str = None):
+    """Declares a setting read from the environment variable of the same
+    name or `var_name`."""
+    _SETTINGS[name] = lambda: get_env_variable(var_name or name, cast, default)
+
+
+def _computed(name: str, resolve: Callable[[], Any]):
+    """Declares a setting computed by the function."""
+    _SETTINGS[name] = resolve
+
+
+def __getattr__(name: str) -> Any:
+    """Resolves a lazy setting on first access and keeps its value."""
+    try:
+        resolve = _SETTINGS[name]
+    except KeyError:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    value = globals()[name] = resolve()
+    return value
+
+
+def __dir__():
+    return sorted(set(globals()) | set(_SETTINGS))
+
+
 BASE_PATH: str = Path(__file__).resolve().parent.parent
 RESOURCES_PATH: str = os.path.join(BASE_PATH, "res/")
 
-BOT_TOKEN: str = get_env_variable("BOT_TOKEN")
+_env("BOT_TOKEN")
+
+_env("MONGO_HOST")
+_env("MONGO_PORT", cast=int)
+_env("MONGO_USERNAME", var_name="MONGO_INITDB_ROOT_USERNAME")
+_env("MONGO_PASSWORD", var_name="MONGO_INITDB_ROOT_PASSWORD")
+_env("MONGO_DATABASE", var_name="MONGO_INITDB_DATABASE")
+_computed(
+    "MONGO_CONNECTION_URI",
+    lambda: (
+        f"mongodb://{__getattr__('MONGO_USERNAME')}:"
+        f"{__getattr__('MONGO_PASSWORD')}@{__getattr__('MONGO_HOST')}:"
+        f"{__getattr__('MONGO_PORT')}/"
+    ),
+)
+# Connection pool tuning, see `pymongo.MongoClient` options
+_env("MONGO_MAX_POOL_SIZE", cast=int, default=100)
+_env("MONGO_MIN_POOL_SIZE", cast=int, default=0)
+_env("MONGO_MAX_IDLE_TIME_MS", cast=int, default=60000)
+_env("MONGO_WAIT_QUEUE_TIMEOUT_MS", cast=int, default=5000)
+
+_computed(
+    "EVENTS_FILE_PATH",
+    lambda: os.path.join(RESOURCES_PATH, get_env_variable("EVENTS_FILE_PATH")),
+)
+
+# Write-behind players cache, see `cache.PlayerCache`
+_env("PLAYERS_CACHE_SIZE", cast=int, default=10000)
+_env("PLAYERS_CACHE_TTL", cast=float, default=3600)
+_env("PLAYERS_FLUSH_INTERVAL", cast=float, default=5)
+_env("PLAYERS_FLUSH_CHANGES", cast=int, default=500)
+
+# Order of events given to players, see `selection.ORDERS`
+_env("EVENTS_ORDER", default="sequential")
+
+# Format of `Player.guessed_events` in the database: `list` or `bitset`
+_env("GUESSED_EVENTS_ENCODING", cast=one_of("list", "bitset"), default="list")
+
+# Optimized event images built with `optimize_images.py`: the cache
+# directory, the maximum side in pixels and the JPEG quality
+_computed(
+    "IMAGES_CACHE_PATH",
+    lambda: os.path.join(
+        BASE_PATH,
+        get_env_variable("IMAGES_CACHE_PATH", default="res/images-optimized"),
+    ),
+)
+_env("IMAGES_MAX_SIZE", cast=int, default=1280)
+_env("IMAGES_QUALITY", cast=int, default=85)
+
+# Telegram chat id of the bot admin, used for service messages
+_env("ADMIN_CHAT_ID", cast=int, default=None)
+# Upload all event images to the admin chat on startup to cache `file_id`s
+_env("IMAGES_WARM_UP", cast=to_bool, default=False)
+
+# How the bot receives updates: `polling` or `webhook`
+_env("BOT_MODE", cast=one_of("polling", "webhook"), default="polling")
+# Public base URL of the webhook server, e.g. `https://example.com`. If not
+# set the webhook is not registered in Telegram (useful for local testing)
+_env("WEBHOOK_URL", default=None)
+_env("WEBHOOK_HOST", default="0.0.0.0")
+_env("WEBHOOK_PORT", cast=int, default=8080)
+_env("WEBHOOK_PATH", default="/webhook")
+_env("WEBHOOK_SECRET", default=None)
+_env("WEBHOOK_WORKERS", cast=int, default=16)
+_env("WEBHOOK_QUEUE_SIZE", cast=int, default=1000)
+
+# Number of worker processes, players are sharded across them by user id
+_env("WORKERS", cast=int, default=1)
+
+# Local server of `/metrics` and `/debug/profile`, disabled if not set. With
+# several workers the worker N serves on `METRICS_PORT + N`
+_env("METRICS_HOST", default="127.0.0.1")
+_env("METRICS_PORT", cast=int, default=None)
+
+# Where the game loads events from: `file` (`EVENTS_FILE_PATH`) or `mongo`
+# (imported with `import_events.py`, changes are picked up without restart)
+_env("EVENTS_SOURCE", cast=one_of("file", "mongo"), default="file")
+_env("EVENTS_RELOAD_INTERVAL", cast=float, default=60)
+# Leave event descriptions in the events file and read them on reveal
+_env("EVENTS_LAZY_DESCRIPTIONS", cast=to_bool, default=True)
+# Number of recently revealed descriptions and image paths kept in memory
+_env("EVENTS_DETAILS_CACHE_SIZE", cast=int, default=256)
+# Load events and the leaderboard while the bot already receives updates,
+# handlers which need them wait for the loading
+_env("BACKGROUND_LOADING", cast=to_bool, default=True)
 
-MONGO_HOST: str = get_env_variable("MONGO_HOST")
-MONGO_PORT: int = get_env_variable("MONGO_PORT", cast=int)
-MONGO_USERNAME: str = get_env_variable("MONGO_INITDB_ROOT_USERNAME")
-MONGO_PASSWORD: str = get_env_variable("MONGO_INITDB_ROOT_PASSWORD")
-MONGO_DATABASE: str = get_env_variable("MONGO_INITDB_DATABASE")
-MONGO_CONNECTION_URI: str = (
-    f"mongodb://{MONGO_USERNAME}:{MONGO_PASSWORD}@{MONGO_HOST}:{MONGO_PORT}/"
+# Flood limits of outgoing messages, see `outbound.OutboundLimiter`. The
+# global rate is shared by all worker processes, the chat rate and burst
+# apply to group chats. 0 disables the limits.
+_env("SEND_GLOBAL_RATE", cast=float, default=30)
+_env("SEND_CHAT_RATE", cast=float, default=1)
+_env("SEND_CHAT_BURST", cast=int, default=3)
+_env("SEND_MAX_RETRIES", cast=int, default=3)
+
+# Write-ahead journal of players changes, see `journal.PlayerJournal`
+_env("JOURNAL_ENABLED", cast=to_bool, default=True)
+_computed(
+    "JOURNAL_PATH",
+    lambda: os.path.join(
+        BASE_PATH, get_env_variable("JOURNAL_PATH", default="journal")
+    ),
 )
+_env("JOURNAL_SYNC_INTERVAL", cast=float, default=0.1)
+
+# Telemetry of guesses, see `telemetry.Telemetry`: the maximum number of
+# records kept in memory, records inserted at once and seconds between drains
+_env("TELEMETRY_BUFFER_SIZE", cast=int, default=100000)
+_env("TELEMETRY_BATCH_SIZE", cast=int, default=1000)
+_env("TELEMETRY_FLUSH_INTERVAL", cast=float, default=5)
+# Seconds between rebuilds of the `difficulty` events order
+_env("EVENTS_REORDER_INTERVAL", cast=float, default=300)
 
-EVENTS_FILE_PATH: str = (
-    os.path.join(RESOURCES_PATH, get_env_variable("EVENTS_FILE_PATH"))
+# Seconds of inactivity after which a round started with `/play` ends with
+# `ROUND_EXPIRY_ACTION` (`cancel` or `surrender`) and the player is evicted
+# from memory, 0 disables the expiry. Rounds are checked every
+# `ROUND_EXPIRY_TICK` seconds, see `sessions.TimerWheel`
+_env("ROUND_TTL", cast=float, default=1800)
+_env(
+    "ROUND_EXPIRY_ACTION",
+    cast=one_of("cancel", "surrender"),
+    default="cancel",
 )
+_env("ROUND_EXPIRY_TICK", cast=float, default=1)
+
+# Broadcasts to all players, see `broadcast.Broadcaster`: messages per
+# second (keep it below `SEND_GLOBAL_RATE` to leave room for game replies,
+# 0 disables the limit), messages sent at the same time, seconds between
+# checkpoints and seconds without checkpoints after which a broadcast of
+# a crashed process is resumed
+_env("BROADCAST_RATE", cast=float, default=20)
+_env("BROADCAST_WORKERS", cast=int, default=8)
+_env("BROADCAST_CHECKPOINT_INTERVAL", cast=float, default=5)
+_env("BROADCAST_LEASE", cast=float, default=60)
+
+# Seconds between reloads of the leaderboard with scores of players of
+# the other worker processes, used if `WORKERS` > 1
+_env("LEADERBOARD_RELOAD_INTERVAL", cast=float, default=300)
+
+# Duels: the maximum score difference of paired players and seconds to wait
+# for an opponent and to guess the event
+_env("DUEL_SCORE_GAP", cast=int, default=100)
+_env("DUEL_QUEUE_TIMEOUT", cast=float, default=60)
+_env("DUEL_MATCH_TIMEOUT", cast=float, default=300)
+
+# Group chat rounds, see `groups.GroupRounds`: seconds between summaries of
+# wrong guesses sent to a chat and seconds without guesses after which
+# a round ends
+_env("GROUP_HINT_INTERVAL", cast=float, default=3)
+_env("GROUP_ROUND_TIMEOUT", cast=float, default=600)
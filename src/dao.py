@@ -1,16 +1,49 @@
 """Module with data access objects (DAO) for MongoDB connection.
 
-Contains two data access objects (DAO): `HistoricalEventDao` and `PlayerDao`.
+Contains data access objects (DAO): `HistoricalEventDao`, `PlayerDao`,
+their non-blocking counterparts `AsyncHistoricalEventDao` and
+`AsyncPlayerDao`, `AsyncEventImageDao`, `AsyncGuessDao`,
+`AsyncEventStatsDao`, `AsyncBlockedPlayerDao` and `AsyncBroadcastDao`.
 """
-import json
+import dataclasses
 import os
-from typing import List, Tuple
+from datetime import datetime, timedelta, timezone
+from typing import (
+    AsyncIterator,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    Optional,
+    Tuple,
+    Union,
+)
 
-from pymongo import ReplaceOne
+from bson import Binary, ObjectId
+from motor.motor_asyncio import AsyncIOMotorDatabase
+from pymongo import (
+    ASCENDING,
+    DESCENDING,
+    ReplaceOne,
+    ReturnDocument,
+    UpdateOne,
+)
 from pymongo.database import Database
+from pymongo.errors import BulkWriteError
 
-from models import HistoricalEvent, Player
-from config import EVENTS_FILE_PATH
+from bitset import EventBitset
+from loader import iter_events
+from metrics import timed
+from models import (
+    Broadcast,
+    EventStats,
+    GuessRecord,
+    PLAYER_SCHEMA_VERSION,
+    HistoricalEvent,
+    Player,
+    PlayerChanges,
+)
+from config import EVENTS_FILE_PATH, GUESSED_EVENTS_ENCODING
 
 
 class ObjectDoesNotExists(Exception):
@@ -19,9 +52,32 @@ class ObjectDoesNotExists(Exception):
     pass
 
 
+EVENT_FIELDS = tuple(
+    f.name for f in dataclasses.fields(HistoricalEvent) if f.init
+)
+PLAYER_FIELDS = ("_id", "current_event", "guessed_events", "attempts", "score")
+
+
+def event_to_document(event: HistoricalEvent) -> dict:
+    """Returns a MongoDB document of the event."""
+    return {name: getattr(event, name) for name in EVENT_FIELDS}
+
+
+def document_to_event(document: dict) -> HistoricalEvent:
+    """Returns the event from a MongoDB document ignoring service fields."""
+    return HistoricalEvent(
+        **{name: document[name] for name in EVENT_FIELDS if name in document}
+    )
+
+
 class HistoricalEventDao:
     """Class for data access of `HistoricalEvent` records from the Database.
 
+    Events are read from the events JSON file or imported from it into
+    the collection. Every imported document has a `version` - a number of
+    the import which added or changed the event, so readers can fetch only
+    changed events. Removed events are kept with the `deleted` flag.
+
     Properties:
         data_source: The Database object.
         collection_name: The name of the collection in the MongoDB to access
@@ -35,26 +91,276 @@ class HistoricalEventDao:
     def __init__(self, data_source: Database):
         self.data_source = data_source[self.collection_name]
 
-    def all(self) -> List[HistoricalEvent]:
-        """Retrieve all historical events from the database.
+    def iter(
+        self, path: str = EVENTS_FILE_PATH, lazy_descriptions: bool = False
+    ) -> Iterator[HistoricalEvent]:
+        """Streams historical events from the events file.
+
+        The file is parsed by chunks, so events can be processed one by one
+        without holding the whole file in memory.
+
+        Args:
+            path: A path to the events file (a JSON array or JSON Lines).
+            lazy_descriptions: Whether to leave descriptions in the file,
+                               see `HistoricalEvent.get_description`.
+
+        Raises:
+            FileNotFoundError: The events file is missing.
+            InvalidEventError: The file or one of its events is malformed.
+        """
+        if not os.path.isfile(path):
+            raise FileNotFoundError(
+                f"The file with events is missing by path: {path}."
+            )
+        return iter_events(path, lazy_descriptions)
+
+    def all(
+        self, path: str = EVENTS_FILE_PATH, lazy_descriptions: bool = False
+    ) -> List[HistoricalEvent]:
+        """Retrieve all historical events from the events file.
+
+        Args:
+            path: A path to the events file.
+            lazy_descriptions: Whether to leave descriptions in the file.
 
         Returns:
             A list of `HistoricalEvent` objects.
         """
-        if not os.path.isfile(EVENTS_FILE_PATH):
-            raise FileNotFoundError(
-                f"The file with events is missing by path: {EVENTS_FILE_PATH}."
+        return list(self.iter(path, lazy_descriptions))
+
+    def ensure_indexes(self):
+        """Creates indexes used to query events (`_id` is always indexed)."""
+        for field in ("_type", "date", "version"):
+            self.data_source.create_index([(field, ASCENDING)])
+
+    def import_events(
+        self,
+        events: Iterable[HistoricalEvent],
+        delete_missing: bool = False,
+        batch_size: int = 1000,
+    ) -> int:
+        """Imports added and changed events into the collection.
+
+        Args:
+            events: Events to import, read one by one.
+            delete_missing: Whether to mark events which are in
+                            the collection, but not in `events` as deleted.
+            batch_size: A number of events written with one bulk write.
+
+        Returns:
+            A number of added, changed and deleted events.
+        """
+        self.ensure_indexes()
+        stored = {
+            document.pop("_id"): document
+            for document in self.data_source.find()
+        }
+        version = 1 + max(
+            (document.get("version", 0) for document in stored.values()),
+            default=0,
+        )
+
+        fields = [name for name in EVENT_FIELDS if name != "_id"]
+        requests = []
+        written = 0
+        imported = set()
+        for event in events:
+            document = event_to_document(event)
+            imported.add(event._id)
+            stored_document = stored.get(event._id)
+            if (
+                stored_document is not None
+                and not stored_document.get("deleted")
+                and all(stored_document.get(k) == document[k] for k in fields)
+            ):
+                continue
+            requests.append(
+                ReplaceOne(
+                    {"_id": event._id},
+                    {**document, "version": version},
+                    upsert=True,
+                )
+            )
+            if len(requests) == batch_size:
+                self.data_source.bulk_write(requests, ordered=False)
+                written += len(requests)
+                requests = []
+        if delete_missing:
+            requests.extend(
+                UpdateOne(
+                    {"_id": event_id},
+                    {"$set": {"deleted": True, "version": version}},
+                )
+                for event_id, document in stored.items()
+                if event_id not in imported and not document.get("deleted")
             )
 
-        try:
-            with open(EVENTS_FILE_PATH, "r") as json_file:
-                events = json.load(json_file)
-        except json.decoder.JSONDecodeError:
-            raise json.decoder.JSONDecodeError(
-                f"The events file ({EVENTS_FILE_PATH}) has bad format "
-                "(not valid JSON)."
+        for start in range(0, len(requests), batch_size):
+            self.data_source.bulk_write(
+                requests[start : start + batch_size], ordered=False
             )
-        return [HistoricalEvent(**event) for event in events]
+        return written + len(requests)
+
+
+class AsyncHistoricalEventDao:
+    """Non-blocking data access of `HistoricalEvent` records imported into
+    the collection with `HistoricalEventDao.import_events`.
+
+    Properties:
+        data_source: The Database object.
+        collection_name: The name of the collection in the MongoDB to access
+                         `HistoricalEvent` records.
+
+    """
+
+    data_source: AsyncIOMotorDatabase
+    collection_name: str = HistoricalEventDao.collection_name
+
+    def __init__(self, data_source: AsyncIOMotorDatabase):
+        self.data_source = data_source[self.collection_name]
+
+    @timed("events.changed_since")
+    async def changed_since(self, version: int) -> List[dict]:
+        """Returns event documents added, changed or deleted after
+        the version ordered by version.
+
+        Args:
+            version: The last seen version, 0 to get all events.
+        """
+        cursor = self.data_source.find({"version": {"$gt": version}})
+        return [document async for document in cursor.sort("version")]
+
+
+def encode_guessed_events(
+    guessed_events: EventBitset,
+) -> Union[Binary, List[int]]:
+    """Encodes guessed events for the database.
+
+    Guessed events are stored as a BSON binary bitset if
+    `GUESSED_EVENTS_ENCODING` is `bitset`, otherwise as an array of ids.
+    Both formats are read by `Player`.
+    """
+    if GUESSED_EVENTS_ENCODING == "bitset":
+        return Binary(guessed_events.to_bytes())
+    return list(guessed_events)
+
+
+def player_to_document(player: Player) -> dict:
+    """Returns a MongoDB document fields of the player (without `_id`)."""
+    return {
+        "current_event": player.current_event,
+        "guessed_events": encode_guessed_events(player.guessed_events),
+        "attempts": player.attempts,
+        "score": player.score,
+        "schema_version": PLAYER_SCHEMA_VERSION,
+    }
+
+
+def document_to_player(document: dict) -> Player:
+    """Returns the player from a MongoDB document ignoring service fields
+    and fields of newer schema versions."""
+    return Player(
+        **{name: document[name] for name in PLAYER_FIELDS if name in document}
+    )
+
+
+def player_to_update(player: Player, changes: PlayerChanges) -> dict:
+    """Returns a partial update of the player document with the changes.
+
+    Scalar fields are updated with `$set` and `$inc`, new guessed events
+    are appended with `$push`. The whole guessed events are written only if
+    they were reset, are stored as a bitset or in another format.
+
+    If it's unknown whether the previous save was applied, all fields are
+    written with `$set`, as applying the changes twice would double them.
+    """
+    if player.saved_state_unknown:
+        return {"$set": player_to_document(player)}
+    update = {}
+    fields = {}
+    if changes.current_event_changed:
+        fields["current_event"] = changes.current_event
+    increments = {
+        name: value
+        for name, value in zip(
+            ("attempts", "score"), (changes.attempts, changes.score)
+        )
+        if value
+    }
+    rewrite_guessed = changes.guessed_events_reset or (
+        changes.new_guessed_events
+        and (
+            GUESSED_EVENTS_ENCODING == "bitset"
+            or player.guessed_events_format != GUESSED_EVENTS_ENCODING
+        )
+    )
+    if rewrite_guessed:
+        fields["guessed_events"] = encode_guessed_events(player.guessed_events)
+    elif changes.new_guessed_events:
+        update["$push"] = {
+            "guessed_events": {"$each": list(changes.new_guessed_events)}
+        }
+    if fields:
+        update["$set"] = fields
+    if increments:
+        update["$inc"] = increments
+    return update
+
+
+# A changed player, its changes and whether its guessed events are written
+# whole, then they are stored in the `GUESSED_EVENTS_ENCODING` format
+ChangedPlayer = Tuple[Player, PlayerChanges, bool]
+
+
+def _get_player_updates(
+    players: Iterable[Player],
+) -> Tuple[List[UpdateOne], List[ChangedPlayer]]:
+    """Returns update requests of changed players and their changes."""
+    requests, changed = [], []
+    for player in players:
+        changes = player.get_changes()
+        if changes.empty:
+            continue
+        update = player_to_update(player, changes)
+        requests.append(UpdateOne({"_id": player._id}, update, upsert=True))
+        rewritten = "guessed_events" in update.get("$set", {})
+        changed.append((player, changes, rewritten))
+    return requests, changed
+
+
+def _mark_players_saved(
+    changed: List[ChangedPlayer], failed: Iterable[int] = ()
+):
+    """Marks changes saved except the ones of failed requests indexes."""
+    failed = set(failed)
+    for index, (player, changes, rewritten) in enumerate(changed):
+        if index not in failed:
+            player.mark_saved(changes)
+            player.saved_state_unknown = False
+            if rewritten:
+                player.guessed_events_format = GUESSED_EVENTS_ENCODING
+
+
+def _get_failed_indexes(error: BulkWriteError) -> List[int]:
+    return [failed["index"] for failed in error.details["writeErrors"]]
+
+
+def _mark_players_unknown(changed: List[ChangedPlayer]):
+    """Marks players whose save failed without a result, e.g. on a timeout
+    or a lost connection, when the server could apply it."""
+    for player, _, _ in changed:
+        player.saved_state_unknown = True
+
+
+async def _iter_ids(
+    collection, after: Optional[int], batch_size: int
+) -> AsyncIterator[int]:
+    """Yields ids of documents of the collection in ascending order."""
+    query = {} if after is None else {"_id": {"$gt": after}}
+    cursor = collection.find(query, {"_id": True})
+    cursor = cursor.sort("_id", ASCENDING).batch_size(batch_size)
+    async for document in cursor:
+        yield document["_id"]
 
 
 class PlayerDao:
@@ -86,16 +392,10 @@ class PlayerDao:
         created = player_db is None
 
         if player_db:
-            player = Player(**player_db)
+            player = document_to_player(player_db)
         else:
             self.data_source.insert_one(
-                {
-                    "_id": player._id,
-                    "current_event": player.current_event,
-                    "guessed_events": player.guessed_events,
-                    "attempts": player.attempts,
-                    "score": player.score,
-                }
+                {"_id": player._id, **player_to_document(player)}
             )
         return player, created
 
@@ -117,24 +417,449 @@ class PlayerDao:
             raise ObjectDoesNotExists(
                 f"Player with id {player_id} does not exists."
             )
-        return Player(**player)
+        return document_to_player(player)
+
+    def get_or_create(self, player_id: int) -> Tuple[Player, bool]:
+        """Gets the player or creates it with one round trip.
+
+        Args:
+            player_id: The id of the player to get.
+
+        Returns:
+            The player and a bool flag - whether it was created.
+        """
+        player = Player(_id=player_id)
+        player_db = self.data_source.find_one_and_update(
+            {"_id": player_id},
+            {"$setOnInsert": player_to_document(player)},
+            upsert=True,
+            return_document=ReturnDocument.BEFORE,
+        )
+        if player_db:
+            return document_to_player(player_db), False
+        player.guessed_events_format = GUESSED_EVENTS_ENCODING
+        return player, True
+
+    def save_many(self, players: Iterable[Player]):
+        """Saves changes of players to the database with partial updates."""
+        requests, changed = _get_player_updates(players)
+        if not requests:
+            return
+        try:
+            self.data_source.bulk_write(requests, ordered=False)
+        except BulkWriteError as error:
+            _mark_players_saved(changed, _get_failed_indexes(error))
+            raise
+        except BaseException:
+            _mark_players_unknown(changed)
+            raise
+        _mark_players_saved(changed)
+
+
+class AsyncPlayerDao:
+    """Non-blocking data access of `Player` records from the Database.
+
+    Methods are coroutines backed by the `motor` driver, so they are safe to
+    await inside the bot handlers.
+
+    Properties:
+        data_source: The Database object.
+        collection_name: The name of the collection in the MongoDB to access
+                         `Player` records.
+
+    """
+
+    data_source: AsyncIOMotorDatabase
+    collection_name: str = "Players"
+
+    def __init__(self, data_source: AsyncIOMotorDatabase):
+        self.data_source = data_source[self.collection_name]
+
+    @timed("players.get_or_create")
+    async def get_or_create(self, player_id: int) -> Tuple[Player, bool]:
+        """Gets the player or creates it with one round trip.
+
+        Args:
+            player_id: The id of the player to get.
+
+        Returns:
+            The player and a bool flag - whether it was created.
+        """
+        player = Player(_id=player_id)
+        player_db = await self.data_source.find_one_and_update(
+            {"_id": player_id},
+            {"$setOnInsert": player_to_document(player)},
+            upsert=True,
+            return_document=ReturnDocument.BEFORE,
+        )
+        if player_db:
+            return document_to_player(player_db), False
+        player.guessed_events_format = GUESSED_EVENTS_ENCODING
+        return player, True
+
+    async def ensure_indexes(self):
+        """Creates the index on `score` used to load the leaderboard."""
+        await self.data_source.create_index([("score", DESCENDING)])
+
+    async def iter_scores(self) -> AsyncIterator[Tuple[int, int]]:
+        """Yields ids and scores of all players from the best one."""
+        cursor = self.data_source.find({}, {"score": True})
+        async for document in cursor.sort("score", DESCENDING):
+            yield document["_id"], document.get("score", 0)
 
-    def save_many(self, players: List[Player]):
-        """Saves list of players to the database."""
-        if not players:
+    def iter_ids(
+        self, after: Optional[int] = None, batch_size: int = 1000
+    ) -> AsyncIterator[int]:
+        """Yields ids of all players in ascending order.
+
+        Only ids are fetched by batches of the cursor, so all players are
+        never held in memory.
+
+        Args:
+            after: The id to start after, None to start from the first one.
+            batch_size: A number of ids fetched with one round trip.
+        """
+        return _iter_ids(self.data_source, after, batch_size)
+
+    @timed("players.get_many")
+    async def get_many(self, player_ids: List[int]) -> Dict[int, Player]:
+        """Returns a dictionary mapping from player id to the player for
+        the given ids, players which don't exist are missing."""
+        cursor = self.data_source.find({"_id": {"$in": player_ids}})
+        return {
+            document["_id"]: document_to_player(document)
+            async for document in cursor
+        }
+
+    @timed("players.save_many")
+    async def save_many(self, players: Iterable[Player]):
+        """Saves changes of players to the database with partial updates.
+
+        Players without changes are skipped. If some updates fail, only
+        the changes of the failed players are kept for the next save. If
+        the write fails without a result (or is cancelled), the next save
+        of the players writes all their fields, so it's idempotent.
+        """
+        requests, changed = _get_player_updates(players)
+        if not requests:
             return
+        try:
+            await self.data_source.bulk_write(requests, ordered=False)
+        except BulkWriteError as error:
+            _mark_players_saved(changed, _get_failed_indexes(error))
+            raise
+        except BaseException:
+            _mark_players_unknown(changed)
+            raise
+        _mark_players_saved(changed)
+
+    @timed("players.add_scores")
+    async def add_scores(self, changes: Dict[int, List[int]]):
+        """Adds score changes and attempts to players with one write,
+        players who don't exist are created.
+
+        Args:
+            changes: A dictionary mapping from player id to the score change
+                     and the number of attempts.
+        """
+        requests = []
+        for player_id, (score, attempts) in changes.items():
+            document = player_to_document(Player(_id=player_id))
+            del document["score"], document["attempts"]
+            requests.append(
+                UpdateOne(
+                    {"_id": player_id},
+                    {
+                        "$inc": {"score": score, "attempts": attempts},
+                        "$setOnInsert": document,
+                    },
+                    upsert=True,
+                )
+            )
+        if requests:
+            await self.data_source.bulk_write(requests, ordered=False)
+
+
+class AsyncEventImageDao:
+    """Non-blocking data access of uploaded event images.
+
+    Stores Telegram `file_id`s of uploaded event images, so an image is
+    uploaded only once and then sent by its `file_id`. A document contains
+    the `HistoricalEvent.image_key` of the uploaded file as `_id` and the
+    `file_id`. Documents keyed by event ids were written before the keys
+    and are skipped.
+
+    Properties:
+        data_source: The Database object.
+        collection_name: The name of the collection in the MongoDB to access
+                         event image records.
+
+    """
+
+    data_source: AsyncIOMotorDatabase
+    collection_name: str = "EventImages"
+
+    def __init__(self, data_source: AsyncIOMotorDatabase):
+        self.data_source = data_source[self.collection_name]
+
+    @timed("event_images.all")
+    async def all(self) -> Dict[str, str]:
+        """Returns a dictionary mapping from image key to the `file_id`."""
+        return {
+            record["_id"]: record["file_id"]
+            async for record in self.data_source.find(
+                {"_id": {"$type": "string"}}
+            )
+        }
+
+    @timed("event_images.save")
+    async def save(self, image_key: str, file_id: str):
+        """Saves the `file_id` of the uploaded image."""
+        await self.data_source.replace_one(
+            {"_id": image_key}, {"file_id": file_id}, upsert=True
+        )
+
+
+class AsyncGuessDao:
+    """Non-blocking data access of recorded actions of players in rounds.
+
+    A document is a `GuessRecord` with the time as `created_at` date.
+
+    Properties:
+        data_source: The Database object.
+        collection_name: The name of the collection in the MongoDB to access
+                         `GuessRecord` records.
+
+    """
+
+    data_source: AsyncIOMotorDatabase
+    collection_name: str = "Guesses"
+
+    def __init__(self, data_source: AsyncIOMotorDatabase):
+        self.data_source = data_source[self.collection_name]
 
-        update_objects = [
-            ReplaceOne(
-                {"_id": player._id},
-                {
-                    "current_event": player.current_event,
-                    "guessed_events": player.guessed_events,
-                    "attempts": player.attempts,
-                    "score": player.score,
-                },
+    @timed("guesses.insert_many")
+    async def insert_many(self, records: Iterable[GuessRecord]):
+        """Inserts the records with one unordered write."""
+        documents = []
+        for record in records:
+            document = dataclasses.asdict(record)
+            document["created_at"] = datetime.fromtimestamp(
+                record.created_at, timezone.utc
+            )
+            documents.append(document)
+        await self.data_source.insert_many(documents, ordered=False)
+
+
+class AsyncEventStatsDao:
+    """Non-blocking data access of aggregates of guesses of events.
+
+    A document contains the event id as `_id` and the `EventStats` fields
+    which are only incremented.
+
+    Properties:
+        data_source: The Database object.
+        collection_name: The name of the collection in the MongoDB to access
+                         `EventStats` records.
+
+    """
+
+    data_source: AsyncIOMotorDatabase
+    collection_name: str = "EventStats"
+
+    def __init__(self, data_source: AsyncIOMotorDatabase):
+        self.data_source = data_source[self.collection_name]
+
+    @timed("event_stats.all")
+    async def all(self) -> Dict[int, EventStats]:
+        """Returns a dictionary mapping from event id to its stats."""
+        fields = [f.name for f in dataclasses.fields(EventStats)]
+        return {
+            document["_id"]: EventStats(
+                **{name: document.get(name, 0) for name in fields}
+            )
+            async for document in self.data_source.find()
+        }
+
+    @timed("event_stats.add_many")
+    async def add_many(self, changes: Dict[int, EventStats]):
+        """Adds the increments to the stats of events with one write."""
+        requests = [
+            UpdateOne(
+                {"_id": event_id},
+                {"$inc": dataclasses.asdict(stats)},
                 upsert=True,
             )
-            for player in players
+            for event_id, stats in changes.items()
         ]
-        self.data_source.bulk_write(update_objects)
+        if requests:
+            await self.data_source.bulk_write(requests, ordered=False)
+
+
+class AsyncBlockedPlayerDao:
+    """Non-blocking data access of players who blocked the bot.
+
+    A document contains the player id as `_id` and the `blocked_at` date.
+    Broadcasts skip these players, a player is removed when they unblock
+    the bot.
+
+    Properties:
+        data_source: The Database object.
+        collection_name: The name of the collection in the MongoDB to access
+                         blocked players records.
+
+    """
+
+    data_source: AsyncIOMotorDatabase
+    collection_name: str = "BlockedPlayers"
+
+    def __init__(self, data_source: AsyncIOMotorDatabase):
+        self.data_source = data_source[self.collection_name]
+
+    def iter_ids(
+        self, after: Optional[int] = None, batch_size: int = 1000
+    ) -> AsyncIterator[int]:
+        """Yields ids of blocked players in ascending order, see
+        `AsyncPlayerDao.iter_ids`."""
+        return _iter_ids(self.data_source, after, batch_size)
+
+    @timed("blocked_players.add_many")
+    async def add_many(self, player_ids: Iterable[int]):
+        """Records the players as blocked with one write."""
+        blocked_at = datetime.now(timezone.utc)
+        requests = [
+            UpdateOne(
+                {"_id": player_id},
+                {"$setOnInsert": {"blocked_at": blocked_at}},
+                upsert=True,
+            )
+            for player_id in player_ids
+        ]
+        if requests:
+            await self.data_source.bulk_write(requests, ordered=False)
+
+    @timed("blocked_players.remove")
+    async def remove(self, player_id: int):
+        """Removes the player from blocked ones."""
+        await self.data_source.delete_one({"_id": player_id})
+
+
+BROADCAST_FIELDS = tuple(f.name for f in dataclasses.fields(Broadcast))
+
+
+def document_to_broadcast(document: dict) -> Broadcast:
+    """Returns the broadcast from a MongoDB document ignoring service
+    fields."""
+    return Broadcast(
+        **{
+            name: document[name]
+            for name in BROADCAST_FIELDS
+            if name in document
+        }
+    )
+
+
+class AsyncBroadcastDao:
+    """Non-blocking data access of `Broadcast` records.
+
+    Besides the `Broadcast` fields a document has the `owner` - the process
+    sending the broadcast, which renews its lease with `heartbeat_at` on
+    every checkpoint. A running broadcast whose lease expired is claimed by
+    another process, so a broadcast of a crashed process is resumed.
+
+    Properties:
+        data_source: The Database object.
+        collection_name: The name of the collection in the MongoDB to access
+                         `Broadcast` records.
+
+    """
+
+    data_source: AsyncIOMotorDatabase
+    collection_name: str = "Broadcasts"
+
+    def __init__(self, data_source: AsyncIOMotorDatabase):
+        self.data_source = data_source[self.collection_name]
+
+    @timed("broadcasts.create")
+    async def create(self, text: str, owner: str) -> Broadcast:
+        """Creates a running broadcast owned by the process."""
+        broadcast = Broadcast(ObjectId(), text)
+        now = datetime.now(timezone.utc)
+        await self.data_source.insert_one(
+            {
+                **dataclasses.asdict(broadcast),
+                "owner": owner,
+                "created_at": now,
+                "heartbeat_at": now,
+            }
+        )
+        return broadcast
+
+    @timed("broadcasts.get_running")
+    async def get_running(self) -> Optional[Broadcast]:
+        """Returns the running broadcast if there is one."""
+        document = await self.data_source.find_one({"status": "running"})
+        return document_to_broadcast(document) if document else None
+
+    @timed("broadcasts.claim")
+    async def claim(self, owner: str, lease: float) -> Optional[Broadcast]:
+        """Takes over a running broadcast whose lease expired.
+
+        Args:
+            owner: The process taking over the broadcast.
+            lease: Seconds since the last heartbeat after which the lease
+                   expires.
+        """
+        now = datetime.now(timezone.utc)
+        document = await self.data_source.find_one_and_update(
+            {
+                "status": "running",
+                "heartbeat_at": {"$lt": now - timedelta(seconds=lease)},
+            },
+            {"$set": {"owner": owner, "heartbeat_at": now}},
+            return_document=ReturnDocument.AFTER,
+        )
+        return document_to_broadcast(document) if document else None
+
+    @timed("broadcasts.save")
+    async def save(
+        self, broadcast: Broadcast, owner: str, release: bool = False
+    ) -> bool:
+        """Saves the progress of the running broadcast and renews the lease.
+
+        Args:
+            broadcast: The broadcast to save.
+            owner: The process sending the broadcast.
+            release: Whether to expire the lease, so another process can
+                     resume the broadcast right away.
+
+        Returns:
+            Whether the process still owns the running broadcast. It is not
+            if the broadcast was stopped or claimed by another process.
+        """
+        fields = dataclasses.asdict(broadcast)
+        del fields["_id"], fields["text"]
+        heartbeat_at = datetime.now(timezone.utc)
+        if release:
+            heartbeat_at = datetime.fromtimestamp(0, timezone.utc)
+        document = await self.data_source.find_one_and_update(
+            {"_id": broadcast._id, "owner": owner, "status": "running"},
+            {"$set": {**fields, "heartbeat_at": heartbeat_at}},
+            {"_id": True},
+        )
+        return document is not None
+
+    @timed("broadcasts.stop")
+    async def stop(self) -> Optional[Broadcast]:
+        """Marks the running broadcast stopped, its owner stops sending it
+        on the next checkpoint.
+
+        Returns:
+            The stopped broadcast if there was a running one.
+        """
+        document = await self.data_source.find_one_and_update(
+            {"status": "running"},
+            {"$set": {"status": "stopped"}},
+            return_document=ReturnDocument.AFTER,
+        )
+        return document_to_broadcast(document) if document else None
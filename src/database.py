@@ -1,10 +1,53 @@
+from motor.motor_asyncio import AsyncIOMotorClient, AsyncIOMotorDatabase
 from pymongo import MongoClient
 from pymongo.database import Database
 
-from config import MONGO_CONNECTION_URI, MONGO_DATABASE
+from config import (
+    MONGO_CONNECTION_URI,
+    MONGO_DATABASE,
+    MONGO_MAX_IDLE_TIME_MS,
+    MONGO_MAX_POOL_SIZE,
+    MONGO_MIN_POOL_SIZE,
+    MONGO_WAIT_QUEUE_TIMEOUT_MS,
+)
 
 
-def get_database() -> Database:
-    """Creates a conntection to the database and returns it."""
-    client = MongoClient(MONGO_CONNECTION_URI)
+def _get_pool_options(**options) -> dict:
+    """Returns the connection pool options from the config.
+
+    Keyword arguments override the configured values.
+    """
+    pool_options = {
+        "maxPoolSize": MONGO_MAX_POOL_SIZE,
+        "minPoolSize": MONGO_MIN_POOL_SIZE,
+        "maxIdleTimeMS": MONGO_MAX_IDLE_TIME_MS,
+        "waitQueueTimeoutMS": MONGO_WAIT_QUEUE_TIMEOUT_MS,
+    }
+    pool_options.update(options)
+    return pool_options
+
+
+def get_database(**options) -> Database:
+    """Creates a conntection to the database and returns it.
+
+    Args:
+        options: `MongoClient` options overriding the configured pool options.
+    """
+    client = MongoClient(MONGO_CONNECTION_URI, **_get_pool_options(**options))
+    return client[MONGO_DATABASE]
+
+
+def get_async_database(**options) -> AsyncIOMotorDatabase:
+    """Creates a non-blocking conntection to the database and returns it.
+
+    The connection is backed by the `motor` driver, so queries can be awaited
+    inside the bot handlers without blocking the event loop.
+
+    Args:
+        options: `AsyncIOMotorClient` options overriding the configured pool
+                 options.
+    """
+    client = AsyncIOMotorClient(
+        MONGO_CONNECTION_URI, **_get_pool_options(**options)
+    )
     return client[MONGO_DATABASE]
@@ -0,0 +1,245 @@
+"""Head-to-head duels of players.
+
+A player joins the duel queue with `/duel`. `Matchmaker` pairs the player
+with the waiting player of the closest score if the scores differ by no
+more than the allowed gap, otherwise the player waits until a suitable
+opponent joins or the wait times out. Paired players get the same event
+and the first one to guess its date wins.
+
+The queue is a sorted list of scores, so joining and leaving it take
+O(log n). Timeouts are kept in FIFO order as every player waits for the same
+time, so expiring them takes O(1) per player.
+
+"""
+import asyncio
+import logging
+import time
+from collections import deque
+from dataclasses import dataclass
+from typing import Awaitable, Callable, Deque, Dict, List, Optional, Tuple
+
+from sortedcontainers import SortedList
+
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass(slots=True)
+class Match:
+    """Class representing a duel of two players.
+
+    Properties:
+        players: Ids of the dueling players.
+        event_id: Id of the event to guess.
+        started_at: Monotonic time of the start.
+
+    """
+
+    players: Tuple[int, int]
+    event_id: int
+    started_at: float
+
+    def opponent(self, player_id: int) -> int:
+        """Returns the id of the other player."""
+        first, second = self.players
+        return second if player_id == first else first
+
+
+class Matchmaker:
+    """Queue of players waiting for an opponent.
+
+    Properties:
+        max_gap: The maximum difference of scores of paired players.
+        timeout: Seconds a player waits for an opponent.
+        queue: A sorted list of `(score, player_id)` pairs.
+        waiting: A dictionary mapping from player id to the player's score
+                 and the time the player joined the queue.
+
+    """
+
+    max_gap: int
+    timeout: float
+    queue: SortedList
+    waiting: Dict[int, Tuple[int, float]]
+
+    def __init__(self, max_gap: int, timeout: float):
+        self.max_gap = max_gap
+        self.timeout = timeout
+        self.queue = SortedList()
+        self.waiting = {}
+        # Player ids with the time they joined in the order they joined
+        self._joined: Deque[Tuple[float, int]] = deque()
+
+    def __len__(self) -> int:
+        return len(self.waiting)
+
+    def __contains__(self, player_id: int) -> bool:
+        return player_id in self.waiting
+
+    def add(
+        self, player_id: int, score: int, now: Optional[float] = None
+    ) -> Optional[int]:
+        """Pairs the player with a waiting opponent or adds it to the queue.
+
+        Args:
+            player_id: Id of the player joining the queue.
+            score: Score of the player.
+            now: The current monotonic time.
+
+        Returns:
+            Id of the paired opponent removed from the queue or `None` if
+            the player waits.
+        """
+        if player_id in self.waiting:
+            return None
+        index = self.queue.bisect_left((score, player_id))
+        # The closest scores are the neighbours of the player's position
+        candidates = [
+            self.queue[i]
+            for i in (index - 1, index)
+            if 0 <= i < len(self.queue)
+        ]
+        if candidates:
+            opponent_score, opponent_id = min(
+                candidates, key=lambda candidate: abs(candidate[0] - score)
+            )
+            if abs(opponent_score - score) <= self.max_gap:
+                self.remove(opponent_id)
+                return opponent_id
+
+        now = time.monotonic() if now is None else now
+        self.queue.add((score, player_id))
+        self.waiting[player_id] = (score, now)
+        self._joined.append((now, player_id))
+        return None
+
+    def remove(self, player_id: int) -> bool:
+        """Removes the player from the queue.
+
+        Returns:
+            Whether the player was waiting.
+        """
+        entry = self.waiting.pop(player_id, None)
+        if entry is None:
+            return False
+        self.queue.remove((entry[0], player_id))
+        return True
+
+    def expire(self, now: Optional[float] = None) -> List[int]:
+        """Removes players who waited longer than `timeout`.
+
+        Returns:
+            Ids of the removed players.
+        """
+        now = time.monotonic() if now is None else now
+        expired = []
+        while self._joined and now - self._joined[0][0] >= self.timeout:
+            joined_at, player_id = self._joined.popleft()
+            entry = self.waiting.get(player_id)
+            # The player could leave and join again since then
+            if entry is not None and entry[1] == joined_at:
+                self.remove(player_id)
+                expired.append(player_id)
+        return expired
+
+
+ExpireCallback = Callable[[List[int], List[Match]], Awaitable[None]]
+
+
+class Duels:
+    """Matchmaking and running duels.
+
+    Properties:
+        matchmaker: The queue of players waiting for an opponent.
+        matches: A dictionary mapping from player id to the player's match.
+        match_timeout: Seconds after which an unfinished match ends.
+        stats: Counters of started, finished and expired matches and
+               expired waits.
+
+    """
+
+    matchmaker: Matchmaker
+    matches: Dict[int, Match]
+    match_timeout: float
+    stats: Dict[str, int]
+
+    def __init__(
+        self, max_gap: int, queue_timeout: float, match_timeout: float
+    ):
+        self.matchmaker = Matchmaker(max_gap, queue_timeout)
+        self.matches = {}
+        self.match_timeout = match_timeout
+        self.stats = dict.fromkeys(
+            ("started", "finished", "expired", "expired_waits"), 0
+        )
+        self._started: Deque[Match] = deque()
+        self._task: Optional[asyncio.Task] = None
+
+    def get(self, player_id: int) -> Optional[Match]:
+        """Returns the player's running match or `None`."""
+        return self.matches.get(player_id)
+
+    def start(self, players: Tuple[int, int], event_id: int) -> Match:
+        """Starts a match of the paired players."""
+        match = Match(players, event_id, time.monotonic())
+        for player_id in players:
+            self.matches[player_id] = match
+        self._started.append(match)
+        self.stats["started"] += 1
+        return match
+
+    def _remove(self, match: Match):
+        for player_id in match.players:
+            if self.matches.get(player_id) is match:
+                del self.matches[player_id]
+
+    def finish(self, match: Match):
+        """Ends the match when one of the players won."""
+        self._remove(match)
+        self.stats["finished"] += 1
+
+    def expire(
+        self, now: Optional[float] = None
+    ) -> Tuple[List[int], List[Match]]:
+        """Removes timed out waiting players and matches.
+
+        Returns:
+            Ids of players who didn't get an opponent and expired matches.
+        """
+        now = time.monotonic() if now is None else now
+        players = self.matchmaker.expire(now)
+        matches = []
+        while (
+            self._started
+            and now - self._started[0].started_at >= self.match_timeout
+        ):
+            match = self._started.popleft()
+            if self.matches.get(match.players[0]) is match:
+                self._remove(match)
+                matches.append(match)
+        self.stats["expired_waits"] += len(players)
+        self.stats["expired"] += len(matches)
+        return players, matches
+
+    async def run(self, on_expire: ExpireCallback, interval: float = 1):
+        """Expires waits and matches every `interval` seconds and notifies
+        players about them."""
+        while True:
+            await asyncio.sleep(interval)
+            players, matches = self.expire()
+            if players or matches:
+                try:
+                    await on_expire(players, matches)
+                except Exception:
+                    logger.exception("Failed to notify about expired duels.")
+
+    def start_expiring(self, on_expire: ExpireCallback):
+        """Starts the background expiration task."""
+        if self._task is None:
+            self._task = asyncio.create_task(self.run(on_expire))
+
+    def stop(self):
+        """Stops the background expiration task."""
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
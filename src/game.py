@@ -2,15 +2,71 @@
 
 This module contains the implementation of a guess game where players
 try to guess the year of historical events. The game uses the `Player`
-and `HistoricalEvent` model classes and the `PlayerDao` and
+and `HistoricalEvent` model classes and the `AsyncPlayerDao` and
 `HistoricalEventDao` data access objects for storing and retrieving player
 and historical event data from the database.
 
 """
-from typing import Dict, Optional, Tuple
-
+import asyncio
+import logging
+import time
+from typing import TYPE_CHECKING, Dict, Iterable, List, Optional, Tuple
+
+from cache import PlayerCache
+from config import (
+    BACKGROUND_LOADING,
+    DUEL_MATCH_TIMEOUT,
+    DUEL_QUEUE_TIMEOUT,
+    DUEL_SCORE_GAP,
+    EVENTS_LAZY_DESCRIPTIONS,
+    EVENTS_ORDER,
+    EVENTS_RELOAD_INTERVAL,
+    EVENTS_REORDER_INTERVAL,
+    EVENTS_SOURCE,
+    GROUP_HINT_INTERVAL,
+    GROUP_ROUND_TIMEOUT,
+    LEADERBOARD_RELOAD_INTERVAL,
+    PLAYERS_CACHE_SIZE,
+    PLAYERS_CACHE_TTL,
+    PLAYERS_FLUSH_CHANGES,
+    PLAYERS_FLUSH_INTERVAL,
+    ROUND_EXPIRY_ACTION,
+    ROUND_EXPIRY_TICK,
+    ROUND_TTL,
+    TELEMETRY_BATCH_SIZE,
+    TELEMETRY_BUFFER_SIZE,
+    TELEMETRY_FLUSH_INTERVAL,
+    WORKERS,
+)
+from duel import Duels, Match
+from groups import GroupRound, GroupRounds
+from journal import PlayerJournal
+from leaderboard import Leaderboard
 from models import HistoricalEvent, Player
-from dao import PlayerDao, HistoricalEventDao, ObjectDoesNotExists
+from dao import (
+    AsyncEventStatsDao,
+    AsyncGuessDao,
+    AsyncHistoricalEventDao,
+    AsyncPlayerDao,
+    HistoricalEventDao,
+    document_to_event,
+)
+from metrics import SELECTION_LATENCY
+from selection import EventSelector
+from sessions import TimerWheel
+from telemetry import Telemetry
+
+if TYPE_CHECKING:
+    # Importing `sharding` imports `aiohttp`, the game needs only the type
+    from sharding import ShardQueues
+
+
+logger = logging.getLogger(__name__)
+
+
+def _log_loading_error(task: asyncio.Task):
+    if not task.cancelled() and task.exception() is not None:
+        logger.error("Failed to load the game.", exc_info=task.exception())
 
 
 class GuessGame:
@@ -18,34 +74,298 @@ class GuessGame:
 
     Properties:
         events: A dictionary mapping from historical event id
-                to `HistoricalEvent` instance.
-        players_dao: An instance of `PlayerDao` for accessing the player data
-                     in the database.
-        players: A dictionary mapping from player id to `Player` instance;
-                 stores cached players.
+                to `HistoricalEvent` instance. Deleted events are kept for
+                the rounds in progress, but not given to players anymore.
+        events_version: The last seen version of events in the database if
+                        events are loaded from the database.
+        selector: An `EventSelector` picking not guessed events for players.
+        players_dao: An instance of `AsyncPlayerDao` for accessing the player
+                     data in the database.
+        players: A write-behind cache of players, changed players are saved
+                 to the database in the background.
+        leaderboard: Players ranked by score, updated on every score change.
+        duels: Duels of players, see `duel.Duels`.
+        groups: Shared rounds of group chats, see `groups.GroupRounds`.
+        shards: Queues of the worker processes with `WORKERS` > 1, to pass
+                score changes of group rounds to the workers of players.
+        rounds: Deadlines of rounds of players, a round ends when the player
+                is idle for `ROUND_TTL` seconds.
+        telemetry: Records of guesses saved in the background and
+                   the difficulty of events.
 
     """
 
     events: Dict[int, HistoricalEvent]
-    players_dao: PlayerDao
-    players: Dict[int, Player]
+    events_version: int
+    selector: EventSelector
+    players_dao: AsyncPlayerDao
+    players: PlayerCache
+    leaderboard: Leaderboard
+    duels: Duels
+    groups: GroupRounds
+    shards: Optional["ShardQueues"]
+    rounds: TimerWheel
+    telemetry: Telemetry
+
+    def __init__(
+        self,
+        database,
+        journal: Optional[PlayerJournal] = None,
+        shards: Optional["ShardQueues"] = None,
+    ):
+        """Creates the game.
+
+        Events and the leaderboard are loaded when entering the game, in
+        the background if `BACKGROUND_LOADING` is enabled.
+
+        Args:
+            database: A database to store players in.
+            journal: A journal to write players changes to, it's replayed
+                     into the database when entering the game.
+            shards: Queues of the worker processes if the game runs in one
+                    of them.
+        """
+        self.events = {}
+        self.events_version = 0
+        self.events_dao = AsyncHistoricalEventDao(database)
+        self.events_file_dao = HistoricalEventDao(database)
+        self._reload_task: Optional[asyncio.Task] = None
+        self.players_dao = AsyncPlayerDao(database)
+        self.players = PlayerCache(
+            self.players_dao,
+            max_size=PLAYERS_CACHE_SIZE,
+            ttl=PLAYERS_CACHE_TTL,
+            flush_interval=PLAYERS_FLUSH_INTERVAL,
+            flush_changes=PLAYERS_FLUSH_CHANGES,
+            journal=journal,
+        )
+        self.leaderboard = Leaderboard()
+        self.duels = Duels(
+            max_gap=DUEL_SCORE_GAP,
+            queue_timeout=DUEL_QUEUE_TIMEOUT,
+            match_timeout=DUEL_MATCH_TIMEOUT,
+        )
+        self.groups = GroupRounds(GROUP_HINT_INTERVAL, GROUP_ROUND_TIMEOUT)
+        self.shards = shards
+        self._leaderboard_task: Optional[asyncio.Task] = None
+        self.rounds = TimerWheel(ROUND_EXPIRY_TICK, ROUND_TTL)
+        self._rounds_task: Optional[asyncio.Task] = None
+        self.telemetry = Telemetry(
+            AsyncGuessDao(database),
+            AsyncEventStatsDao(database),
+            buffer_size=TELEMETRY_BUFFER_SIZE,
+            batch_size=TELEMETRY_BATCH_SIZE,
+            flush_interval=TELEMETRY_FLUSH_INTERVAL,
+        )
+        self._reorder_task: Optional[asyncio.Task] = None
+        self._events_loading: Optional[asyncio.Task] = None
+        self._leaderboard_loading: Optional[asyncio.Task] = None
+
+    async def __aenter__(self):
+        """Recovers players from the journal, starts loading events and
+        the leaderboard and saving changed players to the database in
+        the background."""
+        journal = self.players.journal
+        if journal is not None:
+            journal.open()
+            # Recovered scores must be in the database before the leaderboard
+            # is loaded
+            await journal.recover(self.players_dao)
+        self._events_loading = asyncio.create_task(self.load_events())
+        self._leaderboard_loading = asyncio.create_task(
+            self._load_leaderboard()
+        )
+        for task in (self._events_loading, self._leaderboard_loading):
+            task.add_done_callback(_log_loading_error)
+        if not BACKGROUND_LOADING:
+            await self.wait_for_events()
+            await self.wait_for_leaderboard()
+        if journal is not None:
+            journal.start()
+        self.players.start()
+        self.telemetry.start()
+        if ROUND_TTL:
+            self._rounds_task = asyncio.create_task(self._expire_rounds())
+        return self
 
-    def __init__(self, database):
-        events_dao = HistoricalEventDao(database)
-        self.events = {event._id: event for event in events_dao.all()}
+    async def __aexit__(self, exc_type, exc_value, tb):
+        """Ends rounds of group chats and saves all changed cached players
+        to the database on exit."""
+        for task in (
+            self._events_loading,
+            self._leaderboard_loading,
+            self._reload_task,
+            self._leaderboard_task,
+            self._rounds_task,
+            self._reorder_task,
+        ):
+            if task:
+                task.cancel()
+        self.duels.stop()
+        self.groups.stop()
+        for group_round in list(self.groups.rounds.values()):
+            self.groups.finish(group_round)
+        await self.save_group_scores(stopping=True)
+        await self.telemetry.stop()
+        await self.players.stop()
+        if self.players.journal is not None:
+            await self.players.journal.stop()
+
+    def _set_events(self, events: Iterable[HistoricalEvent]):
+        self.events = {event._id: event for event in events}
         if not self.events:
             raise ValueError("Can't start the game without events.")
-        self.players_dao = PlayerDao(database)
-        self.players = {}
+        self.selector = EventSelector(
+            {event._id: event._type for event in self.events.values()},
+            EVENTS_ORDER,
+        )
 
-    def __enter__(self):
-        return self
+    async def load_events(self):
+        """Loads events from the events file or the database.
 
-    def __exit__(self, exc_type, exc_value, tb):
-        """Saves all cached players to the database on exit."""
-        self.players_dao.save_many(self.players.values())
+        The file is parsed in a thread, so the bot handles updates which
+        don't need events meanwhile.
+        """
+        if EVENTS_SOURCE == "file":
+            events = self.events_file_dao.iter(
+                lazy_descriptions=EVENTS_LAZY_DESCRIPTIONS
+            )
+            loop = asyncio.get_running_loop()
+            await loop.run_in_executor(None, self._set_events, events)
+        else:
+            documents = await self.events_dao.changed_since(0)
+            self._set_events(
+                document_to_event(document)
+                for document in documents
+                if not document.get("deleted")
+            )
+            self.events_version = max(d["version"] for d in documents)
+            self._reload_task = asyncio.create_task(self._reload_events())
+        logger.info("Loaded %d events.", len(self.events))
+        try:
+            await self.telemetry.load()
+        except Exception:
+            logger.exception("Failed to load stats of events.")
+        if EVENTS_ORDER == "difficulty":
+            self.selector.reorder(self.telemetry.difficulty())
+            self._reorder_task = asyncio.create_task(self._reorder_events())
+
+    async def wait_for_events(self):
+        """Waits until events are loaded, raises the loading error if it
+        failed."""
+        if self._events_loading is not None:
+            # Don't cancel the loading if a waiting handler is cancelled
+            await asyncio.shield(self._events_loading)
+
+    def apply_event_changes(self, documents: List[dict]):
+        """Applies added, changed and deleted events to the game.
 
-    def get_player(self, player_id: int) -> Player:
+        Args:
+            documents: Event documents ordered by version.
+        """
+        for document in documents:
+            event = document_to_event(document)
+            if document.get("deleted"):
+                self.selector.remove(event._id)
+            else:
+                self.events[event._id] = event
+                self.selector.add(event._id)
+            self.events_version = document["version"]
+
+    async def _reorder_events(self):
+        """Rebuilds the `difficulty` order with the latest stats."""
+        while True:
+            await asyncio.sleep(EVENTS_REORDER_INTERVAL)
+            self.selector.reorder(self.telemetry.difficulty())
+
+    async def _reload_events(self):
+        """Polls the database for changed events."""
+        while True:
+            await asyncio.sleep(EVENTS_RELOAD_INTERVAL)
+            try:
+                documents = await self.events_dao.changed_since(
+                    self.events_version
+                )
+            except Exception:
+                logger.exception("Failed to reload events.")
+                continue
+            if documents:
+                self.apply_event_changes(documents)
+                logger.info(
+                    "Reloaded %d events, version %d.",
+                    len(documents),
+                    self.events_version,
+                )
+
+    async def load_leaderboard(self):
+        """Loads scores of all players to the leaderboard."""
+        await self.leaderboard.load(self.players_dao)
+        # Scores of cached players could be not saved yet
+        for player in self.players.values():
+            self.leaderboard.update(player._id, player.score)
+
+    async def _load_leaderboard(self):
+        await self.players_dao.ensure_indexes()
+        await self.load_leaderboard()
+        if WORKERS > 1:
+            self._leaderboard_task = asyncio.create_task(
+                self._reload_leaderboard()
+            )
+
+    async def wait_for_leaderboard(self):
+        """Waits until the leaderboard is loaded, raises the loading error
+        if it failed."""
+        if self._leaderboard_loading is not None:
+            await asyncio.shield(self._leaderboard_loading)
+
+    async def _reload_leaderboard(self):
+        """Reloads scores of players of the other worker processes."""
+        while True:
+            await asyncio.sleep(LEADERBOARD_RELOAD_INTERVAL)
+            try:
+                await self.load_leaderboard()
+            except Exception:
+                logger.exception("Failed to reload the leaderboard.")
+
+    def _touch_round(self, player: Player):
+        """Moves the deadline of the player's round."""
+        if ROUND_TTL and player.in_game:
+            self.rounds.schedule(player._id, time.monotonic() + ROUND_TTL)
+
+    def expire_rounds(self, now: Optional[float] = None) -> int:
+        """Ends rounds of players idle for longer than `ROUND_TTL`.
+
+        The round is cancelled or surrendered according to
+        `ROUND_EXPIRY_ACTION`, the change is saved with the next flush and
+        the player is evicted from the cache then.
+
+        Returns:
+            A number of ended rounds.
+        """
+        expired = 0
+        for player_id in self.rounds.advance(now):
+            # Rounds which ended or players which were evicted meanwhile
+            # are skipped, peeking doesn't keep the player in the cache
+            player = self.players.peek(player_id)
+            if player is None or not player.in_game:
+                continue
+            if ROUND_EXPIRY_ACTION == "surrender":
+                self.surrender(player)
+            else:
+                self.cancel(player)
+            self.players.expire(player_id)
+            expired += 1
+        if expired:
+            logger.info("Ended %d idle rounds.", expired)
+        return expired
+
+    async def _expire_rounds(self):
+        """Ends idle rounds every `ROUND_EXPIRY_TICK` seconds."""
+        while True:
+            await asyncio.sleep(ROUND_EXPIRY_TICK)
+            self.expire_rounds()
+
+    async def get_player(self, player_id: int) -> Player:
         """Gets a player by id from the cache if exists otherviese from DB.
 
         Retrives a player for the cache if it exists otherviese from
@@ -58,13 +378,15 @@ class GuessGame:
             The player instance with given id.
         """
         if player := self.players.get(player_id):
+            self._touch_round(player)
             return player
 
-        try:
-            player = self.players_dao.get(player_id)
-        except ObjectDoesNotExists:
-            player, _ = self.players_dao.create(Player(_id=player_id))
-        self.players[player_id] = player
+        player, _ = await self.players_dao.get_or_create(player_id)
+        self.leaderboard.update(player._id, player.score)
+        # Another handler could cache the player while this one was waiting
+        # for the database, keep the first cached instance
+        player = self.players.add(player)
+        self._touch_round(player)
         return player
 
     def _get_event_for_player(self, player: Player) -> HistoricalEvent:
@@ -78,13 +400,10 @@ class GuessGame:
         Returns:
             A next historival event for guessing.
         """
-        for event in self.events.values():
-            if event._id not in player.guessed_events:
-                return event
-        player.guessed_events = []
-        return self._get_event_for_player(player)
+        with SELECTION_LATENCY.time():
+            return self.events[self.selector.next_event_id(player)]
 
-    def play(self, player_id: int) -> HistoricalEvent:
+    async def play(self, player_id: int) -> HistoricalEvent:
         """Starts a new game round for a given player.
 
         Retrieves the `Player` instance, sets the `current_event` for
@@ -96,10 +415,12 @@ class GuessGame:
         Returns:
             A next historival event for guessing.
         """
-        player = self.get_player(player_id)
+        player = await self.get_player(player_id)
+        await self.wait_for_events()
         event = self._get_event_for_player(player)
         player.current_event = event._id
-        self.players[player._id] = player
+        self.players.mark_dirty(player)
+        self._touch_round(player)
         return event
 
     def guess(
@@ -122,15 +443,21 @@ class GuessGame:
         """
         event = self.events[player.current_event]
         player.attempts += 1
+        self.telemetry.record(
+            player._id, event._id, "guess", date, event_date=event.date
+        )
         if event.date == date:
-            player.guessed_events.append(player.current_event)
+            player.add_guessed_event(player.current_event)
             player.current_event = None
+            self.rounds.cancel(player._id)
             player.score += 10
-            self.players[player._id] = player
+            self.players.mark_dirty(player)
+            self.leaderboard.update(player._id, player.score)
             return "Ты угадал, ура!", event
         else:
             player.score -= 1
-            self.players[player._id] = player
+            self.players.mark_dirty(player)
+            self.leaderboard.update(player._id, player.score)
             if date > event.date:
                 return "Это произошло раньше.", None
             else:
@@ -150,11 +477,163 @@ class GuessGame:
             The hidden event.
         """
         event = self.events[player.current_event]
+        self.telemetry.record(player._id, event._id, "surrender")
         player.current_event = None
+        self.rounds.cancel(player._id)
         player.score -= 10
-        self.players[player._id] = player
+        self.players.mark_dirty(player)
+        self.leaderboard.update(player._id, player.score)
         return event
 
+    def duel(
+        self, player: Player
+    ) -> Tuple[Optional[Match], Optional[HistoricalEvent]]:
+        """Puts the player into the duel queue.
+
+        Args:
+            player: A player looking for an opponent.
+
+        Returns:
+            Tuple - the started match and the event to guess if an opponent
+                    was found, `None`s if the player waits for an opponent.
+        """
+        opponent_id = self.duels.matchmaker.add(player._id, player.score)
+        if opponent_id is None:
+            return None, None
+        # The opponent is cached unless it's idle for longer than the wait
+        opponent = self.players.get(opponent_id)
+        event_id = self.selector.shared_event_id(
+            [player, opponent] if opponent else [player]
+        )
+        match = self.duels.start((opponent_id, player._id), event_id)
+        return match, self.events[event_id]
+
+    def duel_guess(
+        self, player: Player, match: Match, date: int
+    ) -> Tuple[str, Optional[HistoricalEvent]]:
+        """Processes a player's guess in the duel.
+
+        The first player to guess the date wins the match and gets points.
+
+        Returns:
+            Tuple - message (a hint for guessing or success message),
+                    the event if guessed, `None` othervise.
+        """
+        event = self.events[match.event_id]
+        if event.date != date:
+            if date > event.date:
+                return "Это произошло раньше.", None
+            return "Это произошло позже.", None
+        self.duels.finish(match)
+        player.score += 10
+        self.players.mark_dirty(player)
+        self.leaderboard.update(player._id, player.score)
+        return "Вы победили в дуэли! +10 очков.", event
+
+    def leave_duel(self, player: Player, match: Match) -> HistoricalEvent:
+        """Ends the duel without a winner and returns the event."""
+        self.duels.finish(match)
+        return self.events[match.event_id]
+
+    async def play_group(self, chat_id: int) -> Tuple[GroupRound, bool]:
+        """Starts a shared round of the group chat unless it has one.
+
+        Returns:
+            Tuple - the round of the chat, whether it was started.
+        """
+        await self.wait_for_events()
+        # Another member could start the round while events were loading
+        group_round = self.groups.get(chat_id)
+        if group_round is not None:
+            return group_round, False
+        event_id = self.selector.shared_event_id([])
+        return self.groups.start(chat_id, event_id), True
+
+    def group_guess(
+        self, group_round: GroupRound, player_id: int, date: int
+    ) -> Optional[HistoricalEvent]:
+        """Processes a guess of a member of the group chat.
+
+        Wrong guesses are not answered, see `groups.GroupRounds.take_hints`.
+
+        Returns:
+            The event if the date is right and the round ended, `None`
+            othervise.
+        """
+        event = self.events[group_round.event_id]
+        if self.groups.guess(group_round, player_id, date, event.date):
+            return event
+        return None
+
+    def surrender_group(self, group_round: GroupRound) -> HistoricalEvent:
+        """Ends the round of the group chat and returns the hidden event."""
+        self.groups.surrender(group_round)
+        return self.events[group_round.event_id]
+
+    async def save_group_scores(self, stopping: bool = False):
+        """Applies score changes of ended group rounds to the players.
+
+        Only the worker of a player caches it, so changes of players of
+        other workers are passed to them, see `sharding.ShardQueues`. Other
+        players are loaded into the cache with one query and saved with
+        the next flush. Changes which failed to apply are kept for the next
+        call.
+
+        Args:
+            stopping: Whether the game is stopping. Other workers could be
+                      stopped already, so changes of their players are
+                      added in the database. Their cached players are saved
+                      with increments, so both changes are kept.
+        """
+        scores, self.groups.unsaved = self.groups.unsaved, {}
+        others = {}
+        if self.shards is not None:
+            for player_id in list(scores):
+                if not self.shards.owns(player_id):
+                    others[player_id] = scores.pop(player_id)
+        if others and not stopping:
+            self.shards.send_scores(others)
+        elif others:
+            try:
+                await self.players_dao.add_scores(others)
+            except Exception:
+                logger.exception(
+                    "Failed to save scores of %d players.", len(others)
+                )
+        if not scores:
+            return
+        try:
+            await self._add_scores(scores)
+        except Exception:
+            logger.exception(
+                "Failed to save scores of %d players.", len(scores)
+            )
+            self.groups.add_unsaved(scores)
+
+    async def _add_scores(self, scores: Dict[int, List[int]]):
+        """Adds score changes and attempts to the players of the worker."""
+        missing = [
+            player_id for player_id in scores if player_id not in self.players
+        ]
+        loaded = await self.players_dao.get_many(missing) if missing else {}
+        for player_id, (score, attempts) in scores.items():
+            player = self.players.peek(player_id)
+            if player is None:
+                player = loaded.get(player_id)
+            if player is None:
+                player = Player(_id=player_id)
+                # Not in the database yet, the first save writes all fields
+                player.saved_state_unknown = True
+            # Another handler could cache the player during the query
+            player = self.players.add(player)
+            player.score += score
+            player.attempts += attempts
+            self.players.mark_dirty(player)
+            self.leaderboard.update(player._id, player.score)
+
     def cancel(self, player: Player):
+        if player.current_event is not None:
+            self.telemetry.record(player._id, player.current_event, "cancel")
         player.current_event = None
-        self.players[player._id] = player
+        self.rounds.cancel(player._id)
+        self.players.mark_dirty(player)
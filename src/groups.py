@@ -0,0 +1,255 @@
+"""Shared rounds in group chats.
+
+In a group chat `/play` starts one round for the whole chat and every
+member can guess. A guess only updates the counters of the round and of
+the participant, so it takes O(1) and touches neither the database nor
+the Bot API. Wrong guesses are not answered one by one: chats with new
+guesses are hinted once per `hint_interval` with a summary of how many
+guesses were earlier and later and the years left.
+
+When the round ends, by the right guess, `/sur` or inactivity, the score
+changes of all participants are collected in `GroupRounds.unsaved` and
+`GuessGame.save_group_scores` applies them to the cached players, loading
+the missing ones with one query, or passes them to the workers of
+the players.
+
+"""
+import asyncio
+import logging
+import time
+from dataclasses import dataclass, field
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+
+from sessions import TimerWheel
+
+
+logger = logging.getLogger(__name__)
+
+# Points of the right and of a wrong guess in a group round
+WIN_POINTS = 10
+MISS_POINTS = -1
+
+
+@dataclass(slots=True)
+class GroupRound:
+    """Class representing a round of a group chat.
+
+    Properties:
+        chat_id: Id of the group chat.
+        event_id: Id of the event to guess.
+        low: The earliest year the event could happen in by the guesses.
+        high: The latest year the event could happen in by the guesses.
+        earlier: A number of guesses later than the event since the last
+                 hint.
+        later: A number of guesses earlier than the event since the last
+               hint.
+        attempts: A number of all guesses of the round.
+        participants: A dictionary mapping from player id to the player's
+                      score change and number of attempts in the round.
+        winner: Id of the player who guessed the date.
+
+    """
+
+    chat_id: int
+    event_id: int
+    low: int = 0
+    high: int = 2023
+    earlier: int = 0
+    later: int = 0
+    attempts: int = 0
+    participants: Dict[int, List[int]] = field(default_factory=dict)
+    winner: Optional[int] = None
+
+    def guess(self, player_id: int, date: int, event_date: int) -> bool:
+        """Records the player's guess.
+
+        Returns:
+            Whether the date is right.
+        """
+        entry = self.participants.get(player_id)
+        if entry is None:
+            entry = self.participants[player_id] = [0, 0]
+        entry[1] += 1
+        self.attempts += 1
+        if date == event_date:
+            entry[0] += WIN_POINTS
+            self.winner = player_id
+            return True
+        entry[0] += MISS_POINTS
+        if date > event_date:
+            self.earlier += 1
+            self.high = min(self.high, date - 1)
+        else:
+            self.later += 1
+            self.low = max(self.low, date + 1)
+        return False
+
+    def take_hint(self) -> str:
+        """Returns the summary of guesses since the last hint and resets
+        their counters."""
+        guesses = self.earlier + self.later
+        text = (
+            f"Попыток: {guesses}, из них «раньше»: {self.earlier}, "
+            f"«позже»: {self.later}.\n"
+            f"Событие произошло между {self.low} и {self.high} годом."
+        )
+        self.earlier = self.later = 0
+        return text
+
+
+TickCallback = Callable[
+    [List[Tuple[GroupRound, str]], List[GroupRound]], Awaitable[None]
+]
+
+
+class GroupRounds:
+    """Rounds of group chats.
+
+    Properties:
+        rounds: A dictionary mapping from chat id to the chat's round.
+        hint_interval: Seconds between hints of a chat.
+        timeout: Seconds without guesses after which a round ends.
+        deadlines: Deadlines of rounds by chat id.
+        unsaved: Score changes and attempts of players of ended rounds not
+                 saved yet, in the same format as `GroupRound.participants`.
+        stats: Counters of started, won, surrendered and expired rounds,
+               guesses and hints.
+
+    """
+
+    rounds: Dict[int, GroupRound]
+    hint_interval: float
+    timeout: float
+    deadlines: TimerWheel
+    unsaved: Dict[int, List[int]]
+    stats: Dict[str, int]
+
+    def __init__(self, hint_interval: float, timeout: float):
+        self.rounds = {}
+        self.hint_interval = hint_interval
+        self.timeout = timeout
+        self.deadlines = TimerWheel(hint_interval, timeout)
+        self.unsaved = {}
+        self.stats = dict.fromkeys(
+            ("started", "won", "surrendered", "expired", "guesses", "hints"),
+            0,
+        )
+        # Chats with guesses since the last hint, in the order of the first
+        # guess
+        self._hinting: Dict[int, None] = {}
+        self._task: Optional[asyncio.Task] = None
+
+    def __len__(self) -> int:
+        return len(self.rounds)
+
+    def get(self, chat_id: int) -> Optional[GroupRound]:
+        """Returns the chat's running round or `None`."""
+        return self.rounds.get(chat_id)
+
+    def _touch(self, chat_id: int, now: Optional[float] = None):
+        now = time.monotonic() if now is None else now
+        self.deadlines.schedule(chat_id, now + self.timeout)
+
+    def start(
+        self, chat_id: int, event_id: int, now: Optional[float] = None
+    ) -> GroupRound:
+        """Starts a round of the chat."""
+        group_round = self.rounds[chat_id] = GroupRound(chat_id, event_id)
+        self._touch(chat_id, now)
+        self.stats["started"] += 1
+        return group_round
+
+    def guess(
+        self,
+        group_round: GroupRound,
+        player_id: int,
+        date: int,
+        event_date: int,
+    ) -> bool:
+        """Records the guess, the round ends if the date is right.
+
+        Returns:
+            Whether the date is right.
+        """
+        self.stats["guesses"] += 1
+        if group_round.guess(player_id, date, event_date):
+            self.finish(group_round)
+            self.stats["won"] += 1
+            return True
+        self._hinting[group_round.chat_id] = None
+        self._touch(group_round.chat_id)
+        return False
+
+    def surrender(self, group_round: GroupRound):
+        """Ends the round without a winner."""
+        self.finish(group_round)
+        self.stats["surrendered"] += 1
+
+    def finish(self, group_round: GroupRound):
+        """Removes the round and adds the score changes of its participants
+        to `unsaved`."""
+        chat_id = group_round.chat_id
+        if self.rounds.get(chat_id) is not group_round:
+            return
+        del self.rounds[chat_id]
+        self._hinting.pop(chat_id, None)
+        self.deadlines.cancel(chat_id)
+        self.add_unsaved(group_round.participants)
+
+    def take_hints(self) -> List[Tuple[GroupRound, str]]:
+        """Returns rounds with guesses since the last call with the summary
+        of the guesses."""
+        hints = [
+            (self.rounds[chat_id], self.rounds[chat_id].take_hint())
+            for chat_id in self._hinting
+        ]
+        self._hinting.clear()
+        self.stats["hints"] += len(hints)
+        return hints
+
+    def expire(self, now: Optional[float] = None) -> List[GroupRound]:
+        """Ends rounds without guesses for `timeout` seconds.
+
+        Returns:
+            The ended rounds.
+        """
+        expired = []
+        for chat_id in self.deadlines.advance(now):
+            group_round = self.rounds.get(chat_id)
+            if group_round is not None:
+                self.finish(group_round)
+                expired.append(group_round)
+        self.stats["expired"] += len(expired)
+        return expired
+
+    def add_unsaved(self, scores: Dict[int, List[int]]):
+        """Adds score changes and attempts of players to `unsaved`, e.g.
+        the ones which failed to save."""
+        for player_id, (score, attempts) in scores.items():
+            entry = self.unsaved.setdefault(player_id, [0, 0])
+            entry[0] += score
+            entry[1] += attempts
+
+    async def run(self, on_tick: TickCallback):
+        """Every `hint_interval` seconds takes hints and expired rounds and
+        passes them to the callback."""
+        while True:
+            await asyncio.sleep(self.hint_interval)
+            hints = self.take_hints()
+            expired = self.expire()
+            if hints or expired or self.unsaved:
+                try:
+                    await on_tick(hints, expired)
+                except Exception:
+                    logger.exception("Failed to notify group chats.")
+
+    def start_hinting(self, on_tick: TickCallback):
+        """Starts the background hints and expiration task."""
+        if self._task is None:
+            self._task = asyncio.create_task(self.run(on_tick))
+
+    def stop(self):
+        """Stops the background hints and expiration task."""
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
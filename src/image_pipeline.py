@@ -0,0 +1,275 @@
+"""Optimization of event images for Telegram.
+
+Telegram shows photos at most 1280 pixels on a side and recompresses them
+anyway, so bigger images and their metadata only make uploads slower.
+`optimize_images` downscales images to `IMAGES_MAX_SIZE`, recompresses
+them with `IMAGES_QUALITY` and strips metadata. Results are stored in
+`IMAGES_CACHE_PATH` under the hash of the source content and the settings,
+and a manifest maps every source image to its optimized file.
+
+Sources whose size and modification time didn't change since the last run
+are not even read, changed ones are hashed and only new contents are
+processed, in parallel processes. The bot reads only the manifest, see
+`get_optimized_path`, so Pillow is needed only to build the images.
+
+"""
+import functools
+import hashlib
+import io
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import asdict, dataclass
+from typing import Dict, Iterable, List, Optional
+
+import config
+from config import BASE_PATH
+
+# Bump when the processing changes, so all images are processed again
+PIPELINE_VERSION = 1
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".webp")
+MANIFEST_NAME = "manifest.json"
+# The IJG luminance quantization table of quality 50, other qualities scale
+# it, see `_jpeg_quality`
+# fmt: off
+STANDARD_LUMINANCE_TABLE = (
+    16, 11, 10, 16, 24, 40, 51, 61, 12, 12, 14, 19, 26, 58, 60, 55,
+    14, 13, 16, 24, 40, 57, 69, 56, 14, 17, 22, 29, 51, 87, 80, 62,
+    18, 22, 37, 56, 68, 109, 103, 77, 24, 35, 55, 64, 81, 104, 113, 92,
+    49, 64, 78, 87, 103, 121, 120, 101, 72, 92, 95, 98, 112, 100, 103, 99,
+)
+# fmt: on
+
+
+@dataclass(slots=True)
+class OptimizedImage:
+    """Class representing a manifest record of an optimized image.
+
+    Properties:
+        path: Path to the source image relative to `BASE_PATH`, as in
+              `HistoricalEvent.image_path`.
+        size: Size of the source image in bytes.
+        mtime_ns: Modification time of the source image.
+        file: Name of the optimized file in the cache directory.
+        optimized_size: Size of the optimized file in bytes.
+        settings: The pipeline version, the maximum size and the quality
+                  the file was made with.
+        status: How the file was got by the last run: `optimized`,
+                `cached` if a file with the same content hash existed or
+                `unchanged` if the source didn't change.
+
+    """
+
+    path: str
+    size: int
+    mtime_ns: int
+    file: str
+    optimized_size: int
+    settings: str
+    status: str = "optimized"
+
+    @property
+    def saved(self) -> int:
+        """Bytes saved by the optimization."""
+        return self.size - self.optimized_size
+
+
+def _settings_key(max_size: int, quality: int) -> str:
+    return f"{PIPELINE_VERSION}:{max_size}:{quality}"
+
+
+def _jpeg_quality(image) -> Optional[int]:
+    """Estimates the quality a JPEG image was saved with from its
+    luminance quantization table."""
+    tables = getattr(image, "quantization", None)
+    if not tables:
+        return None
+    scale = sum(tables[0]) * 100 / sum(STANDARD_LUMINANCE_TABLE)
+    quality = (200 - scale) / 2 if scale <= 100 else 5000 / scale
+    return max(1, min(100, round(quality)))
+
+
+def optimize_file(
+    path: str, cache_path: str, max_size: int, quality: int
+) -> OptimizedImage:
+    """Optimizes the image unless the cache has it.
+
+    A JPEG is never recompressed with a higher quality than it was saved
+    with, which would only add bytes, and the optimized file is never
+    bigger than the source JPEG: if recompressing doesn't pay off,
+    the source is kept as is.
+
+    Args:
+        path: Path to the source image relative to `BASE_PATH`.
+        cache_path: The cache directory.
+        max_size: The maximum width and height in pixels.
+        quality: JPEG quality from 1 to 95.
+    """
+    source = os.path.join(BASE_PATH, path)
+    stat = os.stat(source)
+    with open(source, "rb") as file:
+        data = file.read()
+    settings = _settings_key(max_size, quality)
+    digest = hashlib.sha256(data + settings.encode())
+    name = f"{digest.hexdigest()[:32]}.jpg"
+    target = os.path.join(cache_path, name)
+    image = OptimizedImage(
+        path, len(data), stat.st_mtime_ns, name, 0, settings
+    )
+    if os.path.isfile(target):
+        image.optimized_size = os.path.getsize(target)
+        image.status = "cached"
+        return image
+
+    from PIL import Image, ImageOps
+
+    with Image.open(io.BytesIO(data)) as original:
+        is_jpeg = original.format == "JPEG"
+        if is_jpeg:
+            quality = min(quality, _jpeg_quality(original) or quality)
+        picture = ImageOps.exif_transpose(original)
+        if picture.mode in ("RGBA", "LA", "P"):
+            # JPEG has no transparency, put the image on white
+            picture = picture.convert("RGBA")
+            background = Image.new("RGB", picture.size, "white")
+            background.paste(picture, mask=picture.getchannel("A"))
+            picture = background
+        elif picture.mode not in ("RGB", "L"):
+            picture = picture.convert("RGB")
+        picture.thumbnail((max_size, max_size), Image.LANCZOS)
+        output = io.BytesIO()
+        # Metadata (EXIF, ICC profile, comments) is not passed, so it's
+        # stripped
+        picture.save(
+            output, "JPEG", quality=quality, optimize=True, progressive=True
+        )
+    optimized = output.getvalue()
+    if is_jpeg and len(data) <= len(optimized):
+        optimized = data
+    temporary = f"{target}.{os.getpid()}.tmp"
+    with open(temporary, "wb") as file:
+        file.write(optimized)
+    os.replace(temporary, target)
+    image.optimized_size = len(optimized)
+    return image
+
+
+def find_images(directory: str) -> List[str]:
+    """Returns paths relative to `BASE_PATH` of images in the directory."""
+    return sorted(
+        os.path.relpath(os.path.join(root, name), BASE_PATH)
+        for root, _, names in os.walk(directory)
+        for name in names
+        if name.lower().endswith(IMAGE_EXTENSIONS)
+    )
+
+
+def read_manifest(cache_path: str) -> Dict[str, OptimizedImage]:
+    """Returns a dictionary mapping from source path to its record."""
+    try:
+        with open(os.path.join(cache_path, MANIFEST_NAME)) as file:
+            records = json.load(file)
+    except FileNotFoundError:
+        return {}
+    return {record["path"]: OptimizedImage(**record) for record in records}
+
+
+def write_manifest(cache_path: str, images: Iterable[OptimizedImage]):
+    """Replaces the manifest atomically."""
+    path = os.path.join(cache_path, MANIFEST_NAME)
+    with open(f"{path}.tmp", "w") as file:
+        json.dump([asdict(image) for image in images], file, indent=1)
+    os.replace(f"{path}.tmp", path)
+
+
+def optimize_images(
+    paths: Iterable[str],
+    cache_path: Optional[str] = None,
+    max_size: int = 1280,
+    quality: int = 85,
+    jobs: Optional[int] = None,
+    force: bool = False,
+) -> List[OptimizedImage]:
+    """Optimizes changed images and updates the manifest.
+
+    Files of images which are not in `paths` anymore are removed from
+    the cache.
+
+    Args:
+        paths: Paths to source images relative to `BASE_PATH`.
+        cache_path: The cache directory, `IMAGES_CACHE_PATH` by default.
+        max_size: The maximum width and height in pixels.
+        quality: JPEG quality from 1 to 95.
+        jobs: A number of processes, all CPUs by default.
+        force: Whether to hash all sources even if they didn't change.
+
+    Returns:
+        Records of all images in the order of `paths`.
+    """
+    cache_path = cache_path or config.IMAGES_CACHE_PATH
+    os.makedirs(cache_path, exist_ok=True)
+    manifest = read_manifest(cache_path)
+    settings = _settings_key(max_size, quality)
+    images: Dict[str, OptimizedImage] = {}
+    changed = []
+    for path in paths:
+        stat = os.stat(os.path.join(BASE_PATH, path))
+        image = manifest.get(path)
+        if (
+            not force
+            and image is not None
+            and image.settings == settings
+            and image.size == stat.st_size
+            and image.mtime_ns == stat.st_mtime_ns
+            and os.path.isfile(os.path.join(cache_path, image.file))
+        ):
+            image.status = "unchanged"
+            images[path] = image
+        else:
+            images[path] = None
+            changed.append(path)
+    if changed:
+        optimize = functools.partial(
+            optimize_file,
+            cache_path=cache_path,
+            max_size=max_size,
+            quality=quality,
+        )
+        with ProcessPoolExecutor(jobs) as executor:
+            for image in executor.map(optimize, changed):
+                images[image.path] = image
+    write_manifest(cache_path, images.values())
+    used = {image.file for image in images.values()}
+    for name in os.listdir(cache_path):
+        if name.endswith(".jpg") and name not in used:
+            os.remove(os.path.join(cache_path, name))
+    return list(images.values())
+
+
+@functools.lru_cache(maxsize=1)
+def _read_manifest_once(cache_path: str) -> Dict[str, OptimizedImage]:
+    return read_manifest(cache_path)
+
+
+def get_optimized_path(path: str) -> Optional[str]:
+    """Returns the optimized file of the source image.
+
+    Args:
+        path: Path to the source image relative to `BASE_PATH`.
+
+    Returns:
+        An absolute path to the optimized file or `None` if the image was
+        not optimized or changed after that.
+    """
+    cache_path = config.IMAGES_CACHE_PATH
+    image = _read_manifest_once(cache_path).get(os.path.normpath(path))
+    if image is None:
+        return None
+    try:
+        stat = os.stat(os.path.join(BASE_PATH, path))
+    except OSError:
+        return None
+    if (stat.st_size, stat.st_mtime_ns) != (image.size, image.mtime_ns):
+        return None
+    optimized = os.path.join(cache_path, image.file)
+    return optimized if os.path.isfile(optimized) else None
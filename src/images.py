@@ -0,0 +1,128 @@
+"""Delivery of event images with the Telegram `file_id` cache.
+
+Telegram returns a `file_id` for every uploaded photo, which can be used to
+send the same photo again without uploading it. `ImageCache` remembers the
+`file_id` of each uploaded file after the first upload and stores it in
+the database, so popular events are uploaded only once. `file_id`s are kept
+by `HistoricalEvent.image_key`, so an image is uploaded again when its
+source changes or it gets optimized.
+
+"""
+import asyncio
+import logging
+from typing import Dict, Iterable, Optional, Union
+
+from aiogram import Bot
+from aiogram.types import FSInputFile, Message
+
+from dao import AsyncEventImageDao
+from models import HistoricalEvent
+
+
+logger = logging.getLogger(__name__)
+
+
+class ImageCache:
+    """Cache of Telegram `file_id`s of event images.
+
+    Properties:
+        images_dao: An instance of `AsyncEventImageDao` to store `file_id`s.
+        file_ids: A dictionary mapping from image key to its `file_id`.
+
+    """
+
+    images_dao: AsyncEventImageDao
+    file_ids: Dict[str, str]
+
+    def __init__(self, images_dao: AsyncEventImageDao):
+        self.images_dao = images_dao
+        self.file_ids = {}
+
+    async def load(self):
+        """Loads stored `file_id`s from the database.
+
+        `file_id`s of images uploaded while loading are kept.
+        """
+        file_ids = await self.images_dao.all()
+        file_ids.update(self.file_ids)
+        self.file_ids = file_ids
+
+    def get_photo(
+        self, event: HistoricalEvent
+    ) -> Optional[Union[str, FSInputFile]]:
+        """Returns the event photo to send.
+
+        Returns:
+            A `file_id` if the image was uploaded, otherwise the image file
+            to upload or `None` if the event has no image.
+        """
+        image_key = event.image_key
+        if image_key is None:
+            return None
+        return self.file_ids.get(image_key) or event.get_image_file()
+
+    async def remember(self, event: HistoricalEvent, message: Message):
+        """Remembers the `file_id` of the event image sent in the message."""
+        if not message.photo:
+            return
+        # The last photo size is the original image
+        file_id = message.photo[-1].file_id
+        image_key = event.image_key
+        self.file_ids[image_key] = file_id
+        try:
+            await self.images_dao.save(image_key, file_id)
+        except Exception:
+            logger.exception("Failed to save file_id of event %d.", event._id)
+
+    async def send_photo(
+        self, bot: Bot, chat_id: int, event: HistoricalEvent, **kwargs
+    ) -> Optional[Message]:
+        """Sends the event image to the chat if the event has an image.
+
+        Uploads the image on the first send and uses its `file_id` after.
+
+        Args:
+            bot: A bot to send the photo with.
+            chat_id: A chat to send the photo to.
+            event: An event which image to send.
+            kwargs: Extra arguments of `Bot.send_photo`.
+
+        Returns:
+            The sent message or `None` if the event has no image.
+        """
+        photo = self.get_photo(event)
+        if photo is None:
+            return None
+        message = await bot.send_photo(chat_id, photo, **kwargs)
+        if not isinstance(photo, str):
+            await self.remember(event, message)
+        return message
+
+    async def warm_up(
+        self,
+        bot: Bot,
+        chat_id: int,
+        events: Iterable[HistoricalEvent],
+        delay: float = 1,
+    ):
+        """Uploads event images that have no `file_id` yet to the chat.
+
+        Args:
+            bot: A bot to upload the images with.
+            chat_id: A service chat to send the images to.
+            events: Events which images to upload.
+            delay: Seconds between uploads to stay within the chat limits.
+        """
+        uploaded = 0
+        for event in events:
+            photo = self.get_photo(event)
+            if photo is None or isinstance(photo, str):
+                continue
+            try:
+                await self.send_photo(bot, chat_id, event)
+            except Exception:
+                logger.exception("Failed to upload image of %d.", event._id)
+            else:
+                uploaded += 1
+            await asyncio.sleep(delay)
+        logger.info("Images warm-up finished, uploaded %d images.", uploaded)
@@ -0,0 +1,36 @@
+"""Imports historical events from the events JSON file into MongoDB.
+
+Only added and changed events are written. Running bots with
+`EVENTS_SOURCE=mongo` pick the changes up without a restart.
+
+Usage:
+
+    python src/import_events.py [path] [--delete-missing]
+
+"""
+import argparse
+
+from config import EVENTS_FILE_PATH
+from dao import HistoricalEventDao
+from database import get_database
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("path", nargs="?", default=EVENTS_FILE_PATH)
+    parser.add_argument(
+        "--delete-missing",
+        action="store_true",
+        help="stop giving out events which are not in the file",
+    )
+    args = parser.parse_args()
+
+    events_dao = HistoricalEventDao(get_database())
+    written = events_dao.import_events(
+        events_dao.iter(args.path), delete_missing=args.delete_missing
+    )
+    print(f"Imported {written} changes.")
+
+
+if __name__ == "__main__":
+    main()
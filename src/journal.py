@@ -0,0 +1,275 @@
+"""Write-ahead journal of players changes.
+
+Changed players are saved to the database in the background, see
+`cache.PlayerCache`, so a killed process would lose the changes made since
+the last flush. Every change of a player is appended to the journal before
+the bot answers, the journal is synced to the disk in batches and replayed
+into the database when the game starts.
+
+The journal is a sequence of segment files with JSON lines. A new segment
+is started when a flush begins and the previous ones are removed when
+the flush succeeds, as all their changes are in the database by then.
+
+An entry has the new values of the player fields and the guessed events
+added since the previous entry of the player, so replaying entries over
+a state saved to the database in the middle of the journal gives the same
+result.
+
+"""
+import asyncio
+import glob
+import json
+import logging
+import os
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+from dao import AsyncPlayerDao
+from models import Player
+
+
+logger = logging.getLogger(__name__)
+
+
+def make_entry(player: Player) -> dict:
+    """Returns a journal entry with the player's changes."""
+    reset, guessed_events = player.pop_recent_guessed_events()
+    entry = {
+        "_id": player._id,
+        "current_event": player.current_event,
+        "attempts": player.attempts,
+        "score": player.score,
+    }
+    if reset:
+        entry["reset"] = True
+    if guessed_events:
+        entry["guessed"] = guessed_events
+    return entry
+
+
+def apply_entry(player: Player, entry: dict):
+    """Applies the journal entry to the player."""
+    if entry.get("reset"):
+        player.reset_guessed_events()
+    for event_id in entry.get("guessed", ()):
+        player.add_guessed_event(event_id)
+    player.current_event = entry["current_event"]
+    player.attempts = entry["attempts"]
+    player.score = entry["score"]
+
+
+class PlayerJournal:
+    """Append-only journal of players changes with batched fsync.
+
+    Properties:
+        path: A path prefix of the segment files, segments are named
+              `<path>.<number>.log`.
+        sync_interval: Seconds between syncs of written entries to the disk.
+        segment: The number of the segment new entries are appended to.
+        stats: Counters of written entries and syncs.
+
+    """
+
+    path: str
+    sync_interval: float
+    segment: int
+    stats: Dict[str, int]
+
+    def __init__(self, path: str, sync_interval: float = 0.1):
+        self.path = path
+        self.sync_interval = sync_interval
+        self.segment = 0
+        self.stats = {"entries": 0, "syncs": 0, "replayed": 0}
+        self._fd: Optional[int] = None
+        # Descriptors of finished segments which are not synced yet
+        self._sealed: List[int] = []
+        self._unsynced = False
+        self._syncing: Optional[asyncio.Future] = None
+        self._task: Optional[asyncio.Task] = None
+
+    def _segment_path(self, segment: int) -> str:
+        return f"{self.path}.{segment:08d}.log"
+
+    def segments(self) -> List[Tuple[int, str]]:
+        """Returns numbers and paths of existing segments in order."""
+        segments = []
+        for path in glob.glob(f"{glob.escape(self.path)}.*.log"):
+            number = path[len(self.path) + 1 : -len(".log")]
+            if number.isdigit():
+                segments.append((int(number), path))
+        return sorted(segments)
+
+    def _open_segment(self, segment: int):
+        self.segment = segment
+        self._fd = os.open(
+            self._segment_path(segment),
+            os.O_WRONLY | os.O_CREAT | os.O_APPEND,
+            0o644,
+        )
+
+    def open(self):
+        """Starts a new segment after the existing ones."""
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        segments = self.segments()
+        self._open_segment(segments[-1][0] + 1 if segments else 1)
+
+    def read(self, until: int) -> Iterator[dict]:
+        """Reads entries of segments up to the given one.
+
+        A partially written entry at the end of a segment is skipped.
+        """
+        for number, path in self.segments():
+            if number > until:
+                break
+            with open(path, "rb") as file:
+                for line in file:
+                    try:
+                        yield json.loads(line)
+                    except ValueError:
+                        logger.warning("Skipped a broken entry in %s.", path)
+
+    def append(self, player: Player):
+        """Writes the player's changes to the journal.
+
+        The entry is in the OS page cache after the call, so it survives
+        a crash of the process, and is synced to the disk in background.
+        """
+        line = json.dumps(make_entry(player), separators=(",", ":")) + "\n"
+        os.write(self._fd, line.encode())
+        self._unsynced = True
+        self.stats["entries"] += 1
+
+    def rotate(self) -> int:
+        """Starts a new segment.
+
+        Returns:
+            The number of the last finished segment.
+        """
+        self._sealed.append(self._fd)
+        finished = self.segment
+        self._open_segment(finished + 1)
+        return finished
+
+    def compact(self, until: int):
+        """Removes segments up to the given one after their changes were
+        saved to the database."""
+        for number, path in self.segments():
+            if number > until:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                logger.exception("Failed to remove %s.", path)
+
+    def _take_unsynced(self) -> List[int]:
+        fds, self._sealed = self._sealed + [self._fd], []
+        self._unsynced = False
+        self.stats["syncs"] += 1
+        return fds
+
+    @staticmethod
+    def _sync(fds: List[int]):
+        """Syncs the segments to the disk and closes all but the last one."""
+        for fd in fds[:-1]:
+            os.fsync(fd)
+            os.close(fd)
+        os.fsync(fds[-1])
+
+    async def run(self):
+        """Syncs written entries every `sync_interval` seconds."""
+        loop = asyncio.get_running_loop()
+        while True:
+            await asyncio.sleep(self.sync_interval)
+            if self._unsynced or self._sealed:
+                self._syncing = loop.run_in_executor(
+                    None, self._sync, self._take_unsynced()
+                )
+                # The sync can't be interrupted, `stop` waits for it
+                await asyncio.shield(self._syncing)
+
+    def start(self):
+        """Starts the background sync task."""
+        if self._task is None:
+            self._task = asyncio.create_task(self.run())
+
+    async def stop(self):
+        """Stops the background sync task, syncs and closes the journal."""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        if self._syncing is not None:
+            await self._syncing
+        self._sync(self._take_unsynced())
+        os.close(self._fd)
+
+    async def recover(
+        self, players_dao: AsyncPlayerDao, batch_size: int = 1000
+    ) -> int:
+        """Replays entries of the existing segments into the database and
+        removes the segments.
+
+        Must be called after `open` and before new entries are appended.
+
+        Returns:
+            A number of recovered players.
+        """
+        finished = self.segment - 1
+        entries: Dict[int, List[dict]] = {}
+        for entry in self.read(finished):
+            entries.setdefault(entry["_id"], []).append(entry)
+        player_ids = list(entries)
+        for start in range(0, len(player_ids), batch_size):
+            batch = player_ids[start : start + batch_size]
+            players = await players_dao.get_many(batch)
+            for player_id in batch:
+                if player_id not in players:
+                    players[player_id], _ = await players_dao.get_or_create(
+                        player_id
+                    )
+                player = players[player_id]
+                for entry in entries[player_id]:
+                    apply_entry(player, entry)
+                players[player_id] = player
+            await players_dao.save_many(players.values())
+        self.compact(finished)
+        self.stats["replayed"] += len(player_ids)
+        if player_ids:
+            logger.info("Recovered %d players from journal.", len(player_ids))
+        return len(player_ids)
+
+
+def find_journals(directory: str) -> List[str]:
+    """Returns path prefixes of the journals with segments in the directory."""
+    paths = set()
+    for path in glob.glob(os.path.join(glob.escape(directory), "*.log")):
+        prefix, number = path[: -len(".log")].rsplit(".", 1)
+        if number.isdigit():
+            paths.add(prefix)
+    return sorted(paths)
+
+
+async def recover_journals(
+    directory: str, players_dao: AsyncPlayerDao, keep: Iterable[str] = ()
+) -> int:
+    """Replays into the database and removes the journals in the directory
+    except the given ones, e.g. the journals of workers removed by
+    decreasing `WORKERS`.
+
+    Must be called before the processes writing the journals start.
+
+    Returns:
+        A number of recovered players.
+    """
+    keep = {os.path.join(directory, name) for name in keep}
+    recovered = 0
+    for path in find_journals(directory):
+        if path in keep:
+            continue
+        journal = PlayerJournal(path)
+        # Nothing is appended to the journal, all its segments are finished
+        journal.segment = journal.segments()[-1][0] + 1
+        recovered += await journal.recover(players_dao)
+    return recovered
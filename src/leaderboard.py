@@ -0,0 +1,100 @@
+"""Ranking of players by score.
+
+`Leaderboard` keeps scores of all players in a sorted index which is
+loaded once from the `score` index of the `Players` collection and then
+updated in memory on every score change, so ranks and top pages are
+answered without queries to the database.
+
+"""
+import asyncio
+import logging
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from sortedcontainers import SortedList
+
+from dao import AsyncPlayerDao
+
+
+logger = logging.getLogger(__name__)
+
+
+class Leaderboard:
+    """Players ordered by score with O(log n) updates and rank queries.
+
+    Players with equal scores share the rank and are listed by id.
+
+    Properties:
+        scores: A dictionary mapping from player id to the player's score.
+        index: A sorted list of `(-score, player_id)` pairs.
+
+    """
+
+    scores: Dict[int, int]
+    index: SortedList
+
+    def __init__(self, scores: Iterable[Tuple[int, int]] = ()):
+        """Creates the leaderboard.
+
+        Args:
+            scores: Pairs of player id and score.
+        """
+        self.scores = dict(scores)
+        self.index = SortedList(
+            (-score, player_id) for player_id, score in self.scores.items()
+        )
+
+    def __len__(self) -> int:
+        return len(self.scores)
+
+    def __contains__(self, player_id: int) -> bool:
+        return player_id in self.scores
+
+    def update(self, player_id: int, score: int):
+        """Sets the player's score adding the player if it's new."""
+        old_score = self.scores.get(player_id)
+        if old_score == score:
+            return
+        if old_score is not None:
+            self.index.remove((-old_score, player_id))
+        self.scores[player_id] = score
+        self.index.add((-score, player_id))
+
+    def rank(self, player_id: int) -> Optional[int]:
+        """Returns the player's rank starting from 1 or `None` if the player
+        is not on the leaderboard."""
+        score = self.scores.get(player_id)
+        if score is None:
+            return None
+        # A 1-tuple is less than all pairs with the same score
+        return self.index.bisect_left((-score,)) + 1
+
+    def top(self, offset: int = 0, limit: int = 10) -> List[Tuple[int, int]]:
+        """Returns a page of the leaderboard.
+
+        Args:
+            offset: A number of best players to skip.
+            limit: A maximum number of players on the page.
+
+        Returns:
+            Pairs of player id and score from the best player.
+        """
+        return [
+            (player_id, -score)
+            for score, player_id in self.index.islice(offset, offset + limit)
+        ]
+
+    async def load(self, players_dao: AsyncPlayerDao):
+        """Replaces the leaderboard with scores of all players stored in
+        the database."""
+        scores = {}
+        async for player_id, score in players_dao.iter_scores():
+            scores[player_id] = score
+            if len(scores) % 10000 == 0:
+                # Let handlers run while a big collection is read
+                await asyncio.sleep(0)
+        self.scores = scores
+        # Scores come sorted, so building the index is a cheap merge of runs
+        self.index = SortedList(
+            (-score, player_id) for player_id, score in scores.items()
+        )
+        logger.info("Loaded %d players to the leaderboard.", len(scores))
@@ -0,0 +1,157 @@
+"""Streaming loader of the events file.
+
+The events file is either a JSON array of events or JSON Lines (one event
+per line). Events are parsed one by one while reading the file by chunks,
+so the whole file and all its records are never in memory at once. Every
+record is validated before it becomes a `HistoricalEvent`.
+
+With lazy descriptions events keep only the position of their record in
+the file and the description is read from the file when it's revealed.
+
+"""
+import json
+from typing import Iterator, Tuple
+
+from models import HistoricalEvent
+
+
+CHUNK_SIZE = 64 * 1024
+
+# Field name to allowed types and whether the field is required
+EVENT_SCHEMA = {
+    "_id": (int, True),
+    "_type": (str, True),
+    "event": (str, True),
+    "date": (int, True),
+    "description": ((str, type(None)), False),
+    "image_path": ((str, type(None)), False),
+}
+
+
+class InvalidEventError(ValueError):
+    """The events file has a malformed record."""
+
+    pass
+
+
+def iter_records(
+    path: str, chunk_size: int = CHUNK_SIZE
+) -> Iterator[Tuple[int, int, object]]:
+    """Parses records of a JSON array or JSON Lines file one by one.
+
+    Args:
+        path: A path to the file.
+        chunk_size: A number of characters read from the file at once.
+
+    Yields:
+        A byte offset of the record in the file, its length in bytes and
+        the parsed record.
+
+    Raises:
+        InvalidEventError: The file is not a JSON array or JSON Lines.
+    """
+    decoder = json.JSONDecoder()
+    # No newline translation, offsets must count the bytes of `\r\n` too
+    with open(path, "r", encoding="utf-8", newline="") as file:
+        buffer = file.read(chunk_size)
+        eof = not buffer
+        offset = 0
+        is_array = None
+        while True:
+            # Whitespace and separators are ASCII, so characters are bytes
+            stripped = buffer.lstrip(" \t\r\n," if is_array else " \t\r\n")
+            if is_array is None and stripped:
+                is_array = stripped[0] == "["
+                if is_array:
+                    stripped = stripped[1:]
+            offset += len(buffer) - len(stripped)
+            buffer = stripped
+            if is_array and buffer.startswith("]"):
+                return
+            if not buffer:
+                if eof:
+                    if is_array:
+                        raise InvalidEventError(
+                            f"The events file ({path}) ends before `]`."
+                        )
+                    return
+                buffer = file.read(chunk_size)
+                eof = not buffer
+                continue
+            try:
+                record, end = decoder.raw_decode(buffer)
+            except json.JSONDecodeError as error:
+                if eof:
+                    raise InvalidEventError(
+                        f"The events file ({path}) has bad format "
+                        f"at byte {offset}: {error.msg}."
+                    )
+                chunk = file.read(chunk_size)
+                eof = not chunk
+                buffer += chunk
+                continue
+            if end == len(buffer) and not eof:
+                # A number or a literal could continue in the next chunk
+                chunk = file.read(chunk_size)
+                if chunk:
+                    buffer += chunk
+                    continue
+                eof = True
+            size = len(buffer[:end].encode("utf-8"))
+            yield offset, size, record
+            offset += size
+            buffer = buffer[end:]
+
+
+def validate_event(record: object, offset: int) -> dict:
+    """Checks the record has all required fields of the expected types.
+
+    Raises:
+        InvalidEventError: The record is not a valid event.
+    """
+    if not isinstance(record, dict):
+        raise InvalidEventError(f"The event at byte {offset} is not object.")
+    for name, (types, required) in EVENT_SCHEMA.items():
+        if name not in record:
+            if required:
+                raise InvalidEventError(
+                    f"The event at byte {offset} has no `{name}` field."
+                )
+        elif not isinstance(record[name], types) or isinstance(
+            record[name], bool
+        ):
+            raise InvalidEventError(
+                f"The event at byte {offset} has wrong `{name}` type."
+            )
+    unknown = record.keys() - EVENT_SCHEMA.keys()
+    if unknown:
+        raise InvalidEventError(
+            f"The event at byte {offset} has unknown fields: "
+            f"{', '.join(sorted(unknown))}."
+        )
+    return record
+
+
+def iter_events(
+    path: str, lazy_descriptions: bool = False
+) -> Iterator[HistoricalEvent]:
+    """Streams validated events from the events file.
+
+    Args:
+        path: A path to the events file.
+        lazy_descriptions: Whether to leave descriptions in the file and read
+                           them on demand with
+                           `HistoricalEvent.get_description`.
+
+    Raises:
+        InvalidEventError: The file or one of its records is malformed.
+    """
+    for offset, size, record in iter_records(path):
+        record = validate_event(record, offset)
+        if lazy_descriptions and record.get("description"):
+            record["description"] = None
+            event = HistoricalEvent(**record)
+            event.source = (path, offset, size)
+        else:
+            event = HistoricalEvent(**record)
+        yield event
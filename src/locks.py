@@ -0,0 +1,64 @@
+"""Per-player serialized execution of updates.
+
+aiogram processes updates concurrently, so rapid-fire messages of one user
+could interleave at `await` points and, e.g., score a guess twice. Updates
+of one player are processed one by one in the order they arrive while
+updates of different players are processed in parallel.
+
+"""
+import asyncio
+from contextlib import asynccontextmanager
+from typing import Any, Awaitable, Callable, Dict, List
+
+from aiogram import BaseMiddleware
+from aiogram.types import Message
+
+
+class PlayerLocks:
+    """Locks keyed by player id which exist only while they are used.
+
+    A lock is created when the first update of a player arrives and removed
+    when the last waiting update of the player is processed, so idle players
+    don't hold any memory.
+
+    """
+
+    def __init__(self):
+        # Player id to a lock and a number of its holders and waiters
+        self._locks: Dict[int, List] = {}
+
+    def __len__(self) -> int:
+        return len(self._locks)
+
+    @asynccontextmanager
+    async def hold(self, player_id: int):
+        """Waits for the player's previous updates and holds the lock."""
+        entry = self._locks.get(player_id)
+        if entry is None:
+            entry = self._locks[player_id] = [asyncio.Lock(), 0]
+        entry[1] += 1
+        try:
+            async with entry[0]:
+                yield
+        finally:
+            entry[1] -= 1
+            if not entry[1]:
+                del self._locks[player_id]
+
+
+class PlayerLockMiddleware(BaseMiddleware):
+    """Processes messages of one user one by one."""
+
+    def __init__(self, locks: PlayerLocks):
+        self.locks = locks
+
+    async def __call__(
+        self,
+        handler: Callable[[Message, Dict[str, Any]], Awaitable[Any]],
+        event: Message,
+        data: Dict[str, Any],
+    ) -> Any:
+        if event.from_user is None:
+            return await handler(event, data)
+        async with self.locks.hold(event.from_user.id):
+            return await handler(event, data)
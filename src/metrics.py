@@ -0,0 +1,178 @@
+"""Instrumentation of the bot hot paths.
+
+Collects Prometheus metrics of handlers, database calls, Bot API calls,
+the players cache and the event selection, and serves them on a local HTTP
+server together with an on-demand sampling profiler:
+
+    `/metrics` - metrics in the Prometheus text format.
+    `/debug/profile?seconds=10` - stacks of the event loop thread sampled
+        for the given time in the collapsed format of `flamegraph.pl`.
+
+"""
+import asyncio
+import functools
+import logging
+import sys
+import threading
+import time
+from collections import Counter
+from typing import TYPE_CHECKING, Callable, Dict
+
+from prometheus_client import (
+    CONTENT_TYPE_LATEST,
+    REGISTRY,
+    Histogram,
+    generate_latest,
+)
+from prometheus_client import Counter as PrometheusCounter
+from prometheus_client.core import CounterMetricFamily, GaugeMetricFamily
+
+if TYPE_CHECKING:
+    # The server is imported only when metrics are served, so the DAOs
+    # which use `timed` don't pull in the HTTP stack
+    from aiohttp import web
+
+
+logger = logging.getLogger(__name__)
+
+HANDLER_LATENCY = Histogram(
+    "dateduel_handler_seconds", "Time of handling an update.", ["handler"]
+)
+HANDLER_ERRORS = PrometheusCounter(
+    "dateduel_handler_errors", "Failed handlers.", ["handler"]
+)
+DB_LATENCY = Histogram(
+    "dateduel_db_seconds", "Time of database calls.", ["operation"]
+)
+API_LATENCY = Histogram(
+    "dateduel_api_seconds", "Time of Bot API calls.", ["method"]
+)
+API_ERRORS = PrometheusCounter(
+    "dateduel_api_errors", "Failed Bot API calls.", ["method"]
+)
+SELECTION_LATENCY = Histogram(
+    "dateduel_event_selection_seconds",
+    "Time of picking the next event for a player.",
+    buckets=(1e-6, 5e-6, 1e-5, 5e-5, 1e-4, 5e-4, 1e-3, 1e-2, 0.1),
+)
+
+
+def timed(operation: str):
+    """Decorates a coroutine function to observe its time in `DB_LATENCY`."""
+    histogram = DB_LATENCY.labels(operation)
+
+    def decorator(function):
+        @functools.wraps(function)
+        async def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return await function(*args, **kwargs)
+            finally:
+                histogram.observe(time.perf_counter() - start)
+
+        return wrapper
+
+    return decorator
+
+
+class StatsCollector:
+    """Exports a dictionary of counters, e.g. `PlayerCache.stats`.
+
+    Properties:
+        prefix: A prefix of the metric names.
+        stats: A live dictionary mapping from counter name to its value.
+        gauges: A dictionary of gauge names to functions returning values.
+
+    """
+
+    def __init__(
+        self,
+        prefix: str,
+        stats: Dict[str, int],
+        gauges: Dict[str, Callable[[], float]] = None,
+    ):
+        self.prefix = prefix
+        self.stats = stats
+        self.gauges = gauges or {}
+
+    def collect(self):
+        for name, value in self.stats.items():
+            yield CounterMetricFamily(
+                f"{self.prefix}_{name}", f"Total {name}.", value=value
+            )
+        for name, get_value in self.gauges.items():
+            yield GaugeMetricFamily(
+                f"{self.prefix}_{name}", f"Current {name}.", value=get_value()
+            )
+
+
+def sample_stacks(
+    thread_id: int, seconds: float, interval: float = 0.005
+) -> Counter:
+    """Samples stacks of the thread.
+
+    Args:
+        thread_id: An id of the thread to sample.
+        seconds: Sampling duration.
+        interval: Seconds between samples.
+
+    Returns:
+        A counter of stacks in the collapsed format: frames from the outermost
+        separated by `;`.
+    """
+    stacks: Counter = Counter()
+    deadline = time.monotonic() + seconds
+    while time.monotonic() < deadline:
+        frame = sys._current_frames().get(thread_id)
+        frames = []
+        while frame is not None:
+            code = frame.f_code
+            location = f"{code.co_filename}:{frame.f_lineno}"
+            frames.append(f"{code.co_name} ({location})")
+            frame = frame.f_back
+        if frames:
+            stacks[";".join(reversed(frames))] += 1
+        time.sleep(interval)
+    return stacks
+
+
+async def metrics_view(request: "web.Request") -> "web.Response":
+    from aiohttp import web
+
+    response = web.Response(body=generate_latest(REGISTRY))
+    response.content_type = CONTENT_TYPE_LATEST.split(";")[0]
+    return response
+
+
+async def profile_view(request: "web.Request") -> "web.Response":
+    """Samples the event loop thread and returns the collapsed stacks."""
+    from aiohttp import web
+
+    try:
+        seconds = min(float(request.query.get("seconds", 10)), 300)
+        interval = float(request.query.get("interval", 0.005))
+    except ValueError:
+        return web.Response(status=400)
+    loop_thread = threading.get_ident()
+    stacks = await asyncio.get_running_loop().run_in_executor(
+        None, sample_stacks, loop_thread, seconds, interval
+    )
+    lines = (f"{stack} {count}" for stack, count in stacks.most_common())
+    return web.Response(text="\n".join(lines) + "\n")
+
+
+async def serve_metrics(host: str, port: int):
+    """Serves `/metrics` and `/debug/profile` until the task is cancelled."""
+    from aiohttp import web
+
+    app = web.Application()
+    app.router.add_get("/metrics", metrics_view)
+    app.router.add_get("/debug/profile", profile_view)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    logger.info("Metrics server is listening on %s:%d.", host, port)
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await runner.cleanup()
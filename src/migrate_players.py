@@ -0,0 +1,98 @@
+"""Migrates, exports and imports the `Players` collection.
+
+Documents are streamed in batches, see `player_migrations`, so the commands
+handle millions of players with bounded memory. An interrupted command
+continues from its state file with `--resume`. Stop the bot before running
+the commands.
+
+Usage:
+
+    python src/migrate_players.py migrate [--dry-run]
+    python src/migrate_players.py export players.jsonl.gz
+    python src/migrate_players.py import players.jsonl.gz
+        [--resume] [--state PATH] [--batch-size 1000] [--workers 4]
+
+"""
+import argparse
+import asyncio
+import time
+
+from database import get_async_database
+from player_migrations import export_players, import_players, migrate_players
+
+# The counter of processed documents of every command
+PROCESSED = {"migrate": "read", "export": "exported", "import": "imported"}
+
+
+async def run(args) -> dict:
+    database = get_async_database()
+    path = args.path or "players"
+    state_path = args.state or f"{path}.{args.command}.state"
+    if args.command == "migrate":
+        return await migrate_players(
+            database,
+            state_path,
+            resume=args.resume,
+            batch_size=args.batch_size,
+            workers=args.workers,
+            dry_run=args.dry_run,
+        )
+    if args.command == "export":
+        return await export_players(
+            database,
+            args.path,
+            state_path,
+            resume=args.resume,
+            batch_size=args.batch_size,
+        )
+    return await import_players(
+        database,
+        args.path,
+        state_path,
+        resume=args.resume,
+        batch_size=args.batch_size,
+        workers=args.workers,
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("command", choices=("migrate", "export", "import"))
+    parser.add_argument(
+        "path", nargs="?", help="the backup file for export and import"
+    )
+    parser.add_argument(
+        "--resume",
+        action="store_true",
+        help="continue the interrupted command from its state file",
+    )
+    parser.add_argument(
+        "--state",
+        help="the state file, `<path>.<command>.state` by default",
+    )
+    parser.add_argument("--batch-size", type=int, default=1000)
+    parser.add_argument(
+        "--workers", type=int, default=4, help="bulk writes at the same time"
+    )
+    parser.add_argument(
+        "--dry-run",
+        action="store_true",
+        help="only count the players to migrate",
+    )
+    args = parser.parse_args()
+    if args.command != "migrate" and not args.path:
+        parser.error(f"{args.command} needs the path of the backup file")
+
+    start = time.perf_counter()
+    stats = asyncio.run(run(args))
+    elapsed = time.perf_counter() - start
+    documents = stats[PROCESSED[args.command]]
+    counters = ", ".join(f"{name} {count}" for name, count in stats.items())
+    print(
+        f"{args.command.capitalize()}: {counters} in {elapsed:.1f}s "
+        f"({documents / max(elapsed, 1e-9):.0f} documents/s)."
+    )
+
+
+if __name__ == "__main__":
+    main()
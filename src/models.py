@@ -1,13 +1,28 @@
-"""Module for classes `Player` and `HistoricalEvent`."""
+"""Module for classes `Player`, `PlayerChanges`, `HistoricalEvent`,
+`GuessRecord`, `EventStats` and `Broadcast`."""
 
+import functools
+import json
 import os
+import sys
 
 from dataclasses import dataclass, field
-from typing import List, Optional
-
-from aiogram.types import FSInputFile
+from stat import S_ISREG
+from typing import TYPE_CHECKING, Any, Callable, List, Optional, Tuple
 
+import config
+from bitset import EventBitset
 from config import BASE_PATH
+from image_pipeline import get_optimized_path
+
+if TYPE_CHECKING:
+    # Importing `aiogram.types` takes most of the import time, the models
+    # are used by tools which don't talk to Telegram
+    from aiogram.types import FSInputFile
+
+# Version of the player documents written by the bot, bump it with a new
+# migration in `player_migrations.MIGRATIONS`
+PLAYER_SCHEMA_VERSION = 2
 
 
 @dataclass
@@ -18,35 +33,207 @@ class Player:
         _id: Player's unique identifier.
         current_event: Id of current event in the game. If None player is not
                        in the game.
-        guessed_events: List of events ids which player already guessed.
+        guessed_events: Set of events ids which player already guessed.
+                        Accepts the legacy list of ids or the bitset bytes
+                        stored in the database and converts it to
+                        `EventBitset`.
         attempts: Number of attempts player made to guess current event.
         score: Total score of player.
         in_game: Indicates if player is in the game.
+        event_cursor: Position of the current event in the events order of
+                      `selection.EventSelector`; not stored in the database.
 
     """
 
     _id: int
     current_event: Optional[int] = None
-    guessed_events: List[int] = field(default_factory=list)
+    guessed_events: EventBitset = field(default_factory=EventBitset)
     attempts: int = 0
     score: int = 0
+    event_cursor: Optional[int] = field(default=None, compare=False)
+
+    def __post_init__(self):
+        # Format of guessed events in the database: `list` or `bitset`
+        self.guessed_events_format = (
+            "bitset"
+            if isinstance(self.guessed_events, (bytes, bytearray))
+            else "list"
+        )
+        self.guessed_events = EventBitset.coerce(self.guessed_events)
+        # Whether the last save failed without knowing if it was applied,
+        # then the next save writes all fields instead of the changes
+        self.saved_state_unknown = False
+        # The state last saved to the database, see `get_changes`
+        self._saved_current_event = self.current_event
+        self._saved_attempts = self.attempts
+        self._saved_score = self.score
+        self._new_guessed_events = []
+        self._resets = self._saved_resets = 0
+        # Guessed events changes not written to the journal yet
+        self._recent_guessed_events = []
+        self._recent_reset = False
 
     @property
     def in_game(self) -> bool:
         return isinstance(self.current_event, int)
 
+    def has_guessed(self, event_id: int) -> bool:
+        """Checks whether the player has guessed the event."""
+        return event_id in self.guessed_events
 
-@dataclass
+    def add_guessed_event(self, event_id: int):
+        """Adds the event to the player's guessed events."""
+        if event_id not in self.guessed_events:
+            self.guessed_events.add(event_id)
+            self._new_guessed_events.append(event_id)
+            self._recent_guessed_events.append(event_id)
+
+    def reset_guessed_events(self):
+        """Clears the player's guessed events to start over."""
+        self.guessed_events = EventBitset()
+        self._new_guessed_events = []
+        self._resets += 1
+        self._recent_guessed_events = []
+        self._recent_reset = True
+
+    def pop_recent_guessed_events(self) -> Tuple[bool, List[int]]:
+        """Returns whether guessed events were reset and ids of events
+        guessed since the previous call, see `journal.PlayerJournal`."""
+        recent = self._recent_reset, self._recent_guessed_events
+        self._recent_guessed_events = []
+        self._recent_reset = False
+        return recent
+
+    def get_changes(self) -> "PlayerChanges":
+        """Returns changes of the player since it was last saved."""
+        return PlayerChanges(
+            current_event=self.current_event,
+            current_event_changed=(
+                self.current_event != self._saved_current_event
+            ),
+            attempts=self.attempts - self._saved_attempts,
+            score=self.score - self._saved_score,
+            new_guessed_events=tuple(self._new_guessed_events),
+            guessed_events_reset=self._resets != self._saved_resets,
+            resets=self._resets,
+        )
+
+    def mark_saved(self, changes: "PlayerChanges"):
+        """Marks the changes returned by `get_changes` as saved.
+
+        The player could be changed after `get_changes` while the changes
+        were being saved, such changes are kept for the next save.
+        """
+        self._saved_current_event = changes.current_event
+        self._saved_attempts += changes.attempts
+        self._saved_score += changes.score
+        if changes.resets == self._resets:
+            del self._new_guessed_events[: len(changes.new_guessed_events)]
+            self._saved_resets = changes.resets
+        # Changes are journaled as soon as they are made, so they don't have
+        # to be tracked after the save without the journal
+        self._recent_guessed_events = []
+        self._recent_reset = False
+
+
+@dataclass(frozen=True)
+class PlayerChanges:
+    """Changes of a player since it was last saved to the database.
+
+    Properties:
+        current_event: Id of current event in the game.
+        current_event_changed: Whether the current event was changed.
+        attempts: Number of attempts made since the last save.
+        score: Score gained since the last save.
+        new_guessed_events: Ids of events guessed since the last save.
+        guessed_events_reset: Whether guessed events were reset, then all
+                              guessed events have to be saved.
+        resets: Number of resets of guessed events of the player.
+        empty: Indicates if there are no changes.
+
+    """
+
+    current_event: Optional[int]
+    current_event_changed: bool
+    attempts: int
+    score: int
+    new_guessed_events: Tuple[int, ...]
+    guessed_events_reset: bool
+    resets: int
+
+    @property
+    def empty(self) -> bool:
+        return not (
+            self.current_event_changed
+            or self.attempts
+            or self.score
+            or self.new_guessed_events
+            or self.guessed_events_reset
+        )
+
+
+def _details_cache(function: Callable) -> Callable:
+    """Wraps the function with an LRU cache of `EVENTS_DETAILS_CACHE_SIZE`
+    entries created on the first call, so importing the models doesn't
+    read the settings."""
+    cached = None
+
+    @functools.wraps(function)
+    def wrapper(*args):
+        nonlocal cached
+        if cached is None:
+            cached = functools.lru_cache(config.EVENTS_DETAILS_CACHE_SIZE)(
+                function
+            )
+        return cached(*args)
+
+    wrapper.cache_clear = lambda: cached and cached.cache_clear()
+    return wrapper
+
+
+@_details_cache
+def _resolve_image(image_path: str) -> Optional[Tuple[str, str]]:
+    path = os.path.join(BASE_PATH, image_path)
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    if not S_ISREG(stat.st_mode):
+        return None
+    optimized = get_optimized_path(image_path)
+    if optimized:
+        # Optimized files are named by the hash of their content
+        return optimized, os.path.basename(optimized)
+    return path, f"{image_path}:{stat.st_size}:{stat.st_mtime_ns}"
+
+
+@_details_cache
+def _read_description(source: Tuple[str, int, int]) -> Optional[str]:
+    path, offset, size = source
+    with open(path, "rb") as file:
+        file.seek(offset)
+        return json.loads(file.read(size)).get("description")
+
+
+@dataclass(slots=True)
 class HistoricalEvent:
     """Class representing a historical event object.
 
+    Events are slotted records which keep in memory only the fields needed
+    to ask about the event. The description left in the events file and
+    the image file path are looked up on reveal and kept in small LRU
+    caches, see `EVENTS_DETAILS_CACHE_SIZE`.
+
     Properties:
         _id: Unique identifier for historical event.
         _type: Type of event.
         event: Short event description to guess.
         date: Event date in integer format.
-        description: Additional information about the event.
+        description: Additional information about the event or `None` if
+                     it's left in the events file.
         image_path: Path to the event image.
+        source: A path to the events file, an offset and a size in bytes of
+                the event record if the description is left in the file.
 
     """
 
@@ -56,13 +243,159 @@ class HistoricalEvent:
     date: int
     description: Optional[str] = None
     image_path: Optional[str] = None
+    source: Optional[Tuple[str, int, int]] = field(
+        default=None, init=False, repr=False, compare=False
+    )
 
-    def get_image_file(self) -> Optional[FSInputFile]:
-        """Returns the event image file or `None` if file does not exist."""
+    def __post_init__(self):
+        # Only a few types are shared by all events
+        self._type = sys.intern(self._type)
+
+    @property
+    def image_file_path(self) -> Optional[str]:
+        """Absolute path to the event image or `None` if the file does not
+        exist. The optimized image is preferred, see `image_pipeline`."""
         if self.image_path:
-            path = os.path.join(BASE_PATH, self.image_path)
-            return FSInputFile(path) if os.path.isfile(path) else None
+            resolved = _resolve_image(self.image_path)
+            return resolved and resolved[0]
+
+    @property
+    def image_key(self) -> Optional[str]:
+        """Identifies the content of `image_file_path`: the name of the
+        optimized file or the source path with its size and modification
+        time, so a changed or re-optimized image gets a new key."""
+        if self.image_path:
+            resolved = _resolve_image(self.image_path)
+            return resolved and resolved[1]
+
+    def get_image_file(self) -> Optional["FSInputFile"]:
+        """Returns the event image file or `None` if file does not exist."""
+        image_file_path = self.image_file_path
+        if image_file_path:
+            from aiogram.types import FSInputFile
+
+            return FSInputFile(image_file_path)
+
+    def get_description(self) -> Optional[str]:
+        """Returns the description reading it from the events file if it
+        was left there on loading."""
+        if self.source is None:
+            return self.description
+        return _read_description(self.source)
 
     def explain(self) -> str:
         """Returns explanation for event with date and short description."""
         return "{} г. - {}.".format(self.date, self.event)
+
+
+# Actions of players in rounds recorded by `telemetry.Telemetry`
+GUESS_ACTIONS = ("guess", "surrender", "cancel")
+
+
+@dataclass(slots=True)
+class GuessRecord:
+    """Class representing an action of a player in a round.
+
+    Properties:
+        player_id: Id of the player.
+        event_id: Id of the guessed event.
+        action: One of `GUESS_ACTIONS`.
+        date: The guessed year for a guess.
+        error: Years between the guessed year and the event date.
+        created_at: Unix time of the action.
+
+    """
+
+    player_id: int
+    event_id: int
+    action: str
+    date: Optional[int]
+    error: Optional[int]
+    created_at: float
+
+
+@dataclass(slots=True)
+class EventStats:
+    """Class representing aggregates of the guesses of an event.
+
+    Properties:
+        rounds: Number of ended rounds - solved, surrendered or cancelled.
+        solved: Number of rounds ended with a right guess.
+        guesses: Number of guesses.
+        error_sum: Sum of errors of the guesses in years.
+
+    """
+
+    rounds: int = 0
+    solved: int = 0
+    guesses: int = 0
+    error_sum: int = 0
+
+    def add(self, action: str, error: Optional[int] = None):
+        """Adds an action of a player to the aggregates."""
+        if action == "guess":
+            self.guesses += 1
+            self.error_sum += error
+            if error:
+                return
+            self.solved += 1
+        self.rounds += 1
+
+    def merge(self, other: "EventStats"):
+        """Adds the aggregates of the other stats."""
+        self.rounds += other.rounds
+        self.solved += other.solved
+        self.guesses += other.guesses
+        self.error_sum += other.error_sum
+
+    @property
+    def solve_rate(self) -> Optional[float]:
+        return self.solved / self.rounds if self.rounds else None
+
+    @property
+    def mean_attempts(self) -> Optional[float]:
+        return self.guesses / self.rounds if self.rounds else None
+
+    @property
+    def mean_error(self) -> Optional[float]:
+        return self.error_sum / self.guesses if self.guesses else None
+
+    @property
+    def difficulty(self) -> float:
+        """Share of rounds which were not solved from 0 to 1.
+
+        The share is smoothed towards 0.5, so a couple of rounds of a new
+        event don't put it at either end of the order.
+        """
+        return (self.rounds - self.solved + 1) / (self.rounds + 2)
+
+
+# States of a broadcast, see `broadcast.Broadcaster`
+BROADCAST_STATUSES = ("running", "finished", "stopped")
+
+
+@dataclass(slots=True)
+class Broadcast:
+    """Class representing a message sent to all players.
+
+    Properties:
+        _id: Broadcast's unique identifier.
+        text: The text of the message.
+        status: One of `BROADCAST_STATUSES`.
+        last_id: Id of the player up to which all players were handled,
+                 the broadcast resumes after it. None if nobody was.
+        sent: Number of players who got the message.
+        blocked: Number of players who blocked the bot during the broadcast.
+        skipped: Number of players skipped as they blocked the bot before.
+        failed: Number of players the message failed to send to.
+
+    """
+
+    _id: Any
+    text: str
+    status: str = "running"
+    last_id: Optional[int] = None
+    sent: int = 0
+    blocked: int = 0
+    skipped: int = 0
+    failed: int = 0
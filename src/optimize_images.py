@@ -0,0 +1,63 @@
+"""Optimizes event images for Telegram and reports bytes saved per image.
+
+Only images added or changed since the last run are processed, see
+`image_pipeline`. The bot sends the optimized images instead of the ones
+in `res/images/` once they are built, e.g. in the Docker image build.
+
+Usage:
+
+    python src/optimize_images.py [directory] [--jobs N] [--force]
+
+"""
+import argparse
+import os
+
+from config import (
+    IMAGES_CACHE_PATH,
+    IMAGES_MAX_SIZE,
+    IMAGES_QUALITY,
+    RESOURCES_PATH,
+)
+from image_pipeline import find_images, optimize_images
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        "directory", nargs="?", default=os.path.join(RESOURCES_PATH, "images")
+    )
+    parser.add_argument(
+        "--jobs", type=int, help="number of processes, all CPUs by default"
+    )
+    parser.add_argument(
+        "--force",
+        action="store_true",
+        help="hash all images even if they didn't change",
+    )
+    args = parser.parse_args()
+
+    images = optimize_images(
+        find_images(args.directory),
+        IMAGES_CACHE_PATH,
+        max_size=IMAGES_MAX_SIZE,
+        quality=IMAGES_QUALITY,
+        jobs=args.jobs,
+        force=args.force,
+    )
+    print(f"{'image':<32} {'bytes':>9} {'optimized':>9} {'saved':>6}  status")
+    for image in images:
+        print(
+            f"{image.path:<32} {image.size:>9} {image.optimized_size:>9} "
+            f"{image.saved / image.size:>6.0%}  {image.status}"
+        )
+    size = sum(image.size for image in images)
+    saved = sum(image.saved for image in images)
+    processed = sum(image.status == "optimized" for image in images)
+    print(
+        f"Saved {saved} of {size} bytes ({saved / max(size, 1):.0%}), "
+        f"processed {processed} of {len(images)} images."
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,174 @@
+"""Pacing of outgoing Bot API calls within the Telegram flood limits.
+
+Telegram allows about thirty messages per second overall and about one
+message per second in a chat (twenty per minute in a group), and answers
+calls over the limits with `429 Too Many Requests` and a `retry_after`
+delay. `OutboundLimiter` is a request middleware of the bot session which
+queues every call sending to a chat until the global token bucket allows
+it and retries calls rejected by the flood control after the given delay.
+
+Calls to group chats also wait for the bucket of the chat, as a round of
+a group may answer many members at once. A private chat gets one reply to
+every message of the player, so its replies are not delayed by a chat
+bucket until Telegram rejects one, then calls to the chat wait for
+the delay too, so one flood error doesn't turn into a storm of them.
+
+"""
+import asyncio
+import logging
+import time
+from collections import OrderedDict
+from typing import Dict, Hashable, Optional
+
+from aiogram.client.session.middlewares.base import (
+    BaseRequestMiddleware,
+    NextRequestMiddlewareType,
+)
+from aiogram.exceptions import TelegramRetryAfter
+from aiogram.methods import TelegramMethod
+
+
+logger = logging.getLogger(__name__)
+
+
+def is_group(chat_id: Hashable) -> bool:
+    """Checks whether the chat id is of a group or a channel, their ids are
+    negative and channels may be given by the `@username`."""
+    return not isinstance(chat_id, int) or chat_id < 0
+
+
+class TokenBucket:
+    """Token bucket handing out tokens in the order they are requested.
+
+    A token is reserved as soon as it is requested, so the number of tokens
+    goes below zero while there are waiters and every next waiter sleeps
+    a bit longer than the previous one.
+
+    Properties:
+        rate: Tokens added per second.
+        burst: The maximum number of tokens.
+        tokens: Tokens available at the time of the last update.
+        updated_at: The time of the last update.
+
+    """
+
+    rate: float
+    burst: float
+    tokens: float
+    updated_at: float
+
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated_at = time.monotonic()
+
+    def _refill(self, now: float):
+        elapsed = now - self.updated_at
+        self.tokens = min(self.burst, self.tokens + elapsed * self.rate)
+        self.updated_at = now
+
+    def reserve(self) -> float:
+        """Takes a token and returns seconds to wait before using it."""
+        self._refill(time.monotonic())
+        self.tokens -= 1
+        return max(0.0, -self.tokens / self.rate)
+
+    def pause(self, seconds: float):
+        """Hands out no tokens for the given time."""
+        self._refill(time.monotonic())
+        self.tokens = min(self.tokens, -seconds * self.rate)
+
+
+class OutboundLimiter(BaseRequestMiddleware):
+    """Paces Bot API calls sending to chats and retries flood errors.
+
+    Must be registered before other request middlewares, so they don't
+    count the time spent in the queue.
+
+    Properties:
+        global_bucket: A bucket of calls to all chats.
+        chat_rate: Calls per second to one group chat.
+        chat_burst: Calls to one group chat allowed at once after a pause.
+        max_retries: How many times a call is retried after flood errors.
+        chats: A dictionary mapping from chat id to its bucket, from
+               the least recently used one.
+        max_chats: A number of chat buckets kept, the least recently used
+                   one is dropped for a new one.
+        stats: Counters of delayed calls and flood errors.
+
+    """
+
+    global_bucket: TokenBucket
+    chat_rate: float
+    chat_burst: float
+    max_retries: int
+    chats: "OrderedDict[Hashable, TokenBucket]"
+    max_chats: int
+    stats: Dict[str, int]
+
+    def __init__(
+        self,
+        global_rate: float = 30,
+        chat_rate: float = 1,
+        chat_burst: float = 3,
+        max_retries: int = 3,
+        max_chats: int = 10000,
+    ):
+        self.global_bucket = TokenBucket(global_rate, global_rate)
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.max_retries = max_retries
+        self.chats = OrderedDict()
+        self.max_chats = max_chats
+        self.stats = {"delayed": 0, "retried": 0, "flood_errors": 0}
+
+    def _get_chat_bucket(
+        self, chat_id: Hashable, create: bool = True
+    ) -> Optional[TokenBucket]:
+        bucket = self.chats.get(chat_id)
+        if bucket is not None:
+            self.chats.move_to_end(chat_id)
+        elif create:
+            if len(self.chats) >= self.max_chats:
+                self.chats.popitem(last=False)
+            bucket = self.chats[chat_id] = TokenBucket(
+                self.chat_rate, self.chat_burst
+            )
+        return bucket
+
+    async def wait(self, chat_id: Hashable):
+        """Waits until a call to the chat is allowed."""
+        delay = self.global_bucket.reserve()
+        # Private chats have a bucket only after a flood error
+        bucket = self._get_chat_bucket(chat_id, create=is_group(chat_id))
+        if bucket is not None:
+            delay = max(delay, bucket.reserve())
+        if delay > 0:
+            self.stats["delayed"] += 1
+            await asyncio.sleep(delay)
+
+    async def __call__(
+        self,
+        make_request: NextRequestMiddlewareType,
+        bot,
+        method: TelegramMethod,
+    ):
+        chat_id = getattr(method, "chat_id", None)
+        if chat_id is None:
+            return await make_request(bot, method)
+        for attempt in range(self.max_retries + 1):
+            await self.wait(chat_id)
+            try:
+                return await make_request(bot, method)
+            except TelegramRetryAfter as error:
+                self.stats["flood_errors"] += 1
+                if attempt == self.max_retries:
+                    raise
+                logger.warning(
+                    "Flood control in chat %s, retry in %d seconds.",
+                    chat_id,
+                    error.retry_after,
+                )
+                self.stats["retried"] += 1
+                self._get_chat_bucket(chat_id).pause(error.retry_after)
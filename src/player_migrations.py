@@ -0,0 +1,393 @@
+"""Schema migrations, export and import of the `Players` collection.
+
+Every player document has a `schema_version` (documents written before
+versioning have none, which is version 0). `MIGRATIONS[n]` turns a document
+of version `n` into version `n + 1`, so changing the shape of `Player` is
+a new migration and a bump of `models.PLAYER_SCHEMA_VERSION`. The bot reads
+documents of any version, see `dao.document_to_player`.
+
+All commands stream the collection or the backup file: documents are read
+with a cursor sorted by `_id` in batches and written back with unordered
+bulk writes, at most `workers` of them at the same time, so memory depends
+on the batch size and not on the number of players. Progress is saved to
+a state file after every batch written, an interrupted command continues
+from it with `resume`:
+
+    `migrate_players` - applies pending migrations in place, a document is
+        updated only if it still has the version it was read with;
+    `export_players` - writes all documents to a JSON Lines file compressed
+        with gzip (every batch is a gzip member, so a resumed export cuts
+        the file to the last saved batch and appends to it);
+    `import_players` - replaces players with the documents of the file,
+        migrating the ones of older versions.
+
+Migrated and imported documents replace fields changed by the bot meanwhile,
+so run the commands with the bot stopped.
+
+"""
+import asyncio
+import functools
+import gzip
+import json
+import os
+from collections import deque
+from typing import Any, Callable, Deque, Dict, List, Optional, Tuple
+
+from bson import json_util
+from pymongo import ASCENDING, ReplaceOne, UpdateOne
+
+from bitset import EventBitset
+from dao import AsyncPlayerDao, encode_guessed_events
+from models import PLAYER_SCHEMA_VERSION
+
+Migration = Callable[[dict], None]
+
+
+def _fill_defaults(document: dict):
+    """Adds fields missing in documents of early versions."""
+    document.setdefault("current_event", None)
+    document.setdefault("guessed_events", [])
+    document.setdefault("attempts", 0)
+    document.setdefault("score", 0)
+
+
+def _encode_guessed_events(document: dict):
+    """Stores guessed events in the `GUESSED_EVENTS_ENCODING` format."""
+    document["guessed_events"] = encode_guessed_events(
+        EventBitset.coerce(document["guessed_events"])
+    )
+
+
+MIGRATIONS: List[Migration] = [_fill_defaults, _encode_guessed_events]
+assert len(MIGRATIONS) == PLAYER_SCHEMA_VERSION
+
+
+def migrate_document(document: dict) -> bool:
+    """Applies pending migrations to the document in place.
+
+    Returns:
+        Whether the document was migrated.
+    """
+    version = document.get("schema_version", 0)
+    if version >= PLAYER_SCHEMA_VERSION:
+        return False
+    for migration in MIGRATIONS[version:]:
+        migration(document)
+    document["schema_version"] = PLAYER_SCHEMA_VERSION
+    return True
+
+
+def _get_update(old: dict, new: dict) -> dict:
+    """Returns the update turning the old document into the new one."""
+    update = {}
+    fields = {k: v for k, v in new.items() if k not in old or old[k] != v}
+    removed = {k: "" for k in old if k not in new}
+    if fields:
+        update["$set"] = fields
+    if removed:
+        update["$unset"] = removed
+    return update
+
+
+# Only values which are not JSON (bitsets, dates) go through `json_util`,
+# converting whole documents with it is several times slower
+_to_extended_json = functools.partial(
+    json_util.default, json_options=json_util.RELAXED_JSON_OPTIONS
+)
+
+
+def read_state(path: str) -> Optional[dict]:
+    """Returns the saved progress of a command or `None`."""
+    try:
+        with open(path) as file:
+            return json.load(file)
+    except FileNotFoundError:
+        return None
+
+
+def write_state(path: str, state: dict):
+    """Replaces the saved progress atomically."""
+    with open(f"{path}.tmp", "w") as file:
+        json.dump(state, file)
+    os.replace(f"{path}.tmp", path)
+
+
+class BulkWriter:
+    """Runs unordered bulk writes of consecutive batches in parallel.
+
+    Batches finish in any order, `position` is the position of the last
+    batch such that it and all batches before it are written, so it's safe
+    to resume after it.
+
+    Properties:
+        collection: The collection to write to.
+        position: The position passed with the last written batch.
+        written: A number of written requests.
+        modified: A number of documents changed by the written requests,
+                  requests whose filter didn't match are not counted.
+
+    """
+
+    collection: Any
+    position: Any
+    written: int
+    modified: int
+
+    def __init__(self, collection, workers: int, position: Any = None):
+        self.collection = collection
+        self.position = position
+        self.written = 0
+        self.modified = 0
+        self._semaphore = asyncio.Semaphore(workers)
+        # Batches in the order of positions as `(position, task, size)`,
+        # the task is None for an empty batch
+        self._pending: Deque[Tuple[Any, Optional[asyncio.Task], int]] = deque()
+
+    async def _write(self, requests: list):
+        try:
+            return await self.collection.bulk_write(requests, ordered=False)
+        finally:
+            self._semaphore.release()
+
+    async def submit(self, requests: list, position: Any) -> bool:
+        """Starts writing the batch as soon as a worker is free.
+
+        Returns:
+            Whether `position` moved.
+        """
+        await self._semaphore.acquire()
+        if requests:
+            task = asyncio.create_task(self._write(requests))
+        else:
+            self._semaphore.release()
+            task = None
+        self._pending.append((position, task, len(requests)))
+        return self._advance()
+
+    def _advance(self) -> bool:
+        moved = False
+        while self._pending:
+            position, task, size = self._pending[0]
+            if task is not None:
+                if not task.done():
+                    break
+                # Raises the error of the batch, the position stays before it
+                self.modified += task.result().modified_count
+            self._pending.popleft()
+            self.position = position
+            self.written += size
+            moved = True
+        return moved
+
+    async def drain(self):
+        """Waits for all batches, raises the first error."""
+        tasks = [task for _, task, _ in self._pending if task is not None]
+        if tasks:
+            await asyncio.wait(tasks)
+        self._advance()
+
+    def cancel(self):
+        """Cancels batches being written, e.g. after an error."""
+        for _, task, _ in self._pending:
+            if task is not None:
+                task.cancel()
+
+
+def _players(database):
+    return database[AsyncPlayerDao.collection_name]
+
+
+def _load_state(state_path: str, resume: bool, command: str) -> dict:
+    state = read_state(state_path) if resume else None
+    if state is not None and state.get("command") != command:
+        raise ValueError(
+            f"{state_path} is the state of `{state.get('command')}`."
+        )
+    return state or {"command": command}
+
+
+async def migrate_players(
+    database,
+    state_path: str,
+    resume: bool = False,
+    batch_size: int = 1000,
+    workers: int = 4,
+    dry_run: bool = False,
+) -> Dict[str, int]:
+    """Applies pending migrations to all players.
+
+    Args:
+        database: The database with the `Players` collection.
+        state_path: A path to the file with the progress.
+        resume: Whether to continue after the player the previous run
+                stopped at.
+        batch_size: A number of documents read and written at once.
+        workers: A number of bulk writes at the same time.
+        dry_run: Whether to only count the documents to migrate.
+
+    Returns:
+        Counters of read and migrated documents.
+    """
+    collection = _players(database)
+    state = _load_state(state_path, resume, "migrate")
+    stats = {"read": 0, "migrated": 0}
+    query = {"schema_version": {"$ne": PLAYER_SCHEMA_VERSION}}
+    if state.get("last_id") is not None:
+        query["_id"] = {"$gt": state["last_id"]}
+    writer = BulkWriter(collection, workers, state.get("last_id"))
+    requests = []
+    last_id = None
+
+    async def submit():
+        if dry_run:
+            stats["migrated"] += len(requests)
+        elif await writer.submit(requests, last_id):
+            state["last_id"] = writer.position
+            write_state(state_path, state)
+
+    cursor = collection.find(query).sort("_id", ASCENDING)
+    try:
+        async for document in cursor.batch_size(batch_size):
+            stats["read"] += 1
+            last_id = document["_id"]
+            old = dict(document)
+            if migrate_document(document):
+                version = old.get("schema_version")
+                requests.append(
+                    UpdateOne(
+                        {
+                            "_id": last_id,
+                            # Skip the document if it was migrated meanwhile
+                            "schema_version": (
+                                {"$exists": False}
+                                if version is None
+                                else version
+                            ),
+                        },
+                        _get_update(old, document),
+                    )
+                )
+            if stats["read"] % batch_size == 0:
+                await submit()
+                requests = []
+        if stats["read"] % batch_size:
+            await submit()
+        await writer.drain()
+    finally:
+        writer.cancel()
+    if not dry_run:
+        # Documents migrated by another run meanwhile are not counted
+        stats["migrated"] = writer.modified
+        if os.path.exists(state_path):
+            os.remove(state_path)
+    return stats
+
+
+async def export_players(
+    database,
+    path: str,
+    state_path: str,
+    resume: bool = False,
+    batch_size: int = 1000,
+) -> Dict[str, int]:
+    """Writes all players to a gzip compressed JSON Lines file.
+
+    Documents are serialized as MongoDB Extended JSON, so bitsets of
+    guessed events are kept.
+
+    Returns:
+        Counters of exported documents and written bytes.
+    """
+    collection = _players(database)
+    state = _load_state(state_path, resume, "export")
+    query = {}
+    if state.get("last_id") is not None:
+        query["_id"] = {"$gt": state["last_id"]}
+    stats = {"exported": state.get("exported", 0), "bytes": 0}
+    loop = asyncio.get_running_loop()
+    with open(path, "r+b" if "size" in state else "wb") as file:
+        if "size" in state:
+            # Drop the batches written after the last saved state
+            file.truncate(state["size"])
+            file.seek(state["size"])
+        lines: List[str] = []
+        last_id = None
+
+        async def write():
+            data = "".join(lines).encode()
+            # zlib releases the GIL, so compression doesn't stop the cursor
+            member = await loop.run_in_executor(None, gzip.compress, data)
+            file.write(member)
+            file.flush()
+            os.fsync(file.fileno())
+            stats["exported"] += len(lines)
+            state.update(
+                last_id=last_id, size=file.tell(), exported=stats["exported"]
+            )
+            write_state(state_path, state)
+
+        cursor = collection.find(query).sort("_id", ASCENDING)
+        async for document in cursor.batch_size(batch_size):
+            line = json.dumps(document, default=_to_extended_json)
+            lines.append(f"{line}\n")
+            last_id = document["_id"]
+            if len(lines) == batch_size:
+                await write()
+                lines = []
+        if lines:
+            await write()
+        stats["bytes"] = file.tell()
+    if os.path.exists(state_path):
+        os.remove(state_path)
+    return stats
+
+
+async def import_players(
+    database,
+    path: str,
+    state_path: str,
+    resume: bool = False,
+    batch_size: int = 1000,
+    workers: int = 4,
+) -> Dict[str, int]:
+    """Replaces players with the documents of an exported file, documents
+    of older versions are migrated.
+
+    Returns:
+        Counters of imported and migrated documents.
+    """
+    collection = _players(database)
+    state = _load_state(state_path, resume, "import")
+    skip = state.get("line", 0)
+    writer = BulkWriter(collection, workers, skip)
+    stats = {"imported": 0, "migrated": 0}
+    requests = []
+    line_number = skip
+
+    async def submit():
+        if await writer.submit(requests, line_number):
+            state["line"] = writer.position
+            write_state(state_path, state)
+
+    try:
+        with gzip.open(path, "rt") as file:
+            for line_number, line in enumerate(file, 1):
+                if line_number <= skip:
+                    continue
+                document = json_util.loads(line)
+                if migrate_document(document):
+                    stats["migrated"] += 1
+                requests.append(
+                    ReplaceOne({"_id": document["_id"]}, document, upsert=True)
+                )
+                if len(requests) == batch_size:
+                    await submit()
+                    requests = []
+        await submit()
+        await writer.drain()
+    finally:
+        writer.cancel()
+    stats["imported"] = writer.written
+    if os.path.exists(state_path):
+        os.remove(state_path)
+    return stats
@@ -0,0 +1,166 @@
+"""Selection of the next historical event for a player.
+
+Events are arranged in one shared order. Every player walks the order with
+a cursor which is moved only over already guessed events, so over a full
+pass through the catalog each event is checked once per player and picking
+the next event costs O(1) amortized regardless of the catalog size.
+
+Supported orders:
+
+    `sequential` - events in the order of their ids.
+    `random` - events in a shuffled order, each player starts from its own
+               position in the order.
+    `type` - events grouped by their type.
+    `difficulty` - events from the easiest to the hardest by the guesses of
+                   all players, see `telemetry.EventStats.difficulty`. The
+                   order is rebuilt periodically with `reorder`.
+
+"""
+import random
+from typing import TYPE_CHECKING, Dict, List, Optional
+
+if TYPE_CHECKING:
+    from models import Player
+
+
+ORDERS = ("sequential", "random", "type", "difficulty")
+
+
+class EventSelector:
+    """Picks not guessed events for players.
+
+    Properties:
+        order: A list of event ids in the order they are given to players.
+        order_name: A name of the order, one of `ORDERS`.
+
+    """
+
+    order: List[int]
+    order_name: str
+
+    def __init__(
+        self,
+        event_types: Dict[int, str],
+        order_name: str = "sequential",
+        seed: Optional[int] = None,
+        difficulty: Optional[Dict[int, float]] = None,
+    ):
+        """Builds the events order.
+
+        Args:
+            event_types: A dictionary mapping from event id to the event type.
+            order_name: A name of the order, one of `ORDERS`.
+            seed: A seed for the `random` order.
+            difficulty: A dictionary mapping from event id to its difficulty
+                        for the `difficulty` order, events without it are
+                        of medium difficulty.
+
+        Raises:
+            ValueError: If the order is unknown or there are no events.
+        """
+        if order_name not in ORDERS:
+            raise ValueError(
+                f"Unknown events order {order_name!r}, use one of {ORDERS}."
+            )
+        if not event_types:
+            raise ValueError("Can't select events without events.")
+
+        self.order_name = order_name
+        if order_name == "type":
+            self.order = sorted(event_types, key=lambda i: (event_types[i], i))
+        else:
+            self.order = sorted(event_types)
+        if order_name == "random":
+            random.Random(seed).shuffle(self.order)
+        self._ids = set(self.order)
+        if order_name == "difficulty":
+            self.reorder(difficulty or {})
+
+    def __len__(self) -> int:
+        return len(self.order)
+
+    def __contains__(self, event_id: int) -> bool:
+        return event_id in self._ids
+
+    def _start_position(self, player: "Player") -> int:
+        """Returns the position in the order where the player starts."""
+        if self.order_name == "random":
+            # Multiplicative hashing spreads neighbour ids across the order
+            return (player._id * 2654435761) % len(self.order)
+        return 0
+
+    def reorder(self, difficulty: Dict[int, float]):
+        """Sorts events of the `difficulty` order from the easiest one.
+
+        Takes O(n log n). Cursors of players keep their positions, so
+        a player may skip some events until the next pass through the order.
+        """
+        if self.order_name == "difficulty":
+            self.order.sort(key=lambda i: (difficulty.get(i, 0.5), i))
+
+    def add(self, event_id: int):
+        """Appends a new event to the end of the order."""
+        if event_id not in self._ids:
+            self._ids.add(event_id)
+            self.order.append(event_id)
+
+    def remove(self, event_id: int):
+        """Removes the event from the order.
+
+        Takes O(n), events are expected to be removed rarely. Cursors of
+        players after the removed event shift by one event.
+        """
+        if event_id in self._ids and len(self.order) > 1:
+            self._ids.remove(event_id)
+            self.order.remove(event_id)
+
+    def shared_event_id(
+        self, players: List["Player"], attempts: int = 10
+    ) -> int:
+        """Returns an id of a random event for several players at once.
+
+        Tries to find an event none of the players guessed and which is not
+        their current event, but doesn't move their cursors.
+
+        Args:
+            players: Players to pick the event for.
+            attempts: A number of random events to try.
+        """
+        for _ in range(attempts):
+            event_id = random.choice(self.order)
+            if not any(
+                player.has_guessed(event_id)
+                or player.current_event == event_id
+                for player in players
+            ):
+                break
+        return event_id
+
+    def next_event_id(self, player: "Player") -> int:
+        """Returns an id of a not guessed event for the player.
+
+        The cursor stays on the returned event until the event is guessed,
+        so a surrendered or canceled event is offered again. If all events
+        are guessed resets player's guessed events and starts over.
+
+        Args:
+            player: A player instance for picking next event.
+
+        Returns:
+            An id of the next event for guessing.
+        """
+        size = len(self.order)
+        if player.event_cursor is None:
+            player.event_cursor = self._start_position(player)
+
+        position = player.event_cursor
+        for _ in range(size):
+            event_id = self.order[position % size]
+            if not player.has_guessed(event_id):
+                player.event_cursor = position % size
+                return event_id
+            position += 1
+
+        player.reset_guessed_events()
+        player.event_cursor = self._start_position(player)
+        return self.order[player.event_cursor]
@@ -0,0 +1,104 @@
+"""Expiry of idle game rounds.
+
+A player who starts a round with `/play` and never comes back keeps
+the round open. `TimerWheel` holds a deadline for every player in a round
+and `GuessGame` ends the rounds whose deadlines passed, see `ROUND_TTL`.
+
+The wheel is a ring of buckets, one per `tick` seconds. Scheduling appends
+the key to the bucket of its deadline and a tick empties one bucket, so
+both take constant time however many deadlines are pending. Rescheduled and
+cancelled keys are not searched for: their old entries are skipped when
+their bucket comes up.
+
+"""
+import math
+import time
+from typing import Dict, Hashable, List, Optional, Tuple
+
+
+class TimerWheel:
+    """Hashed timing wheel of deadlines.
+
+    Properties:
+        tick: Seconds covered by one bucket.
+        buckets: A ring of lists of `(key, deadline)` entries.
+        deadlines: A dictionary mapping from key to its current deadline.
+        stats: Counters of scheduled and expired keys.
+
+    """
+
+    tick: float
+    buckets: List[List[Tuple[Hashable, float]]]
+    deadlines: Dict[Hashable, float]
+    stats: Dict[str, int]
+
+    def __init__(self, tick: float, span: float, now: Optional[float] = None):
+        """Creates the wheel.
+
+        Args:
+            tick: Seconds covered by one bucket, the precision of expiry.
+            span: The usual time to a deadline, later deadlines go around
+                  the wheel more than once.
+            now: The current monotonic time.
+        """
+        self.tick = tick
+        self.buckets = [[] for _ in range(max(1, math.ceil(span / tick)) + 1)]
+        self.deadlines = {}
+        self.stats = dict.fromkeys(("scheduled", "expired"), 0)
+        now = time.monotonic() if now is None else now
+        # The number of the next tick to expire
+        self._next_tick = int(now // tick)
+
+    def __len__(self) -> int:
+        return len(self.deadlines)
+
+    def __contains__(self, key: Hashable) -> bool:
+        return key in self.deadlines
+
+    def _add(self, key: Hashable, deadline: float):
+        tick = max(int(deadline // self.tick), self._next_tick)
+        self.buckets[tick % len(self.buckets)].append((key, deadline))
+
+    def schedule(self, key: Hashable, deadline: float):
+        """Sets the deadline of the key replacing the previous one."""
+        self.deadlines[key] = deadline
+        self._add(key, deadline)
+        self.stats["scheduled"] += 1
+
+    def cancel(self, key: Hashable) -> bool:
+        """Removes the deadline of the key.
+
+        Returns:
+            Whether the key had a deadline.
+        """
+        return self.deadlines.pop(key, None) is not None
+
+    def advance(self, now: Optional[float] = None) -> List[Hashable]:
+        """Expires the buckets of the ticks passed since the last call.
+
+        Returns:
+            Keys whose deadlines passed, they are removed from the wheel.
+        """
+        now = time.monotonic() if now is None else now
+        last_tick = int(now // self.tick)
+        # After a pause longer than the wheel every bucket is looked through
+        # only once
+        self._next_tick = max(
+            self._next_tick, last_tick - len(self.buckets) + 1
+        )
+        expired = []
+        while self._next_tick <= last_tick:
+            index = self._next_tick % len(self.buckets)
+            entries, self.buckets[index] = self.buckets[index], []
+            self._next_tick += 1
+            for key, deadline in entries:
+                if self.deadlines.get(key) != deadline:
+                    continue
+                if deadline > now:
+                    # Goes around the wheel once more
+                    self._add(key, deadline)
+                else:
+                    del self.deadlines[key]
+                    expired.append(key)
+        self.stats["expired"] += len(expired)
+        return expired
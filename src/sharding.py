@@ -0,0 +1,288 @@
+"""Sharding of players across bot worker processes.
+
+The front process receives updates (with polling or the webhook server) and
+routes each update to a worker process by the id of the user who sent it,
+so all updates of a player are processed by the same worker and the
+player's state is cached by exactly one process. Messages of group chats
+are routed by the chat id instead, so the shared round of a chat is kept by
+one process. Handlers of group chats don't load players, score changes of
+the members of an ended round are passed to the workers of the players with
+`ShardQueues.send_scores`.
+
+Every worker has its own queue of updates. A worker which exited
+unexpectedly is started again by `ShardRouter.supervise` and continues from
+the same queue, so the queued updates are not lost. Workers stop at
+different times, score changes sent to a worker which has already stopped
+are returned by `ShardRouter.stop` to be saved by the front process.
+
+"""
+import asyncio
+import logging
+import multiprocessing
+import queue
+import signal
+from typing import Any, Callable, Dict, List, Optional
+
+from aiohttp import ClientError, ClientSession, ClientTimeout
+
+from webhook import UpdateHandler
+
+
+logger = logging.getLogger(__name__)
+
+# The key of items of workers queues with score changes of players, which
+# are passed along with raw updates
+SCORE_CHANGES = "score_changes"
+
+
+def get_user_id(update: Dict[str, Any]) -> Optional[int]:
+    """Returns an id of the user who sent the raw update if there is one.
+
+    Every update type (`message`, `callback_query`, etc.) contains an object
+    with the `from` user.
+    """
+    for value in update.values():
+        if isinstance(value, dict) and isinstance(value.get("from"), dict):
+            return value["from"].get("id")
+    return None
+
+
+def get_route_key(update: Dict[str, Any]) -> Optional[int]:
+    """Returns an id of the group chat the raw update was sent to, or of
+    the user who sent it."""
+    message = update.get("message")
+    if isinstance(message, dict):
+        chat = message.get("chat") or {}
+        if chat.get("type") in ("group", "supergroup"):
+            return chat.get("id")
+    return get_user_id(update)
+
+
+def shard_for(user_id: Optional[int], workers: int) -> int:
+    """Returns an index of the worker processing updates of the user."""
+    return (user_id or 0) % workers
+
+
+class ShardQueues:
+    """Queues of all workers as seen from one of them.
+
+    Properties:
+        index: The index of the worker.
+        queues: Updates queues of all workers.
+
+    """
+
+    index: int
+    queues: List[multiprocessing.Queue]
+
+    def __init__(self, index: int, queues: List[multiprocessing.Queue]):
+        self.index = index
+        self.queues = queues
+
+    @property
+    def updates(self) -> multiprocessing.Queue:
+        """The queue of the worker."""
+        return self.queues[self.index]
+
+    def owns(self, player_id: int) -> bool:
+        """Checks whether the player is processed by this worker."""
+        return shard_for(player_id, len(self.queues)) == self.index
+
+    def send_scores(self, scores: Dict[int, List[int]]):
+        """Puts score changes of players into queues of their workers with
+        one item per worker.
+
+        Args:
+            scores: A dictionary mapping from player id to the score change
+                    and the number of attempts.
+        """
+        shards: Dict[int, dict] = {}
+        for player_id, change in scores.items():
+            index = shard_for(player_id, len(self.queues))
+            shards.setdefault(index, {})[player_id] = change
+        for index, changes in shards.items():
+            self.queues[index].put({SCORE_CHANGES: changes})
+
+
+class ShardRouter:
+    """Starts worker processes and routes updates to them.
+
+    Properties:
+        workers: A number of worker processes.
+        target: A function run in a worker process with the worker index and
+                updates queues of all workers.
+        queues: Updates queues of the workers.
+        processes: Worker processes.
+
+    """
+
+    workers: int
+    target: Callable[[int, List[multiprocessing.Queue]], Any]
+    queues: List[multiprocessing.Queue]
+    processes: List[multiprocessing.Process]
+
+    def __init__(
+        self,
+        workers: int,
+        target: Callable[[int, List[multiprocessing.Queue]], Any],
+    ):
+        self.workers = workers
+        self.target = target
+        self._context = multiprocessing.get_context("spawn")
+        self.queues = [self._context.Queue() for _ in range(workers)]
+        self.processes = []
+        self._stopping = False
+
+    def _start_worker(self, index: int) -> multiprocessing.Process:
+        process = self._context.Process(
+            target=self.target,
+            args=(index, self.queues),
+            name=f"shard-{index}",
+        )
+        process.start()
+        return process
+
+    def start(self):
+        """Starts all worker processes."""
+        self.processes = [self._start_worker(i) for i in range(self.workers)]
+
+    def route(self, update: Dict[str, Any]):
+        """Puts the raw update into the queue of the user's or the group
+        chat's worker."""
+        index = shard_for(get_route_key(update), self.workers)
+        self.queues[index].put(update)
+
+    async def route_async(self, update: Dict[str, Any]):
+        """Coroutine version of `route` to use as an `UpdateHandler`."""
+        self.route(update)
+
+    async def supervise(self, interval: float = 1):
+        """Restarts workers which exited unexpectedly."""
+        while not self._stopping:
+            for index, process in enumerate(self.processes):
+                if not process.is_alive() and not self._stopping:
+                    logger.warning(
+                        "Worker %d exited with code %s, restarting.",
+                        index,
+                        process.exitcode,
+                    )
+                    self.processes[index] = self._start_worker(index)
+            await asyncio.sleep(interval)
+
+    async def stop(self, timeout: float = 8) -> List[Dict[str, Any]]:
+        """Stops workers after they process all queued updates.
+
+        Args:
+            timeout: Seconds to wait for the workers, the ones still running
+                     are terminated. Docker kills the container 10 seconds
+                     after `docker stop`.
+
+        Returns:
+            Items left in the queues after all workers exited, e.g. score
+            changes put by a worker after the other one had stopped.
+        """
+        self._stopping = True
+        for updates in self.queues:
+            updates.put(None)
+        loop = asyncio.get_running_loop()
+        await asyncio.gather(
+            *(
+                loop.run_in_executor(None, process.join, timeout)
+                for process in self.processes
+            )
+        )
+        for index, process in enumerate(self.processes):
+            if process.is_alive():
+                logger.warning(
+                    "Worker %d didn't stop in %ss, terminating.",
+                    index,
+                    timeout,
+                )
+                process.terminate()
+                await loop.run_in_executor(None, process.join)
+        return await loop.run_in_executor(None, self._drain)
+
+    def _drain(self) -> List[Dict[str, Any]]:
+        items = []
+        for updates in self.queues:
+            while True:
+                try:
+                    item = updates.get(True, 0.1)
+                except queue.Empty:
+                    break
+                # Sentinels of terminated workers
+                if item is not None:
+                    items.append(item)
+        return items
+
+
+async def consume(
+    updates: multiprocessing.Queue,
+    handle_update: UpdateHandler,
+    concurrency: int,
+):
+    """Processes updates from the worker queue until it is stopped.
+
+    The worker stops on `SIGTERM` or when it gets `None` from the queue.
+    `SIGINT` is ignored, the front process stops the workers itself.
+
+    Args:
+        updates: The worker queue of raw updates.
+        handle_update: A coroutine function processing a raw update.
+        concurrency: A number of concurrently processed updates.
+    """
+    loop = asyncio.get_running_loop()
+    stopped = asyncio.Event()
+    loop.add_signal_handler(signal.SIGTERM, stopped.set)
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+    semaphore = asyncio.Semaphore(concurrency)
+    tasks = set()
+
+    async def process(update: Dict[str, Any]):
+        try:
+            await handle_update(update)
+        except Exception:
+            logger.exception("Failed to process update %s.", update)
+        finally:
+            semaphore.release()
+
+    while not stopped.is_set():
+        try:
+            update = await loop.run_in_executor(None, updates.get, True, 0.5)
+        except queue.Empty:
+            continue
+        if update is None:
+            break
+        await semaphore.acquire()
+        task = asyncio.create_task(process(update))
+        tasks.add(task)
+        task.add_done_callback(tasks.discard)
+
+    await asyncio.gather(*tasks)
+
+
+async def poll_updates(
+    handle_update: UpdateHandler, token: str, timeout: int = 30
+):
+    """Receives raw updates with long polling of the Bot API `getUpdates`.
+
+    Unlike `Dispatcher.start_polling` updates are not parsed, the front
+    process only needs to route them to workers.
+    """
+    url = f"https://api.telegram.org/bot{token}/getUpdates"
+    offset = None
+    async with ClientSession(timeout=ClientTimeout(total=timeout + 10)) as s:
+        while True:
+            try:
+                async with s.get(
+                    url, params={"timeout": timeout, "offset": offset or 0}
+                ) as response:
+                    result = (await response.json())["result"]
+            except (ClientError, asyncio.TimeoutError, KeyError):
+                logger.exception("Failed to get updates, retrying.")
+                await asyncio.sleep(5)
+                continue
+            for update in result:
+                await handle_update(update)
+                offset = update["update_id"] + 1
@@ -0,0 +1,199 @@
+"""Telemetry of guesses and difficulty of events.
+
+Every guess, surrender and cancel of a round is appended to an in-memory
+ring buffer and a background task drains the buffer to the `Guesses`
+collection with batched inserts, so the handlers don't wait for the writes.
+When the buffer is full the oldest records are dropped.
+
+Aggregates of every event - the solve rate, the mean number of attempts
+and the mean error in years - are updated incrementally with each record
+and their increments are saved to the `EventStats` collection with every
+drain, so they survive restarts without scanning the guesses.
+
+"""
+import asyncio
+import logging
+import time
+from collections import deque
+from typing import Deque, Dict, Optional
+
+from pymongo.errors import BulkWriteError
+
+from dao import AsyncEventStatsDao, AsyncGuessDao
+from models import EventStats, GuessRecord
+
+
+logger = logging.getLogger(__name__)
+
+
+class Telemetry:
+    """Ring buffer of players actions drained to the database in batches.
+
+    Properties:
+        guesses_dao: An instance of `AsyncGuessDao` to insert records with.
+        stats_dao: An instance of `AsyncEventStatsDao` to save aggregates.
+        batch_size: A maximum number of records inserted at once, a drain
+                    is started when that many records are buffered.
+        flush_interval: Seconds between periodic drains.
+        buffer: Records not saved yet, the oldest go first.
+        events: A dictionary mapping from event id to its `EventStats`.
+        stats: Counters of recorded, saved and dropped records and failed
+               drains.
+
+    """
+
+    guesses_dao: AsyncGuessDao
+    stats_dao: AsyncEventStatsDao
+    batch_size: int
+    flush_interval: float
+    buffer: Deque[GuessRecord]
+    events: Dict[int, EventStats]
+    stats: Dict[str, int]
+
+    def __init__(
+        self,
+        guesses_dao: AsyncGuessDao,
+        stats_dao: AsyncEventStatsDao,
+        buffer_size: int = 100000,
+        batch_size: int = 1000,
+        flush_interval: float = 5,
+    ):
+        self.guesses_dao = guesses_dao
+        self.stats_dao = stats_dao
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.buffer = deque(maxlen=buffer_size)
+        self.events = {}
+        self.stats = dict.fromkeys(
+            ("recorded", "saved", "dropped", "errors"), 0
+        )
+        # Increments of the aggregates not saved yet
+        self._changes: Dict[int, EventStats] = {}
+        self._flush_requested = asyncio.Event()
+        self._flush_lock = asyncio.Lock()
+        self._task: Optional[asyncio.Task] = None
+
+    def record(
+        self,
+        player_id: int,
+        event_id: int,
+        action: str,
+        date: Optional[int] = None,
+        event_date: Optional[int] = None,
+    ):
+        """Records an action of the player in a round of the event.
+
+        Args:
+            player_id: Id of the player.
+            event_id: Id of the event of the round.
+            action: One of `models.GUESS_ACTIONS`.
+            date: The guessed year for a guess.
+            event_date: The date of the event for a guess.
+        """
+        error = abs(date - event_date) if action == "guess" else None
+        if len(self.buffer) == self.buffer.maxlen:
+            self.stats["dropped"] += 1
+        self.buffer.append(
+            GuessRecord(player_id, event_id, action, date, error, time.time())
+        )
+        for aggregates in (self.events, self._changes):
+            stats = aggregates.get(event_id)
+            if stats is None:
+                stats = aggregates[event_id] = EventStats()
+            stats.add(action, error)
+        self.stats["recorded"] += 1
+        if len(self.buffer) >= self.batch_size:
+            self._flush_requested.set()
+
+    def difficulty(self) -> Dict[int, float]:
+        """Returns a dictionary mapping from event id to its difficulty."""
+        return {
+            event_id: stats.difficulty
+            for event_id, stats in self.events.items()
+        }
+
+    async def load(self):
+        """Loads the saved aggregates of events adding them to the current
+        ones."""
+        saved = await self.stats_dao.all()
+        for event_id, stats in saved.items():
+            self.events.setdefault(event_id, EventStats()).merge(stats)
+
+    def _put_back(self, records):
+        """Returns records which failed to save to the buffer front as far
+        as there is room."""
+        room = self.buffer.maxlen - len(self.buffer)
+        kept = records[len(records) - room :] if room else []
+        self.buffer.extendleft(reversed(kept))
+        self.stats["dropped"] += len(records) - len(kept)
+
+    async def flush(self):
+        """Saves buffered records and the aggregates increments.
+
+        If a write fails the unsaved data is kept for the next drain.
+        """
+        async with self._flush_lock:
+            self._flush_requested.clear()
+            while self.buffer:
+                size = min(self.batch_size, len(self.buffer))
+                batch = [self.buffer.popleft() for _ in range(size)]
+                try:
+                    await self.guesses_dao.insert_many(batch)
+                except BulkWriteError as error:
+                    # The insert is unordered, the other records are saved
+                    failed = sorted(
+                        failed["index"]
+                        for failed in error.details["writeErrors"]
+                    )
+                    self._put_back([batch[index] for index in failed])
+                    self.stats["saved"] += size - len(failed)
+                    self.stats["errors"] += 1
+                    logger.exception(
+                        "Failed to save %d of %d guesses.", len(failed), size
+                    )
+                    return
+                except Exception:
+                    self._put_back(batch)
+                    self.stats["errors"] += 1
+                    logger.exception("Failed to save %d guesses.", size)
+                    return
+                self.stats["saved"] += size
+            if not self._changes:
+                return
+            changes, self._changes = self._changes, {}
+            try:
+                await self.stats_dao.add_many(changes)
+            except Exception:
+                for event_id, stats in changes.items():
+                    self._changes.setdefault(event_id, EventStats()).merge(
+                        stats
+                    )
+                self.stats["errors"] += 1
+                logger.exception("Failed to save stats of events.")
+
+    async def run(self):
+        """Drains the buffer in a loop."""
+        while True:
+            try:
+                await asyncio.wait_for(
+                    self._flush_requested.wait(), self.flush_interval
+                )
+            except asyncio.TimeoutError:
+                pass
+            await self.flush()
+
+    def start(self):
+        """Starts the background drain task."""
+        if self._task is None:
+            self._task = asyncio.create_task(self.run())
+
+    async def stop(self):
+        """Stops the background drain task and saves the buffered data."""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.flush()
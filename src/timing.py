@@ -0,0 +1,63 @@
+"""Middlewares observing handlers and Bot API calls in the metrics.
+
+They are kept apart from `metrics`, which the DAOs import, as importing
+`aiogram` takes most of the startup time of tools which don't talk to
+Telegram.
+
+"""
+import time
+from typing import Any, Awaitable, Callable, Dict
+
+from aiogram import BaseMiddleware
+from aiogram.client.session.middlewares.base import (
+    BaseRequestMiddleware,
+    NextRequestMiddlewareType,
+)
+from aiogram.methods import TelegramMethod
+from aiogram.types import TelegramObject
+
+from metrics import API_ERRORS, API_LATENCY, HANDLER_ERRORS, HANDLER_LATENCY
+
+
+class HandlerTimingMiddleware(BaseMiddleware):
+    """Observes the time of every handler in `HANDLER_LATENCY`.
+
+    Must be registered as an inner middleware, so the handler is known.
+    """
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any],
+    ) -> Any:
+        callback = getattr(data.get("handler"), "callback", None)
+        name = getattr(callback, "__name__", "unknown")
+        start = time.perf_counter()
+        try:
+            return await handler(event, data)
+        except Exception:
+            HANDLER_ERRORS.labels(name).inc()
+            raise
+        finally:
+            HANDLER_LATENCY.labels(name).observe(time.perf_counter() - start)
+
+
+class ApiTimingMiddleware(BaseRequestMiddleware):
+    """Observes the time of every Bot API call in `API_LATENCY`."""
+
+    async def __call__(
+        self,
+        make_request: NextRequestMiddlewareType,
+        bot,
+        method: TelegramMethod,
+    ):
+        name = type(method).__name__
+        start = time.perf_counter()
+        try:
+            return await make_request(bot, method)
+        except Exception:
+            API_ERRORS.labels(name).inc()
+            raise
+        finally:
+            API_LATENCY.labels(name).observe(time.perf_counter() - start)
@@ -0,0 +1,120 @@
+"""Webhook server receiving updates from Telegram.
+
+The server answers Telegram as soon as an update is put into the queue and
+processes updates in the background with a bounded pool of workers. If the
+queue is full the server answers with an error status, so Telegram retries
+the update later.
+
+An update can be sent to the server locally without Telegram, e.g.:
+
+    curl -X POST http://localhost:8080/webhook \\
+         -H "X-Telegram-Bot-Api-Secret-Token: <WEBHOOK_SECRET>" \\
+         -H "Content-Type: application/json" \\
+         -d @update.json
+
+"""
+import asyncio
+import hmac
+import json
+import logging
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+from aiohttp import web
+
+
+logger = logging.getLogger(__name__)
+
+SECRET_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+
+UpdateHandler = Callable[[Dict[str, Any]], Awaitable[Any]]
+
+
+class WebhookServer:
+    """An aiohttp application queueing updates for background workers.
+
+    Properties:
+        handle_update: A coroutine function processing a raw update.
+        path: A URL path to receive updates on.
+        secret: A secret token Telegram sends in the `SECRET_HEADER` header;
+                if empty the header is not checked.
+        workers: A number of concurrently processed updates.
+        queue: A queue of received but not processed updates.
+        app: The aiohttp application.
+
+    """
+
+    handle_update: UpdateHandler
+    path: str
+    secret: Optional[str]
+    workers: int
+    queue: asyncio.Queue
+    app: web.Application
+
+    def __init__(
+        self,
+        handle_update: UpdateHandler,
+        path: str,
+        secret: Optional[str] = None,
+        workers: int = 16,
+        queue_size: int = 1000,
+    ):
+        self.handle_update = handle_update
+        self.path = path
+        self.secret = secret
+        self.workers = workers
+        self.queue = asyncio.Queue(queue_size)
+        self._tasks: List[asyncio.Task] = []
+        self.app = web.Application()
+        self.app.router.add_post(path, self.receive_update)
+        self.app.on_startup.append(self._start_workers)
+        self.app.on_shutdown.append(self._stop_workers)
+
+    async def receive_update(self, request: web.Request) -> web.Response:
+        """Checks the secret token and puts the update into the queue."""
+        if self.secret and not hmac.compare_digest(
+            request.headers.get(SECRET_HEADER, ""), self.secret
+        ):
+            return web.Response(status=401)
+        try:
+            update = await request.json()
+        except json.JSONDecodeError:
+            return web.Response(status=400)
+        try:
+            self.queue.put_nowait(update)
+        except asyncio.QueueFull:
+            logger.warning("Updates queue is full, update is rejected.")
+            return web.Response(status=503)
+        return web.Response()
+
+    async def _work(self):
+        while True:
+            update = await self.queue.get()
+            try:
+                await self.handle_update(update)
+            except Exception:
+                logger.exception("Failed to process update %s.", update)
+            finally:
+                self.queue.task_done()
+
+    async def _start_workers(self, app: web.Application):
+        self._tasks = [
+            asyncio.create_task(self._work()) for _ in range(self.workers)
+        ]
+
+    async def _stop_workers(self, app: web.Application):
+        """Processes the queued updates and stops the workers."""
+        await self.queue.join()
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+
+    async def serve(self, host: str, port: int):
+        """Serves the application until the task is cancelled."""
+        runner = web.AppRunner(self.app)
+        await runner.setup()
+        await web.TCPSite(runner, host, port).start()
+        logger.info("Webhook server is listening on %s:%d.", host, port)
+        try:
+            await asyncio.Event().wait()
+        finally:
+            await runner.cleanup()
@@ -0,0 +1,38 @@
+import pytest
+
+import config
+
+
+@pytest.fixture
+def settings(monkeypatch):
+    """Resolves settings again on access, with the `.env` file ignored."""
+    monkeypatch.setattr(config, "_dotenv_loaded", True)
+    for name in config._SETTINGS:
+        if name in vars(config):
+            monkeypatch.delattr(config, name)
+    yield config
+    # Forget the values resolved by the test
+    for name in config._SETTINGS:
+        vars(config).pop(name, None)
+
+
+@pytest.mark.parametrize(
+    "name, value",
+    [
+        ("EVENTS_SOURCE", "File"),
+        ("BOT_MODE", "webhooks"),
+        ("ROUND_EXPIRY_ACTION", "surender"),
+        ("GUESSED_EVENTS_ENCODING", "bits"),
+    ],
+)
+def test_unknown_choice(settings, monkeypatch, name, value):
+    monkeypatch.setenv(name, value)
+    with pytest.raises(config.ImproperlyConfigured, match=repr(value)):
+        getattr(settings, name)
+
+
+def test_choice_and_default(settings, monkeypatch):
+    monkeypatch.setenv("EVENTS_SOURCE", "mongo")
+    monkeypatch.delenv("ROUND_EXPIRY_ACTION", raising=False)
+    assert settings.EVENTS_SOURCE == "mongo"
+    assert settings.ROUND_EXPIRY_ACTION == "cancel"
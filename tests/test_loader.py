@@ -0,0 +1,60 @@
+import json
+
+import pytest
+
+import loader
+
+EVENTS = [
+    {
+        "_id": event_id,
+        "_type": "date",
+        "event": f"Событие номер {event_id}",
+        "date": 1000 + event_id,
+        "description": f"Описание события {event_id}\nв две строки",
+        "image_path": None,
+    }
+    for event_id in range(1, 33)
+]
+
+
+@pytest.fixture(params=["\n", "\r\n"], ids=["lf", "crlf"])
+def newline(request):
+    return request.param
+
+
+def write(path, text: str, newline: str):
+    with open(path, "w", encoding="utf-8", newline="") as file:
+        file.write(text.replace("\n", newline))
+
+
+@pytest.mark.parametrize("chunk_size", [7, loader.CHUNK_SIZE])
+def test_lazy_descriptions_of_pretty_printed_array(
+    tmp_path, newline, chunk_size
+):
+    path = tmp_path / "events.json"
+    write(path, json.dumps(EVENTS, ensure_ascii=False, indent=4), newline)
+    records = list(loader.iter_records(str(path), chunk_size))
+    assert [record for _, _, record in records] == EVENTS
+
+    events = list(loader.iter_events(str(path), lazy_descriptions=True))
+    assert [event.description for event in events] == [None] * len(EVENTS)
+    assert [event.get_description() for event in events] == [
+        event["description"] for event in EVENTS
+    ]
+
+
+def test_lazy_descriptions_of_json_lines(tmp_path, newline):
+    path = tmp_path / "events.jsonl"
+    lines = [json.dumps(event, ensure_ascii=False) for event in EVENTS]
+    write(path, "\n".join(lines) + "\n", newline)
+    events = list(loader.iter_events(str(path), lazy_descriptions=True))
+    assert [event.get_description() for event in events] == [
+        event["description"] for event in EVENTS
+    ]
+
+
+def test_unterminated_array(tmp_path, newline):
+    path = tmp_path / "events.json"
+    write(path, json.dumps(EVENTS[:2], indent=4)[:-1], newline)
+    with pytest.raises(loader.InvalidEventError):
+        list(loader.iter_events(str(path)))